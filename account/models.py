@@ -1,5 +1,5 @@
 from django.db import models
-from utils.constants import user_default_avatarUrl
+from utils.utils_avatar import default_user_avatar
 
 # Create your models here.
 class User(models.Model):
@@ -8,7 +8,7 @@ class User(models.Model):
     # password: str，   长度不超过16，加密
     # email: str，长度不超过50
     # phoneNumber: str，长度不超过11
-    # avatarUrl：str，长度不超过100
+    # avatarUrl：str，头像地址 /avatars/<sha256>.<ext>，默认头像首次使用时写入存储
     # isDeleted: bool 是否注销
     id = models.BigAutoField(primary_key=True)
     userId = models.CharField(max_length=16, unique=True, db_index=True)
@@ -16,8 +16,26 @@ class User(models.Model):
     password = models.CharField(max_length=100)
     email = models.EmailField(max_length=50, null=True)
     phoneNumber = models.CharField(max_length=11, null=True)
-    avatarUrl = models.TextField(default=user_default_avatarUrl)
+    avatarUrl = models.TextField(default=default_user_avatar)
     isDeleted = models.BooleanField(default=False)
+    # 发给该用户的好友申请推送帧的版本号，只通过 bump_friend_request_version 原子递增
+    friendRequestVersion = models.PositiveBigIntegerField(default=0)
+
+    # 只通过 update() 原子更新的字段，整行 save() 时不回写，避免用过期的值覆盖并发写入
+    ATOMIC_FIELDS = ("friendRequestVersion",)
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.ATOMIC_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
+    @staticmethod
+    def bump_friend_request_version(userId: str) -> int:
+        User.objects.filter(userId=userId).update(friendRequestVersion=models.F("friendRequestVersion") + 1)
+        return User.objects.filter(userId=userId).values_list("friendRequestVersion", flat=True).get()
 
     def serialize(self):
         return {
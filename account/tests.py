@@ -1,6 +1,12 @@
+import base64
+import json
+import tempfile
+from unittest import mock
 from django.test import TestCase
 from .models import User
 from django.contrib.auth.hashers import make_password
+from datetime import datetime, timezone
+from utils import utils_jwt, utils_request, utils_require
 
 # Create your tests here.
 class AccountTests(TestCase):
@@ -158,3 +164,121 @@ class AccountTests(TestCase):
         self.assertEqual(response.json()['email'], '123456@123.com')
         self.assertEqual(response.json()['phoneNumber'], '12345678901')
     
+
+    # * Tests for avatar store
+    def test_default_avatar_is_served_by_hash(self):
+        with tempfile.TemporaryDirectory() as root, self.settings(AVATAR_ROOT=root):
+            user = User.objects.create(userId="Carol", userName="Carol", password="-")
+            self.assertRegex(user.avatarUrl, r'^/avatars/[0-9a-f]{64}\.jpg$')
+            self.assertEqual(user.avatarUrl, self.user.avatarUrl)
+
+            response = self.client.get(user.avatarUrl)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'image/jpeg')
+            self.assertIn('immutable', response['Cache-Control'])
+            self.assertEqual(b''.join(response.streaming_content)[:2], b'\xff\xd8')
+
+            response = self.client.get(user.avatarUrl, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(self.client.get('/avatars/' + '0' * 64 + '.jpg').status_code, 404)
+            self.assertEqual(self.client.get('/avatars/..%2Fdb.sqlite3').status_code, 404)
+
+            # 同一 AVATAR_ROOT 下再创建用户时不再解码、写入默认头像
+            with mock.patch("utils.utils_avatar.store_data_uri") as store:
+                self.assertEqual(User.objects.create(userId="Dave", userName="Dave", password="-").avatarUrl, user.avatarUrl)
+            store.assert_not_called()
+
+    def test_update_profile_stores_data_uri_avatar(self):
+        token = self.login_for_test(self.data)
+        content = b'\x89PNG\r\n\x1a\n' + b'\x00' * 16
+        dataUri = 'data:image/png;base64,' + base64.b64encode(content).decode()
+        with tempfile.TemporaryDirectory() as root, self.settings(AVATAR_ROOT=root):
+            response = self.client.post(f'/update_profile/{self.data["userId"]}/', HTTP_AUTHORIZATION=token, data={"password": self.data["password"], "newAvatarUrl": dataUri}, content_type=self.content_type)
+            self.assertEqual(response.status_code, 200)
+            avatarUrl = User.objects.get(userId=self.data["userId"]).avatarUrl
+            self.assertRegex(avatarUrl, r'^/avatars/[0-9a-f]{64}\.png$')
+            self.assertEqual(b''.join(self.client.get(avatarUrl).streaming_content), content)
+
+            response = self.client.post(f'/update_profile/{self.data["userId"]}/', HTTP_AUTHORIZATION=token, data={"password": self.data["password"], "newAvatarUrl": "data:image/png;base64,???"}, content_type=self.content_type)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(User.objects.get(userId=self.data["userId"]).avatarUrl, avatarUrl)
+
+    # * Tests for JWT verification
+    def test_verified_token_cache_skips_reverification(self):
+        utils_jwt.VERIFIED_TOKENS.clear()
+        token = utils_jwt.generate_jwt_token(self.data["userId"])
+        with mock.patch.object(utils_jwt, "verify_jwt_token", wraps=utils_jwt.verify_jwt_token) as verify:
+            for _ in range(3):
+                response = self.client.get(f'/profile/{self.data["userId"]}/', HTTP_AUTHORIZATION=token)
+                self.assertEqual(response.status_code, 200)
+            self.assertEqual(utils_jwt.check_jwt_token(token), {"userId": self.data["userId"]})
+        self.assertEqual(verify.call_count, 1)
+
+        # 被篡改的 token 不会命中缓存，也不会被写入
+        header, payload, signature = token.split(".")
+        self.assertIsNone(utils_jwt.check_jwt_token(f"{header}.{payload}.{signature[:-2]}AA"))
+        self.assertIsNone(utils_jwt.check_jwt_token("not-a-token"))
+        self.assertIsNone(utils_jwt.check_jwt_token(None))
+        self.assertEqual(len(utils_jwt.VERIFIED_TOKENS.entries), 1)
+
+    def test_verified_token_cache_is_bounded_and_expires(self):
+        cache = utils_jwt.VerifiedTokenCache(maxsize=2)
+        cache.put("a", {"userId": "a"}, exp=100)
+        cache.put("b", {"userId": "b"}, exp=100)
+        self.assertEqual(cache.get("a", now=0), {"userId": "a"})
+        cache.put("c", {"userId": "c"}, exp=100)
+        # 最近最少使用的 b 被淘汰
+        self.assertIsNone(cache.get("b", now=0))
+        self.assertEqual(cache.get("c", now=0), {"userId": "c"})
+        self.assertIsNone(cache.get("a", now=101))
+        self.assertNotIn("a", cache.entries)
+
+    def test_jwt_required_rejects_other_user(self):
+        token = utils_jwt.generate_jwt_token("Alice")
+        response = self.client.post(f'/update_profile/{self.data["userId"]}/', HTTP_AUTHORIZATION=token, data={"password": self.data["password"]}, content_type=self.content_type)
+        self.assertEqual(response.status_code, 401)
+
+    # * Tests for request parsing
+    def test_request_body_errors_return_400(self):
+        response = self.client.post(self.loginUrl, data={"userId": "Bob"}, content_type=self.content_type)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"code": -2, "info": "Missing or error type of [password]"})
+        response = self.client.post(self.loginUrl, data="{not json", content_type=self.content_type)
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(self.loginUrl, data="[1, 2]", content_type=self.content_type)
+        self.assertEqual(response.status_code, 400)
+
+    def test_request_body_parsed_once(self):
+        token = self.login_for_test(self.data)
+        with mock.patch.object(utils_require, "loads", wraps=utils_require.loads) as loads:
+            # jwt_required 与视图都读取请求体中的 userId
+            response = self.client.post('/delete/', HTTP_AUTHORIZATION=token, data=self.data, content_type=self.content_type)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(loads.call_count, 1)
+
+    def test_schema_converts_and_rejects_fields(self):
+        schema = utils_require.Schema(groupId="int", userId="string", memberIds="list")
+        self.assertEqual(schema.parse({"groupId": "3", "userId": "Bob", "memberIds": []}), (3, "Bob", []))
+        with self.assertRaises(utils_require.RequestError) as context:
+            schema.parse({"groupId": 3, "userId": "Bob", "memberIds": "Alice"})
+        self.assertEqual(context.exception.args, ("Missing or error type of [memberIds]", -2))
+
+    # * Tests for response encoding
+    def test_response_encoders_splice_raw_json(self):
+        fragment = utils_request.RawJSON(b'{"userId":"Bob","tags":[1,2]}')
+        data = {
+            "members": [fragment, fragment],
+            # 与占位符形状相同的用户内容不会被替换
+            "content": "rawjson:0000000000000000:0",
+            "time": datetime(2024, 1, 1, 8, 30, 15, 123456, tzinfo=timezone.utc),
+        }
+        for encoder in utils_request.ENCODERS:
+            with self.settings(RESPONSE_JSON_ENCODER=encoder):
+                self.assertEqual(json.loads(utils_request.dumps(data)), {
+                    "members": [{"userId": "Bob", "tags": [1, 2]}] * 2,
+                    "content": "rawjson:0000000000000000:0",
+                    "time": "2024-01-01T08:30:15.123Z",
+                })
+                response = utils_request.request_success({"name": "鲍勃"})
+                self.assertEqual(response["Content-Type"], "application/json")
+                self.assertEqual(json.loads(response.content), {"code": 0, "info": "Succeed", "name": "鲍勃"})
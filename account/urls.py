@@ -9,5 +9,6 @@ urlpatterns = [
     path('search/<str:userId>/', views.search_user, name='search'),
     path('', views.login, name='login'),
     path('profile/<str:userId>/', views.profile, name='profile'),
-    path('update_profile/<str:userId>/', views.update_profile, name='updata_profile')
+    path('update_profile/<str:userId>/', views.update_profile, name='updata_profile'),
+    path('avatars/<str:name>', views.avatar, name='avatar'),
 ]
\ No newline at end of file
@@ -1,21 +1,22 @@
 import re
-import json
-from django.http import HttpRequest
+from django.http import FileResponse, HttpRequest, HttpResponse
+from django.utils.http import parse_etags
 from django.contrib.auth.hashers import make_password,check_password
 from account.models import User
 from utils.utils_request import request_failed, request_success, BAD_METHOD
-from utils.utils_require import require
+from utils.utils_require import Schema, request_body
 from utils.utils_jwt import generate_jwt_token, jwt_required
+from utils.utils_avatar import find_avatar, normalize_avatar
+from friendship.friend_list import invalidate_friend_lists_containing
+
+LOGIN_SCHEMA = Schema(userId="string", password="string")
 
 def login(request:HttpRequest):
     if request.method != 'POST':
         return BAD_METHOD
     
-    body = json.loads(request.body.decode('utf-8'))
-    userId = require(body, "userId", "string",
-                     err_msg="Missing or error type of [userId]")
-    password = require(body, "password", "string",
-                    err_msg="Missing or error type of [password]")
+    body = request_body(request)
+    userId, password = LOGIN_SCHEMA.parse(body)
     
     try:
         user = User.objects.get(userId=userId, isDeleted=False)
@@ -29,17 +30,14 @@ def login(request:HttpRequest):
     return request_success(data=data)
 
 
+REGISTER_SCHEMA = Schema(userId="string", password="string", userName="string")
+
 def register(request:HttpRequest):
     if request.method != 'POST':
         return BAD_METHOD
     
-    body = json.loads(request.body.decode('utf-8'))
-    userId = require(body, "userId", "string",
-                    err_msg="Missing or error type of [userId]")
-    password = require(body, "password", "string",
-                    err_msg="Missing or error type of [password]")
-    userName = require(body, "userName", "string",
-                    err_msg="Missing or error type of [userName]")
+    body = request_body(request)
+    userId, password, userName = REGISTER_SCHEMA.parse(body)
     
     pattern1,pattern2 = r'^\w+$',r'^[\w\u4e00-\u9fa5]+$' 
     if len(userId) < 3 or len(userId) > 16 or not re.match(pattern1, userId):
@@ -57,16 +55,15 @@ def register(request:HttpRequest):
     return request_success(data={"url":"/login"})
 
 
+DELETE_SCHEMA = Schema(userId="string", password="string")
+
 @jwt_required
 def delete(request:HttpRequest):
     if request.method != 'POST':
         return BAD_METHOD
     
-    body = json.loads(request.body.decode('utf-8'))
-    userId = require(body, "userId", "string",
-                     err_msg="Missing or error type of [userId]")
-    password = require(body, "password", "string",
-                       err_msg="Missing or error type of [password]")
+    body = request_body(request)
+    userId, password = DELETE_SCHEMA.parse(body)
 
 
     try:
@@ -78,16 +75,18 @@ def delete(request:HttpRequest):
     
     user.isDeleted = True
     user.save()
+    invalidate_friend_lists_containing(userId)
     return request_success(data={"url":"/login"})
 
+SEARCH_USER_SCHEMA = Schema(searchId="string")
+
 @jwt_required
 def search_user(request:HttpRequest, userId:str):
     if request.method != 'POST':
         return BAD_METHOD
     
-    body = json.loads ( request.body.decode('utf-8'))
-    searchId = require(body,"searchId", "string",
-                     err_msg="Missing or error type of [searchId]")
+    body = request_body(request)
+    searchId = SEARCH_USER_SCHEMA.parse(body)[0]
 
     
     user_info = User.objects.filter(userId=searchId).values("userId", "userName", "avatarUrl","isDeleted").first()
@@ -114,15 +113,15 @@ def profile(request: HttpRequest, userId: str):
 
     return request_success(data=user_info)
 
+UPDATE_PROFILE_SCHEMA = Schema(password="string")
+
 @jwt_required
 def update_profile(request: HttpRequest, userId: str):
     if request.method != "POST":
         return BAD_METHOD
     
-    body = json.loads(request.body.decode("utf-8"))
-    password = require(
-        body, "password", "string", err_msg="Missing or error type of [password]"
-    )
+    body = request_body(request)
+    password = UPDATE_PROFILE_SCHEMA.parse(body)[0]
    
 
     try:
@@ -132,6 +131,13 @@ def update_profile(request: HttpRequest, userId: str):
     except User.DoesNotExist:
         return request_failed(-1, "用户不存在或已注销", 404)
     
+    if "newAvatarUrl" in body:
+        # data URI 转存为按内容哈希命名的文件，行中只保存地址
+        try:
+            body["newAvatarUrl"] = normalize_avatar(body["newAvatarUrl"])
+        except ValueError:
+            return request_failed(-2, "头像格式错误", 400)
+
     for (key, attr) in [("newName", "userName"), ("newEmail", "email"), ("newPhoneNumber", "phoneNumber"), ("newAvatarUrl", "avatarUrl")]:
         if key in body:
             setattr(user, attr, body[key])
@@ -139,5 +145,29 @@ def update_profile(request: HttpRequest, userId: str):
     if "newPassword" in body:
         user.password = make_password(body["newPassword"])
     user.save()
+    # 好友列表中带有昵称和头像
+    if "newName" in body or "newAvatarUrl" in body:
+        invalidate_friend_lists_containing(userId)
 
     return request_success(data={"url": f"/profile/{userId}"})
+
+
+# 头像内容由文件名中的哈希唯一确定，可以永久缓存；ETag 即哈希
+def avatar(request: HttpRequest, name: str):
+    if request.method != "GET":
+        return BAD_METHOD
+
+    found = find_avatar(name)
+    if found is None:
+        return request_failed(-1, "头像不存在", 404)
+    path, digest, contentType = found
+
+    etag = f'"{digest}"'
+    etags = parse_etags(request.headers.get("If-None-Match", ""))
+    if etag in etags or "*" in etags:
+        response = HttpResponse(status=304)
+    else:
+        response = FileResponse(open(path, "rb"), content_type=contentType)
+    response["ETag"] = etag
+    response["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response
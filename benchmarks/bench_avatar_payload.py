@@ -0,0 +1,74 @@
+"""Size and latency of GET /chat/conversations/ with inline vs stored avatars.
+
+Builds one group per size whose members all carry the default avatar as a
+base64 data URI (how rows looked before the avatar store), measures the
+response, then runs ``convert_avatars`` and measures again. The snapshot cache
+is cleared before every request so both sides serialize from the database.
+Needs the Redis server configured in ``CACHES``.
+
+    python -m benchmarks.bench_avatar_payload --sizes 10 100 500
+"""
+import argparse
+import tempfile
+from io import StringIO
+
+from benchmarks.common import measure, print_table, setup_django
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 500])
+    args = parser.parse_args()
+
+    setup_django()
+    from django.core.cache import cache
+    from django.core.management import call_command
+    from django.test import Client
+    from django.test.utils import override_settings
+    from account.models import User
+    from chat.models import Conversation, Membership
+    from utils.constants import group_default_avatarUrl, user_default_avatarUrl
+    from utils.utils_jwt import generate_jwt_token
+
+    client = Client()
+    token = generate_jwt_token("member_0")
+    rows = []
+    with tempfile.TemporaryDirectory() as root, override_settings(AVATAR_ROOT=root):
+        for size in args.sizes:
+            users = User.objects.bulk_create([
+                User(userId=f"member_{i}", userName=f"member {i}", password="-", avatarUrl=user_default_avatarUrl)
+                for i in range(size)
+            ], ignore_conflicts=True)
+            users = list(User.objects.filter(userId__in=[user.userId for user in users]))
+            User.objects.update(avatarUrl=user_default_avatarUrl)
+            conversation = Conversation.objects.create(
+                type="group_chat", host=users[0], groupName=f"group {size}", avatarUrl=group_default_avatarUrl,
+            )
+            conversation.members.set(users)
+            Membership.join(conversation.id, [user.id for user in users])
+            url = f"/chat/conversations/?userId=member_0&id={conversation.id}"
+
+            def request():
+                cache.clear()
+                return client.get(url, HTTP_AUTHORIZATION=token)
+
+            inlineBytes = len(request().content)
+            inlineMs = measure(request, repeat=10)
+            call_command("convert_avatars", stdout=StringIO())
+            storedBytes = len(request().content)
+            storedMs = measure(request, repeat=10)
+            rows.append((
+                size,
+                f"{inlineBytes / 1024:.1f}",
+                f"{storedBytes / 1024:.1f}",
+                f"{inlineMs:.2f}",
+                f"{storedMs:.2f}",
+            ))
+    cache.clear()
+
+    print("GET /chat/conversations/ for one group, response size in KiB and median latency in ms, cold snapshot cache")
+    print_table(["members", "data URI KiB", "stored KiB", "data URI ms", "stored ms"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Latency of GET /friends/myfriends/<userId>/ for users with many friends.
+
+Compares the old per-row ``Friendship.serialize()`` (one user query per
+friend) with the joined query on a cold cache, the cached list, and a
+conditional request answered with 304. The data URI column is the legacy
+response size when every friend still carried the 75 KB default avatar
+inline. Needs the Redis server configured in ``CACHES``.
+
+    python -m benchmarks.bench_friend_list --sizes 10 100 1000
+"""
+import argparse
+
+from benchmarks.common import measure, print_table, setup_django
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1_000])
+    args = parser.parse_args()
+
+    setup_django()
+    from django.core.cache import cache
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import CaptureQueriesContext
+    from account.models import User
+    from friendship.friend_list import invalidate_friend_lists
+    from friendship.models import Friendship
+    from utils.constants import user_default_avatarUrl
+    from utils.utils_jwt import generate_jwt_token
+    from utils.utils_request import request_success
+
+    User.objects.create(userId="alice", userName="alice", password="-")
+    client = Client()
+    token = generate_jwt_token("alice")
+    url = "/friends/myfriends/alice/"
+    rows = []
+    created = 0
+    for size in sorted(args.sizes):
+        User.objects.bulk_create([
+            User(userId=f"friend_{i}", userName=f"friend {i}", password="-", avatarUrl=f"/avatars/{i:064x}.jpg")
+            for i in range(created, size)
+        ])
+        Friendship.objects.bulk_create([
+            Friendship(userId="alice", friendId=f"friend_{i}", tag=f"tag {i}") for i in range(created, size)
+        ])
+        created = size
+
+        def legacy():
+            friendships = Friendship.objects.filter(userId="alice", status=True)
+            return request_success([friendship.serialize() for friendship in friendships])
+
+        def legacy_blobs():
+            # 头像转存之前，每个好友都带着 75 KB 的 data URI
+            User.objects.filter(userId__startswith="friend_").update(avatarUrl=user_default_avatarUrl)
+            try:
+                return len(legacy().content)
+            finally:
+                User.objects.filter(userId__startswith="friend_").update(avatarUrl="/avatars/0.jpg")
+
+        def cold():
+            invalidate_friend_lists(["alice"])
+            return client.get(url, HTTP_AUTHORIZATION=token)
+
+        def warm():
+            return client.get(url, HTTP_AUTHORIZATION=token)
+
+        etag = warm()["ETag"]
+
+        def not_modified():
+            return client.get(url, HTTP_AUTHORIZATION=token, HTTP_IF_NONE_MATCH=etag)
+
+        with CaptureQueriesContext(connection) as legacyQueries:
+            legacy()
+        with CaptureQueriesContext(connection) as coldQueries:
+            cold()
+        rows.append((
+            size,
+            len(legacyQueries),
+            len(coldQueries),
+            f"{legacy_blobs() / 1024:.0f}",
+            f"{len(warm().content) / 1024:.0f}",
+            f"{measure(legacy, repeat=5):.2f}",
+            f"{measure(cold, repeat=5):.2f}",
+            f"{measure(warm):.2f}",
+            f"{measure(not_modified):.2f}",
+        ))
+    cache.clear()
+
+    print("median latency in ms")
+    print_table(
+        ["friends", "legacy queries", "joined queries", "legacy KiB, data URI", "KiB", "legacy ms", "cold ms", "cached ms", "304 ms"],
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Latency of the friend-request inbox and of the add_friend throttle check.
+
+Compares the old inbox (the 30 newest ``FriendshipRequest`` rows, then one
+``User`` query per row in ``serialize``) with the joined, cursor-paged query
+behind GET /friends/myrequests/<userId>/, and the old throttle (``latest``
+query on the request table) with the Redis token bucket. Alice has N pending
+requests from N different users. Needs the Redis server configured in
+``CACHES``.
+
+    python -m benchmarks.bench_friend_requests --sizes 1000 10000
+"""
+import argparse
+
+from benchmarks.common import measure, print_table, setup_django
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000])
+    parser.add_argument("--limit", type=int, default=30)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.core.cache import cache
+    from account.models import User
+    from friendship.models import FriendshipRequest
+    from utils.utils_throttle import take_token
+
+    cache.clear()
+    rows = []
+    created = 0
+    for size in sorted(args.sizes):
+        User.objects.bulk_create([
+            User(userId=f"u{i}", userName=f"u{i}", password="-", avatarUrl=f"/avatars/{i:064x}.png")
+            for i in range(created, size)
+        ])
+        FriendshipRequest.objects.bulk_create([
+            FriendshipRequest(senderId=f"u{i}", receiverId="alice", message=f"hello {i}", sendTime=i)
+            for i in range(created, size)
+        ])
+        created = size
+
+        def legacy_inbox():
+            requests = FriendshipRequest.objects.filter(receiverId="alice").order_by("-sendTime")[:args.limit]
+            return [request.serialize() for request in requests]
+
+        def joined_inbox():
+            requests = FriendshipRequest.with_sender(FriendshipRequest.objects.filter(receiverId="alice")).order_by("-id")
+            return [request.serialize() for request in requests[:args.limit + 1]]
+
+        def legacy_throttle():
+            return FriendshipRequest.objects.filter(senderId=f"u{size // 2}", receiverId="alice").latest("sendTime")
+
+        def token_bucket():
+            return take_token(f"friend_request:u{size // 2}:alice", 1, 10)
+
+        rows.append((
+            size,
+            f"{measure(legacy_inbox):.2f}",
+            f"{measure(joined_inbox):.2f}",
+            f"{measure(legacy_throttle, repeat=200, warmup=5):.3f}",
+            f"{measure(token_bucket, repeat=200, warmup=5):.3f}",
+        ))
+    cache.clear()
+
+    print(f"median latency in ms, inbox page size {args.limit}")
+    print_table(["requests", "inbox N+1", "inbox joined", "throttle latest()", "token bucket"], rows)
+
+
+if __name__ == "__main__":
+    main()
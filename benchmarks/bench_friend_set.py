@@ -0,0 +1,63 @@
+"""Latency of checking whether two users are friends.
+
+Compares the old ``Friendship`` ``exists()`` query with ``is_friend``, which
+answers from the Redis set ``friends:{userId}``, once warm and when the set
+has to be rebuilt from the database. Alice has N friends and the table also
+holds N rows between other users. Needs the Redis server configured in
+``CACHES``.
+
+    python -m benchmarks.bench_friend_set --sizes 1000 10000
+"""
+import argparse
+
+from benchmarks.common import measure, print_table, setup_django
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000])
+    args = parser.parse_args()
+
+    setup_django()
+    from django.core.cache import cache
+    from django_redis import get_redis_connection
+    from friendship.friend_set import is_friend
+    from friendship.models import Friendship
+
+    cache.clear()
+    connection = get_redis_connection("default")
+    rows = []
+    created = 0
+    for size in sorted(args.sizes):
+        Friendship.objects.bulk_create(
+            [Friendship(userId="alice", friendId=f"u{i}") for i in range(created, size)]
+            + [Friendship(userId=f"u{i}", friendId=f"v{i}") for i in range(created, size)]
+        )
+        created = size
+        friendId = f"u{size // 2}"
+
+        def legacy():
+            return Friendship.objects.filter(userId="alice", friendId=friendId, status=True).exists()
+
+        def warm():
+            return is_friend("alice", friendId)
+
+        def rebuild():
+            connection.delete("friends:alice")
+            return is_friend("alice", friendId)
+
+        rows.append((
+            size,
+            f"{measure(legacy, repeat=200, warmup=5):.3f}",
+            f"{measure(warm, repeat=200, warmup=5):.3f}",
+            f"{measure(rebuild, repeat=10, warmup=1):.2f}",
+            connection.scard("friends:alice") - 1,
+        ))
+    cache.clear()
+
+    print("median latency in ms to check whether u<N/2> is alice's friend")
+    print_table(["friends", "exists() query", "is_friend warm", "is_friend rebuild", "set size"], rows)
+
+
+if __name__ == "__main__":
+    main()
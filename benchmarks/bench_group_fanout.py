@@ -0,0 +1,59 @@
+"""Cost of pushing one conversation event to every member's connection.
+
+Compares the old fan-out (one ``group_send`` per member's user group) with a
+single ``group_send`` to the conversation group that every member's
+connection has joined. Uses the channel layer from settings, so the Redis
+server configured in ``CHANNEL_LAYERS`` must be running.
+
+    python -m benchmarks.bench_group_fanout --sizes 10 100 1000
+"""
+import argparse
+
+from benchmarks.common import measure, print_table, setup_django
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1_000])
+    args = parser.parse_args()
+
+    setup_django()
+    from asgiref.sync import async_to_sync
+    from channels.layers import get_channel_layer
+    from utils.utils_channel import conversation_group
+
+    channelLayer = get_channel_layer()
+    rows = []
+    for size in args.sizes:
+        userGroups = [f"bench_user_{size}_{i}" for i in range(size)]
+        conversationGroup = conversation_group(f"bench_{size}")
+
+        async def connect():
+            # 每个成员一个在线连接，同时加入自己的用户组和会话组
+            for userGroup in userGroups:
+                channelName = await channelLayer.new_channel()
+                await channelLayer.group_add(userGroup, channelName)
+                await channelLayer.group_add(conversationGroup, channelName)
+
+        async def per_member():
+            for userGroup in userGroups:
+                await channelLayer.group_send(userGroup, {"type": "notify"})
+
+        async def per_conversation():
+            await channelLayer.group_send(conversationGroup, {"type": "notify"})
+
+        async_to_sync(connect)()
+        # 每个连接最多累积 2 x (warmup + repeat) 条事件，低于默认的 capacity=100
+        rows.append((
+            size,
+            f"{measure(async_to_sync(per_member)):.2f}",
+            f"{measure(async_to_sync(per_conversation)):.2f}",
+        ))
+        async_to_sync(channelLayer.flush)()
+
+    print("median latency in ms to push one event to all members")
+    print_table(["members", "per-member group_send", "conversation group_send"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Latency of building the conversation list for a user with many conversations.
+
+Compares the old sequence (get_conversation_ids, then get_conversation for
+every id with a cold cache, then one get_unread_count per conversation)
+against the first page of GET /chat/inbox/. Needs the Redis server
+configured in ``CACHES``.
+
+    python -m benchmarks.bench_inbox --sizes 100 1000 5000
+"""
+import argparse
+from datetime import datetime, timedelta, timezone
+
+from benchmarks.common import measure, print_table, setup_django
+
+
+def populate(alice, bob, start, stop, origin):
+    from chat.models import Conversation, Membership, Message
+
+    for i in range(start, stop):
+        sendTime = origin + timedelta(seconds=i)
+        conversation = Conversation.objects.create(type="group_chat", host=bob, groupName=f"group {i}")
+        conversation.members.set([alice, bob])
+        Membership.join(conversation.id, [alice.id, bob.id])
+        message = Message.objects.create(
+            conversation=conversation, sender=bob, content=f"message {i}", seq=1,
+            sendTime=sendTime, updateTime=sendTime,
+        )
+        Conversation.objects.filter(id=conversation.id).update(lastSeq=1, **Conversation.summary_of(message))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1_000, 5_000])
+    parser.add_argument("--limit", type=int, default=50)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.core.cache import cache
+    from django.test import Client
+    from account.models import User
+    from utils.utils_jwt import generate_jwt_token
+
+    alice = User.objects.create(userId="alice", userName="alice", password="-")
+    bob = User.objects.create(userId="bob", userName="bob", password="-")
+    origin = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+    client = Client()
+    token = generate_jwt_token("alice")
+    rows = []
+    created = 0
+    for size in sorted(args.sizes):
+        populate(alice, bob, created, size, origin)
+        created = size
+
+        def legacy():
+            cache.delete("conversations_alice")
+            ids = client.get("/chat/get_conversation_ids/?userId=alice", HTTP_AUTHORIZATION=token).json()["conversationIds"]
+            # 超过 DATA_UPLOAD_MAX_NUMBER_FIELDS 时请求会被拒绝，按 500 个 id 分批
+            for start in range(0, len(ids), 500):
+                query = "&".join(f"id={conversationId}" for conversationId in ids[start:start + 500])
+                client.get(f"/chat/conversations/?userId=alice&{query}", HTTP_AUTHORIZATION=token)
+            for conversationId in ids:
+                client.get(f"/chat/get_unread_count/?userId=alice&conversationId={conversationId}", HTTP_AUTHORIZATION=token)
+
+        def inbox():
+            client.get(f"/chat/inbox/?userId=alice&limit={args.limit}", HTTP_AUTHORIZATION=token)
+
+        rows.append((
+            size,
+            f"{measure(legacy, repeat=3, warmup=1):.2f}",
+            f"{measure(inbox):.2f}",
+        ))
+    cache.clear()
+
+    print(f"median latency in ms, inbox page size {args.limit}")
+    print_table(["conversations", "ids + conversations + N unread", "inbox first page"], rows)
+
+
+if __name__ == "__main__":
+    main()
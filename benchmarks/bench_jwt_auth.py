@@ -0,0 +1,80 @@
+"""Per-request cost of authenticating a JWT-protected POST view.
+
+Compares the old ``jwt_required`` path (full token verification, a call to
+``inspect.signature`` and a second ``json.loads`` of the body on every
+request) with ``JwtMiddleware`` plus the current decorator, where repeated
+tokens are served from the verified-token LRU. Only authentication is
+measured: the wrapped view returns immediately.
+
+    python -m benchmarks.bench_jwt_auth --sizes 1 100 20000
+"""
+import argparse
+import inspect
+import json
+
+from benchmarks.common import measure, print_table, setup_django
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 100, 20_000],
+                        help="distinct tokens cycled through; above the LRU size every lookup misses")
+    parser.add_argument("--requests", type=int, default=20_000)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.http import HttpResponse
+    from django.test import RequestFactory
+    from utils import utils_jwt
+    from utils.utils_require import require
+
+    def view(request):
+        return HttpResponse()
+
+    def legacy_jwt_required(f):
+        def decorated_function(request, *args, **kwargs):
+            verified = utils_jwt.verify_jwt_token(request.headers.get("Authorization"))
+            payload = verified[0] if verified else None
+            body = json.loads(request.body.decode("utf-8"))
+            signature = inspect.signature(f)
+            if "userId" in signature.parameters:
+                userId = kwargs.get("userId")
+            else:
+                userId = require(body, "userId")
+            if payload is None or payload["userId"] != userId:
+                raise AssertionError("authentication failed")
+            return f(request, *args, **kwargs)
+        return decorated_function
+
+    legacy = legacy_jwt_required(view)
+    current = utils_jwt.JwtMiddleware(utils_jwt.jwt_required(view))
+
+    factory = RequestFactory()
+    rows = []
+    for size in args.sizes:
+        requests = []
+        for i in range(size):
+            userId = f"user_{i}"
+            requests.append(factory.post(
+                "/chat/messages/", data={"userId": userId, "conversationId": 1, "content": "hi"},
+                content_type="application/json", HTTP_AUTHORIZATION=utils_jwt.generate_jwt_token(userId),
+            ))
+        batch = [requests[i % size] for i in range(args.requests)]
+
+        def run(handler):
+            def fn():
+                for request in batch:
+                    handler(request)
+            return fn
+
+        utils_jwt.VERIFIED_TOKENS.clear()
+        legacyUs = measure(run(legacy), repeat=5, warmup=1) * 1_000 / args.requests
+        currentUs = measure(run(current), repeat=5, warmup=1) * 1_000 / args.requests
+        rows.append((size, f"{legacyUs:.2f}", f"{currentUs:.2f}", f"{legacyUs / currentUs:.1f}x"))
+
+    print(f"median auth overhead in microseconds per request over {args.requests} requests")
+    print_table(["distinct tokens", "legacy jwt_required", "middleware + LRU", "speedup"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Latency of one GET /chat/messages/ poll as the message table grows.
+
+Compares the old three-query page (count + exists + slice on ``updateTime``)
+against the keyset page on ``(updateTime, id)`` that the view now runs.
+
+    python -m benchmarks.bench_message_pagination --sizes 1000 10000 100000
+"""
+import argparse
+from datetime import datetime, timedelta, timezone
+
+from benchmarks.common import measure, print_table, setup_django
+
+
+def populate(conversation, sender, members, start, stop, origin):
+    from chat.models import Message
+
+    # 每 4 条消息共用同一毫秒，模拟高并发下的时间戳碰撞
+    messages = Message.objects.bulk_create([
+        Message(
+            conversation=conversation,
+            sender=sender,
+            content=f"message {i}",
+            seq=i + 1,
+            sendTime=origin + timedelta(milliseconds=i // 4),
+            updateTime=origin + timedelta(milliseconds=i // 4),
+        )
+        for i in range(start, stop)
+    ], batch_size=2_000)
+    # 旧查询依赖的逐条接收者记录，仅用于复现旧版本的分页查询
+    Receiver = Message.receivers.through
+    Receiver.objects.bulk_create([
+        Receiver(message_id=message.id, user_id=member.id)
+        for message in messages for member in members
+    ], batch_size=5_000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--limit", type=int, default=100)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.db.models import Q
+    from django.test import Client
+    from account.models import User
+    from chat.models import Conversation, Membership, Message
+    from utils.utils_cursor import encode_cursor
+    from utils.utils_jwt import generate_jwt_token
+    from utils.utils_time import datetime_to_micros
+
+    alice = User.objects.create(userId="alice", userName="alice", password="-")
+    bob = User.objects.create(userId="bob", userName="bob", password="-")
+    conversation = Conversation.objects.create(type="private_chat")
+    conversation.members.set([alice, bob])
+    Membership.join(conversation.id, [alice.id, bob.id])
+    origin = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+    client = Client()
+    token = generate_jwt_token("alice")
+    limit = args.limit
+    rows = []
+    created = 0
+    for size in sorted(args.sizes):
+        populate(conversation, bob, [alice, bob], created, size, origin)
+        created = size
+
+        # 轮询位置：倒数第 limit 条消息之后
+        anchor = Message.objects.order_by("updateTime", "id")[size - limit]
+        afterDatetime = anchor.updateTime + timedelta(milliseconds=1)
+
+        def legacy_page():
+            query = Message.objects.filter(updateTime__gte=afterDatetime).order_by("updateTime")
+            if query.count() == 0:
+                return []
+            query = query.filter(receivers__userId="alice").exclude(deleteUsers__userId="alice")
+            if not query.exists():
+                return []
+            return list(query[: limit + 1])
+
+        def keyset_page():
+            query = Message.objects.order_by("updateTime", "id").filter(
+                updateTime__gte=anchor.updateTime
+            ).filter(
+                Q(updateTime__gt=anchor.updateTime) | Q(updateTime=anchor.updateTime, id__gt=anchor.id)
+            ).filter(Message.visible_to("alice"))
+            return list(query[: limit + 1])
+
+        cursor = encode_cursor(datetime_to_micros(anchor.updateTime), anchor.id)
+
+        def view_page():
+            client.get(f"/chat/messages/?userId=alice&cursor={cursor}&limit={limit}", HTTP_AUTHORIZATION=token)
+
+        rows.append((
+            size,
+            f"{measure(legacy_page):.2f}",
+            f"{measure(keyset_page):.2f}",
+            f"{measure(view_page, repeat=10):.2f}",
+        ))
+
+    print(f"median latency in ms, page size {limit}")
+    print_table(["messages", "legacy 3-query", "keyset query", "keyset view"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Latency of searching chat history as it grows.
+
+Compares a ``content__icontains`` scan over the messages visible to the
+caller with ``chat.search.search_messages``, which matches through the FTS5
+trigram index kept in sync by triggers. The history is one group chat
+between alice and bob. Only 20 messages, all in the first batch, contain
+the searched word, so the hit count stays fixed while the history grows.
+Inserting the history also exercises the insert trigger.
+
+    python -m benchmarks.bench_message_search --sizes 10000 100000 1000000
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timezone
+
+from benchmarks.common import measure, print_table, setup_django
+
+WORDS = "hello world chat group friend message today tomorrow meeting lunch dinner project deadline review".split()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    args = parser.parse_args()
+
+    setup_django()
+    from account.models import User
+    from chat.models import Conversation, Membership, Message
+    from chat.search import search_messages
+
+    alice = User.objects.create(userId="alice", userName="alice", password="-", avatarUrl="")
+    bob = User.objects.create(userId="bob", userName="bob", password="-", avatarUrl="")
+    conversation = Conversation.objects.create(type="group_chat", host=alice, groupName="bench")
+    conversation.members.set([alice, bob])
+    Membership.join(conversation.id, [alice.id, bob.id])
+
+    # 匹配的 20 条消息都在最早的一段历史中，之后只增加不匹配的消息
+    smallest = min(args.sizes)
+    marked = set(range(0, smallest, smallest // 20))
+    generator = random.Random(0)
+    now = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    rows = []
+    created = 0
+    for size in sorted(args.sizes):
+        start = time.perf_counter()
+        for first in range(created, size, 10_000):
+            Message.objects.bulk_create([
+                Message(
+                    conversation=conversation, sender=bob, seq=seq + 1, sendTime=now, updateTime=now,
+                    content=" ".join(generator.choices(WORDS, k=8)) + (" zebracorn" if seq in marked else ""),
+                )
+                for seq in range(first, min(first + 10_000, size))
+            ])
+        insert = (time.perf_counter() - start) * 1_000 / max(size - created, 1)
+        created = size
+
+        def scan():
+            return list(Message.objects.filter(Message.visible_to("alice"), content__icontains="zebracorn").order_by("-id")[:21])
+
+        def indexed():
+            return search_messages("alice", "zebracorn", limit=20)
+
+        rows.append((
+            size,
+            len(scan()),
+            len(indexed()[0]),
+            f"{measure(scan, repeat=5, warmup=1):.2f}",
+            f"{measure(indexed):.2f}",
+            f"{insert * 1_000:.1f}",
+        ))
+
+    print("median latency in ms to find the 20 messages containing a word")
+    print_table(["messages", "scan hits", "fts hits", "icontains scan", "fts search", "insert µs/message"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Latency of GET /chat/messages/ when only part of the table is visible.
+
+Alice is in one conversation. The rest of the traffic is between bob and
+carol. ``--visible`` sets the fraction of all messages that belong to
+alice's conversation. The old plan walked the global ``(updateTime, id)``
+index and ran the visibility EXISTS on every row it passed, including
+other users' traffic. The current plan, ``Message.page_for``, restricts the query
+to alice's Membership conversations and range-scans
+``(conversation, updateTime, id)`` up to one page per conversation.
+The old index is created here only to reproduce the old plan. Both a tail
+poll (cursor one page before the end) and a first page without a cursor
+are timed.
+
+    python -m benchmarks.bench_message_visibility --size 100000 --visible 1 0.1 0.01
+"""
+import argparse
+from datetime import datetime, timedelta, timezone
+
+from benchmarks.common import measure, print_table, setup_django
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=100_000)
+    parser.add_argument("--visible", type=float, nargs="+", default=[1, 0.1, 0.01, 0.001])
+    parser.add_argument("--limit", type=int, default=100)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.db import connection
+    from django.db.models import Q
+    from account.models import User
+    from chat.models import Conversation, Membership, Message
+
+    with connection.cursor() as cursor:
+        cursor.execute('CREATE INDEX bench_message_update_id_idx ON message ("updateTime", id)')
+
+    users = {name: User.objects.create(userId=name, userName=name, password="-") for name in ["alice", "bob", "carol"]}
+    origin = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    limit = args.limit
+    rows = []
+    for fraction in args.visible:
+        Message.objects.all().delete()
+        Conversation.objects.all().delete()
+        mine = Conversation.objects.create(type="private_chat")
+        mine.members.set([users["alice"], users["bob"]])
+        Membership.join(mine.id, [users["alice"].id, users["bob"].id])
+        other = Conversation.objects.create(type="private_chat")
+        other.members.set([users["bob"], users["carol"]])
+        Membership.join(other.id, [users["bob"].id, users["carol"].id])
+
+        # 可见消息均匀分布在整段时间中
+        step = round(1 / fraction)
+        seqs = {mine.id: 0, other.id: 0}
+        messages = []
+        for i in range(args.size):
+            conversation = mine if i % step == 0 else other
+            seqs[conversation.id] += 1
+            time = origin + timedelta(milliseconds=i)
+            messages.append(Message(
+                conversation=conversation, sender=users["bob"], content=f"message {i}",
+                seq=seqs[conversation.id], sendTime=time, updateTime=time,
+            ))
+        Message.objects.bulk_create(messages, batch_size=5_000)
+        visible = seqs[mine.id]
+        anchor = Message.objects.filter(conversation=mine).order_by("updateTime", "id")[max(visible - limit, 0)]
+
+        tail = Q(updateTime__gte=anchor.updateTime) & (
+            Q(updateTime__gt=anchor.updateTime) | Q(updateTime=anchor.updateTime, id__gt=anchor.id)
+        )
+        first = Q(updateTime__gte=origin)
+
+        def global_scan(after):
+            return [m.id for m in Message.objects.filter(after).filter(Message.visible_to("alice")).order_by("updateTime", "id")[: limit + 1]]
+
+        def by_membership(after):
+            conversationIds = Membership.objects.filter(user__userId="alice").values("conversation_id")
+            return [m.id for m in Message.page_for("alice", conversationIds, after, limit)]
+
+        assert global_scan(tail) == by_membership(tail) and global_scan(first) == by_membership(first)
+        rows.append((
+            f"{fraction:.1%}",
+            visible,
+            f"{measure(lambda: global_scan(tail), repeat=5, warmup=1):.2f}",
+            f"{measure(lambda: by_membership(tail), repeat=5, warmup=1):.2f}",
+            f"{measure(lambda: global_scan(first), repeat=5, warmup=1):.2f}",
+            f"{measure(lambda: by_membership(first), repeat=5, warmup=1):.2f}",
+        ))
+
+    print(f"median latency in ms, {args.size} messages, page size {limit}")
+    print_table(
+        ["visible", "alice's messages", "tail: global index", "tail: membership", "first: global index", "first: membership"],
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Latency of finding the private conversation between two users.
+
+Compares the old grouped join over the membership table
+(``members__in`` + ``Count('members')``) with ``Conversation.private_between``,
+which looks up the unique ``pairKey`` index, as the number of private
+conversations grows. Alice has one private chat with everyone else.
+
+    python -m benchmarks.bench_private_lookup --sizes 1000 10000 50000
+"""
+import argparse
+
+from benchmarks.common import measure, print_table, setup_django
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 50_000])
+    args = parser.parse_args()
+
+    setup_django()
+    from django.db.models import Count
+    from account.models import User
+    from chat.models import Conversation
+
+    alice = User.objects.create(userId="alice", userName="alice", password="-")
+    Members = Conversation.members.through
+    rows = []
+    created = 0
+    for size in sorted(args.sizes):
+        users = User.objects.bulk_create([
+            User(userId=f"u{i}", userName=f"u{i}", password="-", avatarUrl="") for i in range(created, size)
+        ])
+        conversations = Conversation.objects.bulk_create([
+            Conversation(type="private_chat", pairKey=Conversation.pair_key("alice", user.userId)) for user in users
+        ])
+        Members.objects.bulk_create([
+            Members(conversation_id=conversation.id, user_id=userId)
+            for conversation, user in zip(conversations, users) for userId in (alice.id, user.id)
+        ])
+        created = size
+        friendId = f"u{size // 2}"
+
+        def legacy():
+            userIds = User.objects.filter(userId__in=["alice", friendId]).values_list("id", flat=True)
+            return Conversation.objects.filter(type="private_chat", members__in=userIds).annotate(
+                num_members=Count("members")
+            ).filter(num_members=2).first()
+
+        def pair_key():
+            return Conversation.private_between("alice", friendId)
+
+        rows.append((
+            size,
+            legacy().pairKey,
+            pair_key().pairKey,
+            f"{measure(legacy, repeat=5, warmup=1):.2f}",
+            f"{measure(pair_key):.3f}",
+        ))
+
+    print("median latency in ms to find alice's private chat with u<N/2>")
+    print_table(["private chats", "legacy found", "pairKey found", "members__in + Count", "pairKey"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Cost of decoding and validating typical JSON request bodies.
+
+Compares the old path, where ``jwt_required`` and the view each ran
+``json.loads(request.body.decode())`` and the view then called ``require``
+field by field, with ``request_body`` (decoded once, with orjson when it is
+installed) plus a compiled ``Schema``. Payloads mirror real requests:
+sending a message, creating a group and inviting N members.
+
+    python -m benchmarks.bench_request_parsing --sizes 10 100 1000
+"""
+import argparse
+import gc
+import json
+import statistics
+import time
+
+from benchmarks.common import print_table, setup_django
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1_000],
+                        help="number of member ids in the invite payload")
+    parser.add_argument("--requests", type=int, default=10_000)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.test import RequestFactory
+    from utils import utils_require
+    from utils.utils_require import Schema, request_body, require
+
+    factory = RequestFactory()
+    sendMessage = Schema(conversationId="int", userId="string", content="string")
+    inviteMember = Schema(opId="string", groupId="int", memberIds="list")
+
+    def legacy_send(request):
+        json.loads(request.body.decode("utf-8"))
+        body = json.loads(request.body.decode("utf-8"))
+        require(body, "conversationId", "int")
+        require(body, "userId", "string")
+        require(body, "content", "string")
+
+    def current_send(request):
+        request_body(request)
+        sendMessage.parse(request_body(request))
+
+    def legacy_invite(request):
+        json.loads(request.body.decode("utf-8"))
+        body = json.loads(request.body.decode("utf-8"))
+        require(body, "opId", "string")
+        require(body, "groupId", "int")
+        require(body, "memberIds", "list")
+
+    def current_invite(request):
+        request_body(request)
+        inviteMember.parse(request_body(request))
+
+    def per_request_us(handler, payload, count, repeat=5):
+        # 每个请求都是新的 request 对象，request_body 的缓存不跨请求生效；构造请求不计入耗时
+        raw = json.dumps(payload)
+        samples = []
+        for _ in range(repeat + 1):
+            requests = [factory.generic("POST", "/", raw, content_type="application/json") for _ in range(count)]
+            for request in requests:
+                request.body
+            # 解析结果缓存在 request 上会一直存活，关闭 GC 以免回收扫描计入耗时（与 timeit 相同）
+            gc.disable()
+            start = time.perf_counter()
+            for request in requests:
+                handler(request)
+            samples.append((time.perf_counter() - start) * 1_000_000 / count)
+            gc.enable()
+        return statistics.median(samples[1:])
+
+    cases = [("send_message", legacy_send, current_send, {
+        "conversationId": 1, "userId": "alice", "content": "你好，" * 40, "replyId": None,
+    })]
+    for size in args.sizes:
+        cases.append((f"invite_member x{size}", legacy_invite, current_invite, {
+            "opId": "alice", "groupId": 1, "memberIds": [f"member_{i}" for i in range(size)],
+        }))
+
+    rows = []
+    for name, legacy, current, payload in cases:
+        legacyUs = per_request_us(legacy, payload, args.requests)
+        currentUs = per_request_us(current, payload, args.requests)
+        rows.append((name, f"{len(json.dumps(payload))}", f"{legacyUs:.2f}", f"{currentUs:.2f}", f"{legacyUs / currentUs:.1f}x"))
+
+    decoder = "orjson" if hasattr(utils_require, "orjson") else "json"
+    print(f"median parse + validate time in microseconds per request, decoder: {decoder}")
+    print_table(["payload", "bytes", "legacy double json.loads", "request_body + Schema", "speedup"], rows)
+
+
+if __name__ == "__main__":
+    main()
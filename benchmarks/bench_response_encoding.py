@@ -0,0 +1,88 @@
+"""Throughput of encoding large JSON responses.
+
+Encodes a page of N serialized messages, and a conversation list of N groups
+with 50 members each as assembled from cached snapshots, three ways: the old
+``JsonResponse`` (stdlib encoder), ``request_success`` with the stdlib
+encoder and ``request_success`` with orjson. For the conversation list the
+old path encodes member dicts, the new one splices the members array
+joined from the pre-encoded member fragments stored in the snapshot.
+
+    python -m benchmarks.bench_response_encoding --sizes 100 1000 5000
+"""
+import argparse
+from datetime import datetime, timedelta, timezone
+
+from benchmarks.common import measure, print_table, setup_django
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1_000, 5_000])
+    parser.add_argument("--members", type=int, default=50)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.http import JsonResponse
+    from django.test.utils import override_settings
+    from account.models import User
+    from chat.models import Conversation, Membership, Message
+    from chat.snapshot import _snapshot
+    from utils.utils_request import ENCODERS, RawJSON, request_success
+
+    users = User.objects.bulk_create([
+        User(userId=f"member_{i}", userName=f"member {i}", password="-", avatarUrl=f"/avatars/{i:064x}.jpg")
+        for i in range(args.members)
+    ])
+    alice = users[0]
+    origin = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+    def legacy(data):
+        return JsonResponse({"code": 0, "info": "Succeed", **data}).content
+
+    def current(encoder):
+        def encode(data):
+            with override_settings(RESPONSE_JSON_ENCODER=encoder):
+                return request_success(data).content
+        return encode
+
+    encoders = [name for name in ("json", "orjson") if name in ENCODERS]
+    rows = []
+    for size in args.sizes:
+        conversation = Conversation.objects.create(type="group_chat", host=alice, groupName=f"group {size}")
+        conversation.members.set(users)
+        Membership.join(conversation.id, [user.id for user in users])
+        Message.objects.bulk_create([
+            Message(
+                conversation=conversation, sender=users[i % len(users)], content=f"message {i} " + "内容" * 20, seq=i + 1,
+                sendTime=origin + timedelta(seconds=i), updateTime=origin + timedelta(seconds=i),
+            )
+            for i in range(size)
+        ])
+        messages = {"messages": Message.serialize_list(Message.objects.filter(conversation=conversation).order_by("seq"))}
+
+        snapshot = Conversation.serialize_list([conversation])[0]
+        members = [member for member in snapshot["members"] if member["userId"] != alice.userId]
+        stored = _snapshot(snapshot)
+        fragments = RawJSON(b"[" + b",".join(encoded for memberId, encoded in stored["members"] if memberId != alice.userId) + b"]")
+        dictList = {"conversations": [{**snapshot, "id": i, "members": members} for i in range(size)]}
+        rawList = {"conversations": [{**snapshot, "id": i, "members": fragments} for i in range(size)]}
+
+        for name, legacyData, currentData in [("messages", messages, messages), ("conversations", dictList, rawList)]:
+            mb = len(legacy(legacyData)) / 1_000_000
+            legacyMs = measure(lambda: legacy(legacyData), repeat=5, warmup=1)
+            row = [f"{size} {name}", f"{mb * 1_000:.0f}", f"{legacyMs:.2f}"]
+            for encoder in encoders:
+                encode = current(encoder)
+                ms = measure(lambda: encode(currentData), repeat=5, warmup=1)
+                row += [f"{ms:.2f}", f"{mb / ms * 1_000:.0f}"]
+            rows.append(row)
+
+    headers = ["payload", "KB", "JsonResponse ms"]
+    for encoder in encoders:
+        headers += [f"{encoder} ms", f"{encoder} MB/s"]
+    print("median time to encode one response body")
+    print_table(headers, rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""Throughput and lock errors of SQLite under concurrent sends and reads.
+
+Runs N worker processes against one database file for a fixed time. Each
+worker loops over a mixed load: a send checks membership and then calls
+``Message.create_next`` inside ``transaction.atomic``, the same
+read-then-write shape as the send view, and a read loads the newest page of
+messages. The stock ``django.db.backends.sqlite3`` settings are compared with
+``SQLITE_PRODUCTION_PROFILE`` (WAL, synchronous=NORMAL, mmap, cache size,
+busy timeout, BEGIN IMMEDIATE). Each profile gets its own file in a
+temporary directory, so ``db/db.sqlite3`` is never touched.
+
+    python -m benchmarks.bench_sqlite_concurrency --workers 2 4 8 --seconds 5
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from benchmarks.common import print_table
+
+
+def configure(database):
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "tasright_backend.settings")
+    import django
+    from django.conf import settings
+
+    settings.DATABASES["default"] = {**settings.DATABASES["default"], **database}
+    django.setup()
+
+
+def prepare(path):
+    configure({"NAME": path})
+    from django.core.management import call_command
+    from django.db import connection
+    from account.models import User
+    from chat.models import Conversation, Membership
+
+    call_command("migrate", verbosity=0)
+    alice = User.objects.create(userId="alice", userName="alice", password="-", avatarUrl="")
+    bob = User.objects.create(userId="bob", userName="bob", password="-", avatarUrl="")
+    conversation = Conversation.objects.create(type="group_chat", host=alice, groupName="bench")
+    conversation.members.set([alice, bob])
+    Membership.join(conversation.id, [alice.id, bob.id])
+    connection.close()
+    return conversation.id, alice.id
+
+
+def work(database, conversationId, senderId, seconds, sendRatio, seed):
+    configure(database)
+    from datetime import datetime, timezone
+    from django.db import OperationalError, connection, transaction
+    from chat.models import Conversation, Message
+
+    generator = random.Random(seed)
+    sends, reads, locked = 0, 0, 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        try:
+            if generator.random() < sendRatio:
+                with transaction.atomic():
+                    Conversation.objects.filter(id=conversationId, members__id=senderId).exists()
+                    now = datetime.now(tz=timezone.utc)
+                    Message.create_next(conversationId, sender_id=senderId, content="hello", sendTime=now, updateTime=now)
+                sends += 1
+            else:
+                list(Message.objects.filter(conversation_id=conversationId).order_by("-seq")[:50])
+                reads += 1
+        except OperationalError as error:
+            if "locked" not in str(error):
+                raise
+            locked += 1
+    connection.close()
+    return sends, reads, locked
+
+
+def run(database, workers, conversationId, senderId, seconds, sendRatio):
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(workers) as pool:
+        results = pool.starmap(work, [
+            (database, conversationId, senderId, seconds, sendRatio, seed) for seed in range(workers)
+        ])
+    return [sum(column) for column in zip(*results)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", type=int, nargs="+", default=[2, 4, 8])
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--send-ratio", type=float, default=0.3)
+    args = parser.parse_args()
+
+    from tasright_backend.settings import SQLITE_PRODUCTION_PROFILE
+
+    directory = tempfile.mkdtemp()
+    try:
+        template = os.path.join(directory, "template.sqlite3")
+        # 建表放在子进程中，主进程不加载 Django，避免与工作进程的配置混用
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(1) as pool:
+            conversationId, senderId = pool.apply(prepare, (template,))
+
+        profiles = [
+            ("default", {"ENGINE": "django.db.backends.sqlite3", "OPTIONS": {}}),
+            ("production", SQLITE_PRODUCTION_PROFILE),
+        ]
+        rows = []
+        for workers in args.workers:
+            for name, profile in profiles:
+                path = os.path.join(directory, f"{name}-{workers}.sqlite3")
+                shutil.copyfile(template, path)
+                sends, reads, locked = run(
+                    {**profile, "NAME": path}, workers, conversationId, senderId, args.seconds, args.send_ratio,
+                )
+                rows.append((
+                    workers, name,
+                    f"{sends / args.seconds:.0f}", f"{reads / args.seconds:.0f}", locked,
+                ))
+    finally:
+        shutil.rmtree(directory)
+
+    print(f"{args.seconds:g}s per run, {args.send_ratio:.0%} sends")
+    print_table(["workers", "profile", "sends/s", "reads/s", "database is locked"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Latency of loading unread counts for a whole inbox on app open.
+
+Compares one GET /chat/get_unread_count/ per conversation (and the count
+query it used to run per conversation before the Redis hash) against a single
+GET /chat/unread_counts/, both with a cold hash (rebuilt from the database)
+and a warm one. Needs the Redis server configured in ``CACHES``.
+
+    python -m benchmarks.bench_unread_counts --sizes 10 100 300
+"""
+import argparse
+from datetime import datetime, timedelta, timezone
+
+from benchmarks.common import measure, print_table, setup_django
+
+
+def populate(alice, bob, start, stop, perConversation, origin):
+    from chat.models import Conversation, Membership, Message
+
+    for _ in range(start, stop):
+        conversation = Conversation.objects.create(type="group_chat", host=bob)
+        conversation.members.set([alice, bob])
+        Membership.join(conversation.id, [alice.id, bob.id])
+        Message.objects.bulk_create([
+            Message(
+                conversation=conversation,
+                sender=bob,
+                content=f"message {i}",
+                seq=i + 1,
+                sendTime=origin + timedelta(milliseconds=i),
+                updateTime=origin + timedelta(milliseconds=i),
+            )
+            for i in range(perConversation)
+        ])
+        Conversation.objects.filter(id=conversation.id).update(lastSeq=perConversation)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 300])
+    parser.add_argument("--messages", type=int, default=20, help="unread messages per conversation")
+    args = parser.parse_args()
+
+    setup_django()
+    from django.test import Client
+    from django_redis import get_redis_connection
+    from account.models import User
+    from chat.models import Conversation, Message, ReadState
+    from utils.utils_jwt import generate_jwt_token
+
+    alice = User.objects.create(userId="alice", userName="alice", password="-")
+    bob = User.objects.create(userId="bob", userName="bob", password="-")
+    origin = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    redis = get_redis_connection("default")
+
+    client = Client()
+    token = generate_jwt_token("alice")
+    rows = []
+    created = 0
+    for size in sorted(args.sizes):
+        populate(alice, bob, created, size, args.messages, origin)
+        created = size
+        conversationIds = list(Conversation.objects.filter(members=alice).values_list("id", flat=True))
+
+        def legacy_queries():
+            # 旧版缓存未命中时每个会话各查一次用户与未读数
+            for conversationId in conversationIds:
+                id = User.objects.filter(userId="alice").values_list("id", flat=True).first()
+                lastReadSeq = ReadState.last_read_seq(conversationId, id)
+                Message.objects.filter(conversation_id=conversationId, seq__gt=lastReadSeq).filter(
+                    Message.visible_to("alice")
+                ).exclude(sender__id=id).count()
+
+        def per_conversation():
+            for conversationId in conversationIds:
+                client.get(
+                    f"/chat/get_unread_count/?userId=alice&conversationId={conversationId}",
+                    HTTP_AUTHORIZATION=token,
+                )
+
+        def per_conversation_cold():
+            redis.delete("unread:alice")
+            per_conversation()
+
+        def bulk():
+            client.get("/chat/unread_counts/?userId=alice", HTTP_AUTHORIZATION=token)
+
+        def bulk_cold():
+            redis.delete("unread:alice")
+            bulk()
+
+        rows.append((
+            size,
+            f"{measure(legacy_queries, repeat=5):.2f}",
+            f"{measure(per_conversation_cold, repeat=5):.2f}",
+            f"{measure(per_conversation, repeat=5):.2f}",
+            f"{measure(bulk_cold):.2f}",
+            f"{measure(bulk):.2f}",
+        ))
+    redis.delete("unread:alice")
+
+    print(f"median latency in ms to load every unread count, {args.messages} unread messages per conversation")
+    print_table(
+        ["conversations", "legacy N counts", "N requests cold", "N requests warm", "bulk cold", "bulk warm"],
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    main()
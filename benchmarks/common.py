@@ -0,0 +1,45 @@
+"""Shared helpers for the standalone benchmarks in this package.
+
+Every benchmark builds its own throwaway test database, so it never touches
+``db/db.sqlite3``. Run them from the repository root, for example::
+
+    python -m benchmarks.bench_message_pagination
+"""
+import os
+import statistics
+import time
+
+import django
+
+
+def setup_django():
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "tasright_backend.settings")
+    django.setup()
+
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+
+
+def measure(fn, repeat=20, warmup=2):
+    """Run ``fn`` ``repeat`` times and return the median wall time in ms."""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1_000)
+    return statistics.median(samples)
+
+
+def print_table(headers, rows):
+    widths = [
+        max(len(str(cell)) for cell in [header] + [row[i] for row in rows])
+        for i, header in enumerate(headers)
+    ]
+    print("  ".join(str(h).rjust(w) for h, w in zip(headers, widths)))
+    for row in rows:
+        print("  ".join(str(c).rjust(w) for c, w in zip(row, widths)))
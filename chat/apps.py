@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class ChatConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chat'
+
+    def ready(self):
+        # 消息全文索引是 FTS5 虚拟表与触发器，不由模型迁移管理，迁移完成后补建
+        from .search import create_search_index
+        post_migrate.connect(create_search_index, sender=self)
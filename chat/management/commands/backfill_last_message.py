@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from chat.models import Conversation, Message
+
+
+class Command(BaseCommand):
+    help = "为已有消息但尚无最后一条消息摘要的会话补写摘要，可重复执行"
+
+    def handle(self, *args, **options):
+        conversations = Conversation.objects.filter(lastMessageId__isnull=True, lastSeq__gt=0).values_list("id", "lastSeq")
+        total = 0
+        for conversationId, lastSeq in list(conversations):
+            message = (
+                Message.objects.filter(conversation_id=conversationId, seq__lte=lastSeq)
+                .select_related("sender")
+                .order_by("-seq")
+                .first()
+            )
+            if message is None:
+                continue
+            # 仅在期间没有新消息写入摘要时补写
+            total += Conversation.objects.filter(id=conversationId, lastMessageId__isnull=True).update(
+                **Conversation.summary_of(message)
+            )
+        self.stdout.write(f"已为 {total} 个会话补写最后一条消息摘要")
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max, Min
+
+from chat.models import Conversation, Membership, Message
+
+
+class Command(BaseCommand):
+    help = "根据旧版 Message.receivers 记录推导 Membership 在场区间，需在 backfill_message_seq 之后执行"
+
+    def handle(self, *args, **options):
+        Receiver_Message = Message.receivers.through
+        created = 0
+        for conversation in Conversation.objects.exclude(memberships__isnull=False).only("id", "lastSeq"):
+            with transaction.atomic():
+                memberIds = set(conversation.members.values_list("id", flat=True))
+                received = (
+                    Receiver_Message.objects.filter(message__conversation_id=conversation.id, message__seq__isnull=False)
+                    .values("user_id")
+                    .annotate(firstSeq=Min("message__seq"), lastSeq=Max("message__seq"))
+                )
+                memberships = []
+                for row in received:
+                    # 当前成员的区间保持开放，已离开的成员截止到其收到的最后一条消息
+                    leftSeq = None if row["user_id"] in memberIds else row["lastSeq"]
+                    memberships.append(Membership(
+                        conversation_id=conversation.id, user_id=row["user_id"],
+                        joinedSeq=row["firstSeq"] - 1, leftSeq=leftSeq,
+                    ))
+                # 从未收到过消息的当前成员从现在开始可见
+                receivedIds = {membership.user_id for membership in memberships}
+                memberships += [
+                    Membership(conversation_id=conversation.id, user_id=userId, joinedSeq=conversation.lastSeq)
+                    for userId in memberIds - receivedIds
+                ]
+                Membership.objects.bulk_create(memberships)
+                Receiver_Message.objects.filter(message__conversation_id=conversation.id).delete()
+            created += len(memberships)
+        self.stdout.write(f"已生成 {created} 段在场区间")
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+
+from chat.models import Conversation, Message
+
+
+class Command(BaseCommand):
+    help = "为历史消息按 (sendTime, id) 顺序分配会话内序号 seq，可重复执行"
+
+    def handle(self, *args, **options):
+        conversationIds = (
+            Message.objects.filter(seq__isnull=True)
+            .values_list("conversation_id", flat=True)
+            .distinct()
+        )
+        total = 0
+        for conversationId in list(conversationIds):
+            with transaction.atomic():
+                lastSeq = Message.objects.filter(conversation_id=conversationId).aggregate(
+                    lastSeq=Max("seq")
+                )["lastSeq"] or 0
+                pending = list(
+                    Message.objects.filter(conversation_id=conversationId, seq__isnull=True)
+                    .order_by("sendTime", "id")
+                    .only("id")
+                )
+                for offset, message in enumerate(pending, start=1):
+                    message.seq = lastSeq + offset
+                Message.objects.bulk_update(pending, ["seq"], batch_size=1_000)
+                Conversation.objects.filter(id=conversationId).update(lastSeq=lastSeq + len(pending))
+            total += len(pending)
+        self.stdout.write(f"已为 {total} 条消息分配 seq")
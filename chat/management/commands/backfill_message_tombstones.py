@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from chat.models import Message, MessageTombstone
+
+
+class Command(BaseCommand):
+    help = "将旧版 Message.deleteUsers 删除记录合并为 MessageTombstone 区间，需在 backfill_message_seq 之后执行"
+
+    def handle(self, *args, **options):
+        DeleteUser_Message = Message.deleteUsers.through
+        legacy = DeleteUser_Message.objects.filter(message__seq__isnull=False)
+        seqsByUser = {}
+        for userId, conversationId, seq in legacy.values_list(
+            "user_id", "message__conversation_id", "message__seq"
+        ):
+            seqsByUser.setdefault(userId, {}).setdefault(conversationId, []).append(seq)
+
+        created = 0
+        with transaction.atomic():
+            for userId, seqsByConversation in seqsByUser.items():
+                created += len(MessageTombstone.hide(userId, seqsByConversation))
+            legacy.delete()
+        self.stdout.write(f"已生成 {created} 个删除区间")
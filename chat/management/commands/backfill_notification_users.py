@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from account.models import User
+from chat.models import Notification
+
+
+class Command(BaseCommand):
+    help = "按旧版冗余的 userId 为尚未关联发布者的群公告补写 user 外键，可重复执行"
+
+    def handle(self, *args, **options):
+        userIds = Notification.objects.filter(user__isnull=True).exclude(userId="").values_list("userId", flat=True).distinct()
+        users = dict(User.objects.filter(userId__in=list(userIds)).values_list("userId", "id"))
+        total = 0
+        for userId, id in users.items():
+            total += Notification.objects.filter(user__isnull=True, userId=userId).update(user_id=id)
+        self.stdout.write(f"已为 {total} 条群公告关联发布者")
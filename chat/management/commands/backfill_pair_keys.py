@@ -0,0 +1,35 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from chat.models import Conversation
+
+
+class Command(BaseCommand):
+    help = "为尚无 pairKey 的私聊按双方 userId 补写规范化的配对键，可重复执行"
+
+    def handle(self, *args, **options):
+        Members = Conversation.members.through
+        members = defaultdict(list)
+        for conversationId, userId in Members.objects.filter(
+            conversation__type="private_chat", conversation__pairKey__isnull=True
+        ).values_list("conversation_id", "user__userId"):
+            members[conversationId].append(userId)
+
+        # 同一对用户若有多个历史私聊，配对键给仍有效且消息最多的那个，其余保持为空
+        taken = set(Conversation.objects.filter(pairKey__isnull=False).values_list("pairKey", flat=True))
+        candidates = Conversation.objects.filter(id__in=list(members)).order_by("-status", F("lastSeq").desc(), "id")
+        total, skipped = 0, 0
+        for conversationId in candidates.values_list("id", flat=True):
+            userIds = members[conversationId]
+            if len(userIds) != 2:
+                skipped += 1
+                continue
+            pairKey = Conversation.pair_key(*userIds)
+            if pairKey in taken:
+                skipped += 1
+                continue
+            taken.add(pairKey)
+            total += Conversation.objects.filter(id=conversationId, pairKey__isnull=True).update(pairKey=pairKey)
+        self.stdout.write(f"已为 {total} 个私聊补写配对键，{skipped} 个成员不是两人或与已有私聊重复")
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+
+from chat.models import Message, ReadState
+
+
+class Command(BaseCommand):
+    help = "将旧版 Message.readUsers 逐条已读记录折算为 ReadState 水位线，需在 backfill_message_seq 之后执行"
+
+    def handle(self, *args, **options):
+        ReadUser_Message = Message.readUsers.through
+        # 每个 (会话, 用户) 读到的最大序号即为其水位线
+        rows = (
+            ReadUser_Message.objects.filter(message__seq__isnull=False)
+            .values("message__conversation_id", "user_id")
+            .annotate(lastReadSeq=Max("message__seq"))
+        )
+        converted = 0
+        with transaction.atomic():
+            for row in rows:
+                ReadState.mark_read(row["message__conversation_id"], row["user_id"], row["lastReadSeq"])
+                converted += 1
+            ReadUser_Message.objects.filter(message__seq__isnull=False).delete()
+        self.stdout.write(f"已生成 {converted} 条已读水位线")
@@ -0,0 +1,30 @@
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+
+from account.models import User
+from chat.models import Conversation
+from utils.utils_avatar import is_data_uri, store_data_uri
+
+
+class Command(BaseCommand):
+    help = "把用户与群聊行中以 data URI 保存的头像转存为按内容哈希命名的文件，行中改为保存地址，可重复执行"
+
+    def handle(self, *args, **options):
+        total, skipped = 0, 0
+        for model in (User, Conversation):
+            # 相同的 data URI（如默认头像）只解码、写入一次，再按取值整体更新
+            values = model.objects.filter(avatarUrl__startswith="data:").values_list("avatarUrl", flat=True).distinct()
+            for value in list(values):
+                if not is_data_uri(value):
+                    continue
+                try:
+                    url = store_data_uri(value)
+                except ValueError:
+                    skipped += 1
+                    continue
+                total += model.objects.filter(avatarUrl=value).update(avatarUrl=url)
+
+        # 会话快照中嵌着成员头像，转存后让其全部失效
+        if total:
+            cache.delete_pattern("conversation_snapshot_*")
+        self.stdout.write(f"已转存 {total} 行头像，{skipped} 种无法解析的头像保持不变")
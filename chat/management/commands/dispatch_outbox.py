@@ -0,0 +1,31 @@
+import time
+import logging
+
+from django.core.management.base import BaseCommand
+
+from chat.outbox import dispatch
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "持续读取 OutboxEvent 并批量推送到 channel layer，应只运行一个实例"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--interval", type=float, default=0.05, help="发件箱为空时的轮询间隔（秒）")
+        parser.add_argument("--once", action="store_true", help="清空当前发件箱后退出")
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                sent = dispatch(options["batch_size"])
+            except Exception:
+                logger.exception("dispatch outbox failed")
+                sent = 0
+                if options["once"]:
+                    raise
+            if sent == 0:
+                if options["once"]:
+                    return
+                time.sleep(options["interval"])
@@ -1,16 +1,19 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, Exists, F, Max, Min, OuterRef, Prefetch, Q, Subquery, Value, prefetch_related_objects
+from django.db.models.functions import Coalesce
 from account.models import User
-from datetime import datetime
+from datetime import datetime, timezone as dt_timezone
 from django.utils import timezone
 
 # Create your models here.
 
 
 class Notification(models.Model):
+    # 群公告只引用发布者，昵称和头像序列化时从用户表读取，不再随每条公告复制
     id = models.AutoField(primary_key=True)
-    userId = models.CharField(max_length=16, db_index=True)
-    userName = models.CharField(max_length=16, db_index=True)
-    avatarUrl = models.TextField()
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="notifications", null=True)
+    # 旧版冗余的发布者 userId，仅供 backfill_notification_users 迁移历史数据
+    userId = models.CharField(max_length=16, default="", blank=True)
     content = models.TextField()
     timestamp = models.DateTimeField()
 
@@ -24,13 +27,34 @@ class Notification(models.Model):
 
     def serialize(self):
         return {
-            "userId": self.userId,
-            "userName": self.userName,
-            "avatarUrl": self.avatarUrl,
+            "id": self.id,
+            "userId": self.user.userId if self.user else None,
+            "userName": self.user.userName if self.user else None,
+            "avatarUrl": self.user.avatarUrl if self.user else None,
             "content": self.content,
             "timestamp": int(self.timestamp.timestamp() * 1_000),
         }
 
+    @staticmethod
+    def summaries(conversationIds) -> dict:
+        # 返回 {conversationId: (最新一条公告, 公告条数)}：分组计数一次查询，取最新一条连同发布者一次查询
+        rows = list(
+            Notification.objects.filter(conversation_id__in=conversationIds)
+            .values("conversation_id")
+            .annotate(count=Count("id"), latestId=Max("id"))
+            .order_by()
+        )
+        if not rows:
+            return {}
+        latest = Notification.objects.select_related("user").in_bulk([row["latestId"] for row in rows])
+        return {row["conversation_id"]: (latest[row["latestId"]].serialize(), row["count"]) for row in rows}
+
+    class Meta:
+        indexes = [
+            # 公告列表按 id 倒序游标分页
+            models.Index(fields=["conversation", "id"], name="notification_conv_id_idx"),
+        ]
+
 
 class Conversation(models.Model):
     TYPE_CHOICES = [
@@ -42,6 +66,22 @@ class Conversation(models.Model):
     status = models.BooleanField(default=True, db_index=True)
     avatarUrl = models.CharField(max_length=200, default="", blank=True, null=True)
     updateTime = models.DateTimeField(default=timezone.now)
+    # 会话内最后一条消息的序号，由 Message.create_next 递增
+    lastSeq = models.PositiveBigIntegerField(default=0)
+    # 会话资料与成员的版本号，每次变动由 bump_version 递增，随推送帧下发供客户端发现漏收
+    version = models.PositiveBigIntegerField(default=0)
+    # 已读推送帧的版本号，每次推进水位线由 bump_read_version 递增，与会话快照的 version 分开，已读不会使快照缓存失效
+    readVersion = models.PositiveBigIntegerField(default=0)
+    # 入群邀请推送帧（发给群主与管理员）的版本号，由 bump_invitation_version 递增
+    invitationVersion = models.PositiveBigIntegerField(default=0)
+    # 最后一条消息的冗余摘要，由 Message.create_next 在同一事务内更新，会话列表无需再查消息表
+    lastMessageId = models.IntegerField(null=True, default=None)
+    lastMessageSenderId = models.CharField(max_length=16, default="", blank=True)
+    lastMessageSenderName = models.CharField(max_length=16, default="", blank=True)
+    lastMessageSnippet = models.CharField(max_length=50, default="", blank=True)
+    lastMessageTime = models.DateTimeField(null=True, default=None)
+    # 私聊双方 userId 排序后以 ":" 拼接，唯一索引保证同一对用户只有一个私聊，按键查找与会话总数无关；群聊为空
+    pairKey = models.CharField(max_length=33, null=True, default=None, unique=True)
 
 
     # 以下为群聊所需的字段
@@ -56,18 +96,53 @@ class Conversation(models.Model):
         User, related_name="admin_conversations", default=None
     )
     groupName = models.CharField(max_length=20, default="", blank=True, null=True)
-    groupNotificationList = models.ManyToManyField(
-        Notification, related_name="notificationList", blank=True
+
+    # 只通过 update() 原子更新的字段，整行 save() 时不回写，避免用过期的值覆盖并发写入
+    ATOMIC_FIELDS = (
+        "lastSeq", "version", "readVersion", "invitationVersion", "updateTime",
+        "lastMessageId", "lastMessageSenderId", "lastMessageSenderName", "lastMessageSnippet", "lastMessageTime",
     )
 
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.ATOMIC_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
+    @staticmethod
+    def pair_key(userIdA: str, userIdB: str) -> str:
+        return ":".join(sorted((userIdA, userIdB)))
+
+    @staticmethod
+    def private_between(userIdA: str, userIdB: str):
+        return Conversation.objects.filter(pairKey=Conversation.pair_key(userIdA, userIdB)).first()
+
+    def bump_version(self) -> int:
+        Conversation.objects.filter(id=self.id).update(version=F("version") + 1)
+        self.version = Conversation.objects.filter(id=self.id).values_list("version", flat=True).get()
+        return self.version
+
+    @staticmethod
+    def bump_read_version(conversationId: int) -> int:
+        Conversation.objects.filter(id=conversationId).update(readVersion=F("readVersion") + 1)
+        return Conversation.objects.filter(id=conversationId).values_list("readVersion", flat=True).get()
+
+    @staticmethod
+    def bump_invitation_version(conversationId: int) -> int:
+        Conversation.objects.filter(id=conversationId).update(invitationVersion=F("invitationVersion") + 1)
+        return Conversation.objects.filter(id=conversationId).values_list("invitationVersion", flat=True).get()
+
     def serialize(self, excludeUserId=None, otherUserId = None):
-        members = self.members.all().exclude(userId=excludeUserId)
-        # 不包含userID对应的用户
+        # 不包含userID对应的用户；成员、管理员都遍历 .all()，批量序列化时直接使用 prefetch 的结果
+        members = [user for user in self.members.all() if user.userId != excludeUserId]
         data = {
             "id": self.id,
             "type": self.type,
-            "members": [user.serialize() for user in members.all()],
+            "members": [user.serialize() for user in members],
             "status": self.status,
+            "version": self.version,
             "updateTime": int(self.updateTime.timestamp() * 1_000),
         }
         if self.type == "private_chat":
@@ -76,13 +151,62 @@ class Conversation(models.Model):
             data['groupName'] = self.groupName
             data['avatarUrl'] =self.avatarUrl
             data['hostId'] = self.host.userId if self.host else None
-            data['adminIdList'] = list(self.admins.values_list('userId', flat=True))
-            data['groupNotificationList'] = [
-                notification.serialize()
-                for notification in self.groupNotificationList.all()
-            ]
+            data['adminIdList'] = [admin.userId for admin in self.admins.all()]
+            # 只带最新一条公告和条数，完整列表由 /chat/notifications/ 分页获取
+            summary = getattr(self, "_notificationSummary", None)
+            if summary is None:
+                summary = Notification.summaries([self.id]).get(self.id, (None, 0))
+            data['latestNotification'], data['notificationCount'] = summary
         return data
 
+    @staticmethod
+    def serialize_list(conversations, userId=None):
+        # 批量序列化：成员、管理员、群主各一次查询，群公告摘要至多两次查询，与会话数量无关
+        conversations = list(conversations)
+        prefetch_related_objects(conversations, "members", "admins", "host")
+        groupIds = [conversation.id for conversation in conversations if conversation.type == "group_chat"]
+        summaries = Notification.summaries(groupIds) if groupIds else {}
+        for conversation in conversations:
+            conversation._notificationSummary = summaries.get(conversation.id, (None, 0))
+        data = []
+        for conversation in conversations:
+            otherUserId = None
+            if conversation.type == "private_chat":
+                otherUserId = next(
+                    (member.userId for member in conversation.members.all() if member.userId != userId), None
+                )
+            data.append(conversation.serialize(userId, otherUserId))
+        return data
+
+    def serialize_last_message(self):
+        if self.lastMessageId is None:
+            return None
+        return {
+            "id": self.lastMessageId,
+            "senderId": self.lastMessageSenderId,
+            "senderName": self.lastMessageSenderName,
+            "snippet": self.lastMessageSnippet,
+            "timestamp": int(self.lastMessageTime.timestamp() * 1_000),
+        }
+
+    @staticmethod
+    def summary_of(message):
+        # 由消息生成会话的最后一条消息摘要字段，updateTime 同时作为会话列表的排序依据
+        return {
+            "updateTime": message.sendTime,
+            "lastMessageId": message.id,
+            "lastMessageSenderId": message.sender.userId,
+            "lastMessageSenderName": message.sender.userName,
+            "lastMessageSnippet": (message.content or "")[:50],
+            "lastMessageTime": message.sendTime,
+        }
+
+    class Meta:
+        indexes = [
+            # 会话列表按 (updateTime, id) 倒序游标分页
+            models.Index(fields=["updateTime", "id"], name="conversation_update_id_idx"),
+        ]
+
 
 class Message(models.Model):
     id = models.AutoField(primary_key=True)
@@ -96,9 +220,10 @@ class Message(models.Model):
     sender = models.ForeignKey(
         User, related_name="sent_messages", on_delete=models.CASCADE, db_index=True
     )
+    # 旧版逐条接收者记录，可见性已改由 Membership 在场区间推导，仅供 backfill_memberships 迁移历史数据
     receivers = models.ManyToManyField(User, related_name="received_messages")
     sendTime = models.DateTimeField()
-    updateTime = models.DateTimeField(db_index=True)
+    updateTime = models.DateTimeField()
     content = models.CharField(max_length=200, default="", blank=True, null=True)
     replyTo = models.ForeignKey(
         "self",
@@ -108,20 +233,36 @@ class Message(models.Model):
         default=None,
         null=True,
     )
+    # 旧版逐条已读记录，已由 ReadState 水位线取代，仅供 backfill_read_states 迁移历史数据
     readUsers = models.ManyToManyField(User, related_name="read_message", blank=True, db_index=True)
+    # 旧版"仅对自己删除"记录，已由 MessageTombstone 取代，仅供 backfill_message_tombstones 迁移历史数据
     deleteUsers = models.ManyToManyField(
         User, related_name="delete_message", symmetrical=False, blank=True
     )
     replyCount = models.IntegerField(default=0)
+    # 会话内单调递增且连续的序号，插入时分配，之后不再改变
+    seq = models.PositiveBigIntegerField(null=True)
 
-    def serialize(self):
-    
-        readUsers = list(self.readUsers.values_list('userName', flat=True))
-        deleteUsers = list(self.deleteUsers.values_list('userId', flat=True))
+    def serialize(self, readStates=None, tombstones=None):
+        # readStates 为该会话成员的 (user_id, userName, lastReadSeq)，
+        # tombstones 为该会话的 (userId, startSeq, endSeq)，未传入时单独查询
+        if readStates is None:
+            readStates = ReadState.states_for([self.conversation_id]).get(self.conversation_id, [])
+        if tombstones is None:
+            tombstones = MessageTombstone.ranges_for([self]).get(self.conversation_id, [])
+        readUsers = [
+            userName for (userId, userName, lastReadSeq) in readStates
+            if self.seq is not None and lastReadSeq >= self.seq and userId != self.sender_id
+        ]
+        deleteUsers = sorted({
+            userId for (userId, startSeq, endSeq) in tombstones
+            if self.seq is not None and startSeq <= self.seq <= endSeq
+        })
 
         return {
             "id": self.id,
             "conversation": self.conversation_id,
+            "seq": self.seq,
             "sender": self.sender.userName,
             "senderId": self.sender.userId,
             "content": self.content,
@@ -133,8 +274,272 @@ class Message(models.Model):
             "deleteList": deleteUsers,
         }
 
+    @classmethod
+    def create_next(cls, conversation_id, **fields):
+        # 递增 lastSeq 与插入消息处于同一事务：失败回滚时序号一并回滚，不会留下空洞
+        with transaction.atomic():
+            Conversation.objects.filter(id=conversation_id).update(lastSeq=F("lastSeq") + 1)
+            seq = Conversation.objects.filter(id=conversation_id).values_list("lastSeq", flat=True).get()
+            message = cls.objects.create(conversation_id=conversation_id, seq=seq, **fields)
+            # 上面的 update 已锁住会话行，并发发送时摘要按 seq 顺序写入
+            Conversation.objects.filter(id=conversation_id).update(**Conversation.summary_of(message))
+            return message
+
+    @staticmethod
+    def serialize_list(messages):
+        # 批量序列化一页消息：sender、已读水位线、删除区间各一次查询，与页大小无关
+        messages = list(messages)
+        prefetch_related_objects(
+            messages,
+            Prefetch("sender", queryset=User.objects.only("id", "userId", "userName")),
+        )
+        readStates = ReadState.states_for({message.conversation_id for message in messages})
+        tombstones = MessageTombstone.ranges_for(messages)
+        return [
+            message.serialize(
+                readStates.get(message.conversation_id, []),
+                tombstones.get(message.conversation_id, []),
+            )
+            for message in messages
+        ]
+
+    # 按 (updateTime, id) 取用户在若干会话中游标之后的一页可见消息，after 为游标条件
+    # 每个会话游标之后第 limit+1 条可见消息的时间中最早的一个作为上界：该会话已有 limit+1 条不晚于它，
+    # 一页内的消息都不会更晚；于是每个会话只在 (conversation, updateTime, id) 索引上扫描不超过一页的范围，
+    # 与其他用户的消息量和本人的历史总量都无关
+    @staticmethod
+    def page_for(userId, conversationIds, after, limit):
+        visible = Message.objects.filter(after).filter(Message.visible_to(userId))
+        nth = visible.filter(conversation_id=OuterRef("id")).order_by("updateTime", "id").values("updateTime")[limit:limit + 1]
+        bound = (
+            Conversation.objects.filter(id__in=conversationIds)
+            .annotate(nth=Subquery(nth), group=Value(1))
+            .values("group")
+            .annotate(bound=Min("nth"))
+            .values("bound")
+        )
+        # 所有会话都不足 limit+1 条时没有上界
+        upper = Coalesce(Subquery(bound), Value(datetime.max.replace(tzinfo=dt_timezone.utc)), output_field=models.DateTimeField())
+        return (
+            visible.filter(conversation_id__in=conversationIds, updateTime__lte=upper)
+            .order_by("updateTime", "id")[: limit + 1]
+        )
+
+    @staticmethod
+    def visible_to(userId):
+        # 消息对该用户可见：seq 落在其某段在场区间内，且未被其"仅对自己删除"
+        return Q(Membership.covers(userId)) & ~Q(MessageTombstone.covers(userId))
+
     class Meta:
         db_table = "message"
+        indexes = [
+            # 游标分页先按用户所在会话限定，每个会话内按 (updateTime, id) 有序，只扫描游标之后的消息
+            models.Index(fields=["conversation", "updateTime", "id"], name="message_conv_update_id_idx"),
+        ]
+        constraints = [
+            # 按序号同步时走 (conversation, seq) 唯一索引的范围扫描
+            models.UniqueConstraint(fields=["conversation", "seq"], name="message_conversation_seq_uniq"),
+        ]
+
+
+class Membership(models.Model):
+    # 成员在会话中的一段在场区间：joinedSeq < seq 且 (leftSeq 为空或 seq <= leftSeq) 的消息对其可见
+    # 发消息时不再为每个成员写接收记录，群聊中发送一条消息只插入一行
+    id = models.AutoField(primary_key=True)
+    conversation = models.ForeignKey(
+        Conversation, on_delete=models.CASCADE, related_name="memberships"
+    )
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="memberships")
+    joinedSeq = models.PositiveBigIntegerField(default=0)
+    leftSeq = models.PositiveBigIntegerField(null=True, default=None)
+    joinTime = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = "membership"
+        indexes = [
+            models.Index(fields=["user", "conversation", "joinedSeq"], name="membership_user_conv_join_idx"),
+        ]
+
+    @classmethod
+    def join(cls, conversation_id, user_ids):
+        # 加入时记下当前 lastSeq，此前的历史消息对新成员不可见；已在会话中的成员忽略
+        lastSeq = Conversation.objects.filter(id=conversation_id).values_list("lastSeq", flat=True).get()
+        present = set(cls.objects.filter(
+            conversation_id=conversation_id, user_id__in=user_ids, leftSeq__isnull=True
+        ).values_list("user_id", flat=True))
+        cls.objects.bulk_create([
+            cls(conversation_id=conversation_id, user_id=user_id, joinedSeq=lastSeq)
+            for user_id in set(user_ids) - present
+        ])
+
+    @classmethod
+    def leave(cls, conversation_id, user_id):
+        # 离开时封闭当前区间，离开前收到的消息仍然可见
+        lastSeq = Conversation.objects.filter(id=conversation_id).values_list("lastSeq", flat=True).get()
+        cls.objects.filter(
+            conversation_id=conversation_id, user_id=user_id, leftSeq__isnull=True
+        ).update(leftSeq=lastSeq)
+
+    @staticmethod
+    def covers(userId):
+        return Exists(Membership.objects.filter(
+            user__userId=userId,
+            conversation_id=OuterRef("conversation_id"),
+            joinedSeq__lt=OuterRef("seq"),
+        ).filter(Q(leftSeq__isnull=True) | Q(leftSeq__gte=OuterRef("seq"))))
+
+
+class ReadState(models.Model):
+    # 每个 (会话, 成员) 一行的已读水位线：seq 不超过 lastReadSeq 的消息视为已读
+    id = models.AutoField(primary_key=True)
+    conversation = models.ForeignKey(
+        Conversation, on_delete=models.CASCADE, related_name="readStates"
+    )
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="readStates")
+    lastReadSeq = models.PositiveBigIntegerField(default=0)
+    updateTime = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = "read_state"
+        constraints = [
+            models.UniqueConstraint(fields=["conversation", "user"], name="read_state_conversation_user_uniq"),
+        ]
+
+    @classmethod
+    def mark_read(cls, conversation_id, user_id, seq):
+        # 水位线只前进不后退；已有记录时只是一条 UPDATE
+        updated = cls.objects.filter(
+            conversation_id=conversation_id, user_id=user_id, lastReadSeq__lt=seq
+        ).update(lastReadSeq=seq, updateTime=timezone.now())
+        if updated == 0:
+            cls.objects.get_or_create(
+                conversation_id=conversation_id, user_id=user_id, defaults={"lastReadSeq": seq}
+            )
+
+    @classmethod
+    def last_read_seq(cls, conversation_id, user_id):
+        return cls.objects.filter(
+            conversation_id=conversation_id, user_id=user_id
+        ).values_list("lastReadSeq", flat=True).first() or 0
+
+    @classmethod
+    def states_for(cls, conversationIds):
+        # 一次查询取出若干会话的全部水位线，按会话分组
+        states = {}
+        rows = cls.objects.filter(conversation_id__in=conversationIds).order_by("user_id").values_list(
+            "conversation_id", "user_id", "user__userName", "lastReadSeq"
+        )
+        for conversationId, userId, userName, lastReadSeq in rows:
+            states.setdefault(conversationId, []).append((userId, userName, lastReadSeq))
+        return states
+
+
+class MessageTombstone(models.Model):
+    # 用户"仅对自己删除"的消息，按会话内连续的 seq 区间 [startSeq, endSeq] 压缩存储
+    id = models.AutoField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="tombstones")
+    conversation = models.ForeignKey(
+        Conversation, on_delete=models.CASCADE, related_name="tombstones"
+    )
+    startSeq = models.PositiveBigIntegerField()
+    endSeq = models.PositiveBigIntegerField()
+
+    class Meta:
+        db_table = "message_tombstone"
+        indexes = [
+            models.Index(fields=["user", "conversation", "startSeq"], name="tombstone_user_conv_start_idx"),
+            # ranges_for 不限定用户，按 (conversation, startSeq) 取一页消息范围内的全部区间
+            models.Index(fields=["conversation", "startSeq"], name="tombstone_conv_start_idx"),
+        ]
+
+    @staticmethod
+    def to_ranges(seqs):
+        # 将一组 seq 合并为若干连续区间
+        ranges = []
+        for seq in sorted(set(seqs)):
+            if ranges and ranges[-1][1] + 1 == seq:
+                ranges[-1][1] = seq
+            else:
+                ranges.append([seq, seq])
+        return [tuple(r) for r in ranges]
+
+    @classmethod
+    def hide(cls, user_id, seqsByConversation):
+        # seqsByConversation 为 {conversation_id: [seq, ...]}；新区间与该用户已有的重叠或相邻区间合并，
+        # 一次查询取出可能相接的旧区间，删除被合并的旧区间后连同新区间一次批量写入
+        rangesByConversation = {
+            conversationId: cls.to_ranges(seqs) for conversationId, seqs in seqsByConversation.items() if seqs
+        }
+        if not rangesByConversation:
+            return []
+        nearby = Q()
+        for conversationId, ranges in rangesByConversation.items():
+            nearby |= Q(conversation_id=conversationId, startSeq__lte=ranges[-1][1] + 1, endSeq__gte=ranges[0][0] - 1)
+
+        with transaction.atomic():
+            existing = {}
+            for id, conversationId, startSeq, endSeq in cls.objects.filter(nearby, user_id=user_id).values_list(
+                "id", "conversation_id", "startSeq", "endSeq"
+            ):
+                existing.setdefault(conversationId, []).append((startSeq, endSeq, id))
+
+            tombstones, merged = [], []
+            for conversationId, ranges in rangesByConversation.items():
+                # 按起点扫描，与上一组重叠或相邻的区间并入该组；新区间的 id 记为 None
+                groups = []
+                candidates = existing.get(conversationId, []) + [(startSeq, endSeq, None) for startSeq, endSeq in ranges]
+                for startSeq, endSeq, id in sorted(candidates, key=lambda candidate: candidate[0]):
+                    if groups and startSeq <= groups[-1][1] + 1:
+                        groups[-1][1] = max(groups[-1][1], endSeq)
+                        groups[-1][2].append(id)
+                    else:
+                        groups.append([startSeq, endSeq, [id]])
+                # 只有包含新区间的组需要改写：删除组内的旧区间，写入合并后的区间
+                for startSeq, endSeq, ids in groups:
+                    if None in ids:
+                        merged.extend(id for id in ids if id is not None)
+                        tombstones.append(cls(user_id=user_id, conversation_id=conversationId, startSeq=startSeq, endSeq=endSeq))
+            if merged:
+                cls.objects.filter(id__in=merged).delete()
+            cls.objects.bulk_create(tombstones)
+        return tombstones
+
+    @staticmethod
+    def covers(userId):
+        # 按 (user, conversation, startSeq) 索引判断外层消息是否落在该用户的删除区间内
+        return Exists(MessageTombstone.objects.filter(
+            user__userId=userId,
+            conversation_id=OuterRef("conversation_id"),
+            startSeq__lte=OuterRef("seq"),
+            endSeq__gte=OuterRef("seq"),
+        ))
+
+    @classmethod
+    def ranges_for(cls, messages):
+        # 一次查询取出与这页消息重叠的全部删除区间，按会话分组
+        seqs = [message.seq for message in messages if message.seq is not None]
+        if not seqs:
+            return {}
+        ranges = {}
+        rows = cls.objects.filter(
+            conversation_id__in={message.conversation_id for message in messages},
+            startSeq__lte=max(seqs),
+            endSeq__gte=min(seqs),
+        ).values_list("conversation_id", "user__userId", "startSeq", "endSeq")
+        for conversationId, userId, startSeq, endSeq in rows:
+            ranges.setdefault(conversationId, []).append((userId, startSeq, endSeq))
+        return ranges
+
+
+class OutboxEvent(models.Model):
+    # 待推送的 WebSocket 事件，与业务修改在同一事务中写入，由 dispatch_outbox 进程批量发出
+    id = models.BigAutoField(primary_key=True)
+    groups = models.JSONField()
+    payload = models.JSONField()
+    createTime = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = "outbox_event"
 
 
 class Invitation(models.Model):
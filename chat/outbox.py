@@ -0,0 +1,77 @@
+import asyncio
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from utils.utils_channel import conversation_group, user_group
+from .models import OutboxEvent
+
+
+def _record(groups, event: dict) -> None:
+    if groups:
+        OutboxEvent.objects.create(groups=groups, payload=event)
+
+
+# 记录一条推送给若干用户的待推送事件，随当前事务一同提交或回滚；视图不再在请求内逐个成员推送
+def publish(userIds, event: dict) -> None:
+    _record([user_group(userId) for userId in userIds], event)
+
+
+# 推送帧：type 对应 consumer 的处理方法，旧客户端收到后仍重新拉取；
+# event 与 data 供客户端直接应用，version 为 message 事件的 seq、read 事件的 Conversation.readVersion、
+# invitation 事件的 Conversation.invitationVersion、friend_request 事件的接收者 User.friendRequestVersion
+# 或会话与 leave 事件的 Conversation.version，均在写入推送事件的同一事务中递增，同类事件的 version 不连续即说明漏收
+def make_frame(type: str, event: str, conversationId, version, data) -> dict:
+    return {
+        "type": type,
+        "event": event,
+        "conversationId": conversationId,
+        "version": version,
+        "data": data,
+    }
+
+
+# 会话资料或成员变动后调用：递增版本号并生成携带会话快照的推送帧，应与变动处于同一事务
+def conversation_frame(conversation, type: str = "notify") -> dict:
+    version = conversation.bump_version()
+    return make_frame(type, "conversation", conversation.id, version, conversation.serialize())
+
+
+# 成员离开会话时发给该成员的推送帧，不含会话快照；version 为同一事务中发给其余成员的会话帧的版本号，
+# 该成员只收到其中之一，版本号仍连续；没有其余成员（会话随之删除）时不传，单独递增
+def leave_frame(conversation, userId: str, type: str = "notify", version=None) -> dict:
+    if version is None:
+        version = conversation.bump_version()
+    return make_frame(type, "leave", conversation.id, version, {"userId": userId})
+
+
+# 推送给会话组内所有在线连接，只需一次 group_send；
+# exclude 为不应收到该帧的用户，其连接退订前可能仍在组内，由 consumer 丢弃
+def publish_to_conversation(conversationId: int, event: dict, exclude=()) -> None:
+    if exclude:
+        event = {**event, "exclude": list(exclude)}
+    _record([conversation_group(conversationId)], event)
+
+
+# 让用户的在线连接订阅或退订会话组，frame 为随后转发给客户端的推送帧
+def publish_subscribe(userIds, conversationId: int, frame: dict) -> None:
+    publish(userIds, {"type": "subscribe", "conversationId": conversationId, "frame": frame})
+
+
+def publish_unsubscribe(userIds, conversationId: int, frame: dict) -> None:
+    publish(userIds, {"type": "unsubscribe", "conversationId": conversationId, "frame": frame})
+
+
+async def _send_batch(channelLayer, events) -> None:
+    # 事件之间按 id 顺序串行发送：同一连接既在用户组又在会话组中，订阅、退订帧须先于其后写入的会话帧到达，
+    # 不同组之间也不能乱序；只有同一事件的多个组互不依赖，并发发送以减少等待 Redis 往返的时间
+    for event in events:
+        await asyncio.gather(*(channelLayer.group_send(group, event.payload) for group in event.groups))
+
+
+# 取出最早的一批事件推送后删除，返回本批数量；推送失败时事件保留，下一轮重试
+def dispatch(batchSize: int = 500) -> int:
+    events = list(OutboxEvent.objects.order_by("id")[:batchSize])
+    if not events:
+        return 0
+    async_to_sync(_send_batch)(get_channel_layer(), events)
+    OutboxEvent.objects.filter(id__in=[event.id for event in events]).delete()
+    return len(events)
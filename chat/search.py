@@ -0,0 +1,129 @@
+import html
+import re
+import sqlite3
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Subquery, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce
+from .models import Message
+
+# 消息全文检索：SQLite FTS5 外部内容表 message_fts，内容取自 message 表，不重复存储消息正文
+# 使用 trigram 分词，中文没有空格分词也能按任意不少于 3 个字符的子串命中
+# 由 message 上的触发器随插入、删除、修改同步；迁移重建 message 表时触发器会随旧表删除，
+# 因此每次 migrate 后检查，表或触发器缺失时补建并整体重建索引
+FTS_TABLE = "message_fts"
+
+_CREATE_TABLE = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+    content, content='message', content_rowid='id', tokenize='trigram'
+)
+"""
+
+# content 可能为 NULL，写入与删除时统一按空串处理，保证删除时给出的值与写入时一致
+_TRIGGERS = {
+    f"{FTS_TABLE}_insert": f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert AFTER INSERT ON message BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, coalesce(new.content, ''));
+        END
+    """,
+    f"{FTS_TABLE}_delete": f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete AFTER DELETE ON message BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.id, coalesce(old.content, ''));
+        END
+    """,
+    f"{FTS_TABLE}_update": f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update AFTER UPDATE OF content ON message BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.id, coalesce(old.content, ''));
+            INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, coalesce(new.content, ''));
+        END
+    """,
+}
+
+# 摘要中命中部分先用控制字符标出，转义正文后再换成 <mark>，用户输入的标签不会被当作 HTML
+_START, _END = "\x02", "\x03"
+_MIN_TERM_LENGTH = 3
+# 关键词全部不足 3 个字符时无法走索引，只在最近这么多条可见消息中按子串扫描，更早的消息需用更长的关键词检索
+FALLBACK_SCAN_LIMIT = 2000
+
+
+# trigram 分词需要 SQLite 3.34 及以上
+def fts_supported(connection) -> bool:
+    return connection.vendor == "sqlite" and sqlite3.sqlite_version_info >= (3, 34, 0)
+
+
+# 连接在 ChatConfig.ready 的 post_migrate 上
+def create_search_index(using=DEFAULT_DB_ALIAS, **kwargs) -> None:
+    connection = connections[using]
+    if not fts_supported(connection):
+        return
+    names = [FTS_TABLE, *_TRIGGERS]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT name FROM sqlite_master WHERE name IN ({', '.join(['%s'] * len(names))})", names
+        )
+        existing = {name for name, in cursor.fetchall()}
+        if existing.issuperset(names):
+            return
+        cursor.execute(_CREATE_TABLE)
+        for statement in _TRIGGERS.values():
+            cursor.execute(statement)
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def _terms(query: str) -> list:
+    return query.split()
+
+
+def _mark(snippet: str) -> str:
+    return html.escape(snippet).replace(_START, "<mark>").replace(_END, "</mark>")
+
+
+# 退化路径的摘要：正文很短，整条转义后标出每个关键词
+def _mark_terms(content: str, terms) -> str:
+    pattern = re.compile("|".join(re.escape(term) for term in terms), re.I)
+    return _mark(pattern.sub(lambda match: _START + match[0] + _END, content or ""))
+
+
+# 在用户可见的消息中检索，返回 ([(message, 摘要)], hasNext)；按相关度排序，相同时新消息在前
+# 不少于 3 个字符的关键词走 FTS 索引，较短的关键词在索引命中的结果上再按子串过滤；
+# 所有关键词都较短时 trigram 无法索引，只扫描最近 FALLBACK_SCAN_LIMIT 条可见消息
+def search_messages(userId: str, query: str, conversationId=None, offset: int = 0, limit: int = 20):
+    terms = _terms(query)
+    messages = Message.objects.filter(Message.visible_to(userId))
+    if conversationId is not None:
+        messages = messages.filter(conversation_id=conversationId)
+
+    if fts_supported(connections[messages.db]):
+        indexedTerms = [term for term in terms if len(term) >= _MIN_TERM_LENGTH]
+    else:
+        indexedTerms = []
+    scannedTerms = [term for term in terms if term not in indexedTerms]
+    indexed = bool(indexedTerms)
+    if indexed:
+        # 每个关键词作为一个短语，双引号转义后用户输入不会被解析为 FTS 语法
+        expression = " ".join('"' + term.replace('"', '""') + '"' for term in indexedTerms)
+        # 命中的 rowid 用子查询过滤，与可见性等条件一样可组合；snippet 与 bm25 只能在 MATCH 查询中调用，
+        # 按 message.id 在同一表达式的 MATCH 中定位该行再计算
+        match = f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s"
+        messages = messages.filter(id__in=RawSQL(f"SELECT rowid {match}", [expression])).annotate(
+            # trigram 下 snippet 的窗口按字符计，取允许的上限 64
+            snippet=RawSQL(
+                f"SELECT snippet({FTS_TABLE}, 0, %s, %s, '…', 64) {match} AND rowid = message.id",
+                [_START, _END, expression],
+            ),
+            rank=RawSQL(f"SELECT bm25({FTS_TABLE}) {match} AND rowid = message.id", [expression]),
+        ).order_by("rank", "-id")
+    else:
+        # 按 id 倒序取第 FALLBACK_SCAN_LIMIT 条可见消息作为扫描下界，不足时扫描全部
+        oldest = messages.order_by("-id").values("id")[FALLBACK_SCAN_LIMIT - 1:FALLBACK_SCAN_LIMIT]
+        messages = messages.filter(id__gte=Coalesce(Subquery(oldest), Value(0))).order_by("-id")
+    for term in scannedTerms:
+        messages = messages.filter(content__icontains=term)
+
+    page = list(messages[offset: offset + limit + 1])
+    hasNext = len(page) > limit
+    page = page[:limit]
+    return [
+        (message, _mark(message.snippet) if indexed else _mark_terms(message.content, terms))
+        for message in page
+    ], hasNext
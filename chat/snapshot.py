@@ -0,0 +1,59 @@
+from django.core.cache import cache
+from utils.utils_request import RawJSON, dumps
+from .models import Conversation
+
+# 每个会话一份与用户无关的快照，键中带 Conversation.version：会话变动时 bump_version 后旧键自然失效，
+# 不再逐个成员删除或改写缓存。status / updateTime / version 每次从数据库读取，不进入快照。
+# 成员的昵称头像修改不会递增版本号，由过期时间兜底
+# 快照中每个成员预先编码为 JSON 字节，组装时按用户过滤后作为片段写入响应，读缓存后不再解码、重编码成员
+SNAPSHOT_TIMEOUT = 60 * 5
+# 快照的存储格式变化时递增，旧格式的缓存键不再被读取
+SNAPSHOT_FORMAT = 2
+
+
+def _key(conversationId: int, version: int) -> str:
+    return f"conversation_snapshot_{conversationId}_v{version}_f{SNAPSHOT_FORMAT}"
+
+
+def _snapshot(data: dict) -> dict:
+    snapshot = dict(data)
+    snapshot["members"] = [(member["userId"], dumps(member)) for member in data["members"]]
+    return snapshot
+
+
+# 按 id 取若干会话，并按当前用户组装：成员列表不含本人，私聊补上 otherUserId；成员为 RawJSON 数组片段，只用于写入响应
+def get_conversations(conversationIds, userId: str) -> list:
+    rows = list(
+        Conversation.objects.filter(id__in=conversationIds)
+        .order_by("id")
+        .values_list("id", "version", "status", "updateTime")
+    )
+    keys = {conversationId: _key(conversationId, version) for conversationId, version, _, _ in rows}
+    snapshots = cache.get_many(keys.values())
+
+    missing = [conversationId for conversationId, key in keys.items() if key not in snapshots]
+    if missing:
+        fresh = {
+            data["id"]: data
+            for data in Conversation.serialize_list(Conversation.objects.filter(id__in=missing))
+        }
+        fresh = {keys[conversationId]: _snapshot(data) for conversationId, data in fresh.items()}
+        cache.set_many(fresh, SNAPSHOT_TIMEOUT)
+        snapshots.update(fresh)
+
+    conversations = []
+    for conversationId, version, status, updateTime in rows:
+        snapshot = snapshots.get(keys[conversationId])
+        if snapshot is None:
+            continue
+        data = dict(snapshot)
+        members = [(memberId, encoded) for memberId, encoded in snapshot["members"] if memberId != userId]
+        # 过滤后的成员拼成一个数组片段，编码响应时每个会话只替换一次
+        data["members"] = RawJSON(b"[" + b",".join(encoded for _, encoded in members) + b"]")
+        if data["type"] == "private_chat":
+            data["otherUserId"] = members[0][0] if members else None
+        data["status"] = status
+        data["version"] = version
+        data["updateTime"] = int(updateTime.timestamp() * 1_000)
+        conversations.append(data)
+    return conversations
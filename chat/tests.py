@@ -1,7 +1,26 @@
-from django.test import TestCase
+import tempfile
+from datetime import datetime, timezone
+from io import StringIO
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import InMemoryChannelLayer, get_channel_layer
+from threading import Thread
+from unittest import mock
+from django.core.cache import cache
+from django_redis import get_redis_connection
+from django.test import TestCase, override_settings
+from django.core.management import call_command
 from django.contrib.auth.hashers import make_password
 from account.models import User
-from chat.models import Conversation, Message, Notification, Invitation
+from chat.models import Conversation, Membership, Message, MessageTombstone, Notification, Invitation, OutboxEvent, ReadState
+import chat.unread
+from chat.outbox import dispatch
+from chat.unread import get_unread, incr_unread
+from channels.testing import WebsocketCommunicator
+from tasright_backend.consumer import ChatConsumer
+from utils.constants import user_default_avatarUrl
+from utils.utils_cursor import encode_cursor
+from utils.utils_jwt import generate_jwt_token
 # Create your tests here.
 
 class ChatTest(TestCase):
@@ -26,6 +45,8 @@ class ChatTest(TestCase):
             "userName": "dave",
             "password": "123456",
         }
+        # 未读数等状态存放在共享的 Redis 中，每个用例前删除用例涉及的键
+        self.clear_redis_for_test()
         self.content_type = 'application/json'
         self.registerUrl = '/register/'
         self.loginUrl = '/login/'
@@ -34,6 +55,17 @@ class ChatTest(TestCase):
             register_data['password'] = make_password('123456')
             User.objects.create(**register_data)
 
+    # 只删除用例涉及的键，不清空共享的 Redis
+    def clear_redis_for_test(self):
+        userIds = [data["userId"] for data in (self.data1, self.data2, self.data3, self.data4)]
+        connection = get_redis_connection("default")
+        patterns = [f"{prefix}:{userId}*" for userId in userIds for prefix in ("unread", "friends", "throttle:friend_request")]
+        keys = [key for pattern in patterns for key in connection.scan_iter(pattern)]
+        if keys:
+            connection.delete(*keys)
+        cache.delete_many([f"friend_list_{userId}" for userId in userIds])
+        cache.delete_pattern("conversation_snapshot_*")
+
     def login_for_test(self,data):
         response = self.client.post(self.loginUrl, data=data, content_type=self.content_type)
         token = response.json()['token']
@@ -112,7 +144,37 @@ class ChatTest(TestCase):
         response = self.client.get(f'/chat/conversations/?userId={self.data1["userId"]}&id=1&id=2', HTTP_AUTHORIZATION=token1, content_type='application/json')
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(response.json()['conversations']), 2)
- 
+
+    def test_conversation_snapshot_cache(self):
+        token1, token2 = self.create_friendship_for_test(self.data1, self.data2)
+        self.create_group_for_test()
+        url = f'/chat/conversations/?userId={self.data1["userId"]}&id=1&id=2'
+
+        # 首次：版本号一次查询 + 批量序列化；之后只查版本号
+        with self.assertNumQueries(6):
+            response = self.client.get(url, HTTP_AUTHORIZATION=token1)
+        private, group = response.json()['conversations']
+        self.assertEqual(private['otherUserId'], self.data2['userId'])
+        self.assertEqual([member['userId'] for member in private['members']], [self.data2['userId']])
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/chat/conversations/?userId={self.data2["userId"]}&id=1&id=2', HTTP_AUTHORIZATION=token2)
+        self.assertEqual(response.json()['conversations'][0]['otherUserId'], self.data1['userId'])
+
+        # 只返回请求的会话
+        response = self.client.get(f'/chat/conversations/?userId={self.data1["userId"]}&id=2', HTTP_AUTHORIZATION=token1)
+        self.assertEqual([conversation['id'] for conversation in response.json()['conversations']], [2])
+
+        # 群资料变动递增版本号，读到的是新快照
+        self.client.post('/chat/update_group/', data={"userId": self.data1['userId'], "groupId": 2, "newName": "renamed"}, HTTP_AUTHORIZATION=token1, content_type='application/json')
+        response = self.client.get(url, HTTP_AUTHORIZATION=token1)
+        self.assertEqual(response.json()['conversations'][1]['groupName'], "renamed")
+        self.assertEqual(response.json()['conversations'][1]['version'], group['version'] + 1)
+
+        # 状态不在快照中，删除好友后立即可见
+        self.client.post('/friends/delete_friend/', data={"userId": self.data1['userId'], "friendId": self.data2['userId']}, HTTP_AUTHORIZATION=token1, content_type='application/json')
+        response = self.client.get(url, HTTP_AUTHORIZATION=token1)
+        self.assertFalse(response.json()['conversations'][0]['status'])
+
     def test_send_message(self):
         token1, token2 = self.create_friendship_for_test(self.data1, self.data2)
         self.assertEqual(Message.objects.count(), 1)
@@ -132,6 +194,139 @@ class ChatTest(TestCase):
         self.assertEqual(message.sender.userId, message_data['userId'])
         self.assertEqual(message.conversation.id, message_data['conversationId'])
 
+    @override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}})
+    def test_outbox_dispatch(self):
+        token1, token2 = self.create_friendship_for_test(self.data1, self.data2)
+        OutboxEvent.objects.all().delete()
+        message_data = {
+            "userId": self.data1['userId'],
+            "conversationId": 1,
+            "content": "Hello, I'm Alice"
+        }
+        response = self.client.post('/chat/messages/', data=message_data, HTTP_AUTHORIZATION=token1, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        event = OutboxEvent.objects.get()
+        self.assertEqual(event.groups, ["conversation.1"])
+        frame = event.payload
+        self.assertEqual((frame["type"], frame["event"], frame["conversationId"], frame["version"]), ("notify", "message", 1, 2))
+        self.assertEqual(frame["data"], Message.objects.get(seq=2).serialize())
+
+        channelLayer = get_channel_layer()
+        channelName = async_to_sync(channelLayer.new_channel)()
+        async_to_sync(channelLayer.group_add)("conversation.1", channelName)
+        self.assertEqual(dispatch(), 1)
+        self.assertEqual(OutboxEvent.objects.count(), 0)
+        self.assertEqual(async_to_sync(channelLayer.receive)(channelName), frame)
+
+        # 同一连接所在的不同组之间也按事件 id 顺序送达
+        async_to_sync(channelLayer.group_add)("user.alice", channelName)
+        for groups, type in [(["conversation.1"], "first"), (["user.alice", "user.bob"], "second"), (["conversation.1"], "third")]:
+            OutboxEvent.objects.create(groups=groups, payload={"type": type})
+        self.assertEqual(dispatch(), 3)
+        self.assertEqual([async_to_sync(channelLayer.receive)(channelName)["type"] for _ in range(3)], ["first", "second", "third"])
+
+    @override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}})
+    def test_consumer_conversation_groups(self):
+        self.create_friendship_for_test(self.data1, self.data2)
+
+        async def scenario():
+            channelLayer = get_channel_layer()
+            # 没有 token 或 token 属于其他用户时拒绝连接
+            for path in ["/chat/ws/?userId=alice", f"/chat/ws/?userId=alice&token={generate_jwt_token('bob')}"]:
+                rejected = WebsocketCommunicator(ChatConsumer.as_asgi(), path)
+                connected, _ = await rejected.connect()
+                self.assertFalse(connected)
+
+            communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), f"/chat/ws/?userId=alice&token={generate_jwt_token('alice')}")
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            # 名为 conversation_1 的用户不会被加入会话 1 的组
+            impostor = WebsocketCommunicator(
+                ChatConsumer.as_asgi(), "/chat/ws/?userId=conversation_1",
+                headers=[(b"authorization", generate_jwt_token("conversation_1").encode())],
+            )
+            connected, _ = await impostor.connect()
+            self.assertTrue(connected)
+
+            await channelLayer.group_send("conversation.1", {"type": "notify"})
+            self.assertEqual(await communicator.receive_json_from(), {"type": "notify"})
+            self.assertTrue(await impostor.receive_nothing())
+            await impostor.disconnect()
+
+            await channelLayer.group_send("user.alice", {"type": "unsubscribe", "conversationId": 1, "frame": {"type": "kick_member"}})
+            self.assertEqual(await communicator.receive_json_from(), {"type": "kick_member"})
+            await channelLayer.group_send("conversation.1", {"type": "notify"})
+            self.assertTrue(await communicator.receive_nothing())
+
+            await channelLayer.group_send("user.alice", {"type": "subscribe", "conversationId": 1, "frame": {"type": "notify"}})
+            self.assertEqual(await communicator.receive_json_from(), {"type": "notify"})
+            await channelLayer.group_send("conversation.1", {"type": "group_modify"})
+            self.assertEqual(await communicator.receive_json_from(), {"type": "group_modify"})
+            # 被排除的用户收不到该帧，其余连接收到的帧不含 exclude
+            await channelLayer.group_send("conversation.1", {"type": "kick_member", "exclude": ["alice"]})
+            self.assertTrue(await communicator.receive_nothing())
+            await channelLayer.group_send("conversation.1", {"type": "kick_member", "exclude": ["bob"]})
+            self.assertEqual(await communicator.receive_json_from(), {"type": "kick_member"})
+            await communicator.disconnect()
+
+        async_to_sync(scenario)()
+
+    @override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}})
+    def test_kicked_member_receives_no_messages(self):
+        token1 = self.login_for_test(self.data1)
+        self.create_group_for_test()
+        OutboxEvent.objects.all().delete()
+
+        def kick_then_send():
+            self.client.post('/chat/kick_member/', data={'opId': self.data1['userId'], 'groupId': 1, 'memberId': self.data2['userId']}, HTTP_AUTHORIZATION=token1, content_type='application/json')
+            self.client.post('/chat/messages/', data={"userId": self.data1['userId'], "conversationId": 1, "content": "secret after kick"}, HTTP_AUTHORIZATION=token1, content_type='application/json')
+            # 踢人与之后的消息在同一批中推送
+            self.assertEqual(dispatch(), 3)
+
+        async def scenario():
+            communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), f"/chat/ws/?userId=bob&token={generate_jwt_token('bob')}")
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            # group_discard 不生效，模拟退订尚未传播到通道层时，连接仍在会话组中
+            with mock.patch.object(InMemoryChannelLayer, "group_discard", mock.AsyncMock()):
+                await database_sync_to_async(kick_then_send)()
+                frame = await communicator.receive_json_from()
+                self.assertEqual((frame["event"], frame["data"]), ("leave", {"userId": self.data2['userId']}))
+                self.assertTrue(await communicator.receive_nothing())
+            await communicator.disconnect()
+
+        async_to_sync(scenario)()
+
+    def test_kick_member_publishes_unsubscribe(self):
+        token1 = self.login_for_test(self.data1)
+        self.create_group_for_test()
+        subscribe = OutboxEvent.objects.get(payload__type="subscribe")
+        self.assertEqual(sorted(subscribe.groups), sorted([f"user.{data['userId']}" for data in [self.data1, self.data2, self.data3]]))
+        self.assertEqual(subscribe.payload["frame"]["event"], "conversation")
+        self.assertEqual(subscribe.payload["frame"]["version"], 1)
+
+        OutboxEvent.objects.all().delete()
+        kick_data = {
+            'opId': self.data1['userId'],
+            'groupId': 1,
+            'memberId': self.data2['userId']
+        }
+        response = self.client.post('/chat/kick_member/', data=kick_data, HTTP_AUTHORIZATION=token1, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        snapshot, unsubscribe = OutboxEvent.objects.order_by("id")
+        self.assertEqual(snapshot.groups, ["conversation.1"])
+        self.assertEqual(snapshot.payload["type"], "kick_member")
+        self.assertEqual(snapshot.payload["version"], 2)
+        self.assertEqual(snapshot.payload["data"], Conversation.objects.get(id=1).serialize())
+        # 被踢成员只收到 leave 帧，不收到新的成员快照
+        self.assertEqual(snapshot.payload["exclude"], [self.data2['userId']])
+        self.assertEqual(unsubscribe.groups, [f"user.{self.data2['userId']}"])
+        self.assertEqual(unsubscribe.payload, {
+            "type": "unsubscribe",
+            "conversationId": 1,
+            "frame": {"type": "kick_member", "event": "leave", "conversationId": 1, "version": 2, "data": {"userId": self.data2['userId']}},
+        })
+
     def test_send_message_invalid_conversation(self):
         token1, token2 = self.create_friendship_for_test(self.data1, self.data2)
         delete_data = {
@@ -178,6 +373,210 @@ class ChatTest(TestCase):
             self.assertEqual(message['readList'], [])
             self.assertEqual(message['replyCount'],0)
 
+    def test_get_messages_by_cursor(self):
+        token1, token2 = self.create_friendship_for_test(self.data1, self.data2)
+        message_data = {
+            "userId": self.data1['userId'],
+            "conversationId": 1,
+            "content": "Hello, I'm Alice"
+        }
+        for i in range(4):
+            message_data['content'] = f"Hello, I'm Alice {i}"
+            self.client.post('/chat/messages/', data=message_data, HTTP_AUTHORIZATION=token1, content_type='application/json')
+        # 同一毫秒内的消息也不能被跳过
+        Message.objects.update(updateTime=Message.objects.get(id=1).updateTime)
+
+        receivedIds = []
+        cursor = ''
+        while True:
+            response = self.client.get(f'/chat/messages/?userId={self.data1["userId"]}&cursor={cursor}&limit=2', HTTP_AUTHORIZATION=token1, content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+            receivedIds += [message['id'] for message in response.json()['messages']]
+            cursor = response.json()['nextCursor']
+            if not response.json()['hasNext']:
+                break
+        self.assertEqual(receivedIds, [1, 2, 3, 4, 5])
+
+        response = self.client.get(f'/chat/messages/?userId={self.data1["userId"]}&cursor={cursor}', HTTP_AUTHORIZATION=token1, content_type='application/json')
+        self.assertEqual(response.json()['messages'], [])
+        self.assertEqual(response.json()['nextCursor'], cursor)
+
+        response = self.client.get(f'/chat/messages/?userId={self.data1["userId"]}&cursor=invalid', HTTP_AUTHORIZATION=token1, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['code'], -2)
+        # 篡改的游标：数值越界、为负或超出 datetime 范围
+        for cursor in [encode_cursor(10 ** 30, 1), encode_cursor(-1, 1), encode_cursor(2 ** 62, 1)]:
+            response = self.client.get(f'/chat/messages/?userId={self.data1["userId"]}&cursor={cursor}', HTTP_AUTHORIZATION=token1)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json()['info'], "游标格式错误")
+        for limit in ["abc", "0", "-1"]:
+            response = self.client.get(f'/chat/messages/?userId={self.data1["userId"]}&limit={limit}', HTTP_AUTHORIZATION=token1)
+            self.assertEqual(response.status_code, 400)
+
+        # 给出 conversationId 时只返回该会话的消息
+        self.create_friendship_for_test(self.data1, self.data3)
+        response = self.client.get(f'/chat/messages/?userId={self.data1["userId"]}&conversationId=2', HTTP_AUTHORIZATION=token1)
+        self.assertEqual({message['conversation'] for message in response.json()['messages']}, {2})
+
+    def test_get_messages_query_count(self):
+        token1, token2 = self.create_friendship_for_test(self.data1, self.data2)
+        message_data = {
+            "userId": self.data2['userId'],
+            "conversationId": 1,
+            "content": "Hello, I'm Bob"
+        }
+        url = f'/chat/messages/?userId={self.data1["userId"]}'
+        with self.assertNumQueries(4):
+            Message.serialize_list(Message.objects.all())
+        response = self.client.get(url, HTTP_AUTHORIZATION=token1)
+        self.assertEqual(len(response.json()['messages']), 1)
+
+        for i in range(20):
+            self.client.post('/chat/messages/', data=message_data, HTTP_AUTHORIZATION=token2, content_type='application/json')
+        self.client.post('/chat/read_message/', data={"userId": self.data1['userId'], "conversationId": 1}, HTTP_AUTHORIZATION=token1, content_type='application/json')
+        self.client.post('/chat/delete_message/', data={"userId": self.data2['userId'], "messageId": 2}, HTTP_AUTHORIZATION=token2, content_type='application/json')
+
+        # 页大小变化不影响查询次数
+        with self.assertNumQueries(4):
+            messagesData = Message.serialize_list(Message.objects.all())
+        self.assertEqual(len(messagesData), 21)
+        self.assertEqual(messagesData[1]['readList'], [self.data1['userName']])
+        self.assertEqual(messagesData[1]['deleteList'], [self.data2['userId']])
+        with self.assertNumQueries(3):
+            response = self.client.get(url, HTTP_AUTHORIZATION=token1)
+        self.assertEqual(len(response.json()['messages']), 21)
+
+    def test_serialize_conversations_query_count(self):
+        self.create_friendship_for_test(self.data1, self.data2)
+        self.create_group_for_test()
+        alice, bob, carol = [User.objects.get(userId=data['userId']) for data in [self.data1, self.data2, self.data3]]
+        group = Conversation.objects.get(type="group_chat")
+        group.admins.add(bob)
+        Notification.objects.create(conversation=group, content="old", user=alice, timestamp=datetime.now(timezone.utc))
+        Notification.objects.create(conversation=group, content="notice", user=alice, timestamp=datetime.now(timezone.utc))
+
+        # 会话、成员、管理员、群主各一次查询，群公告计数与最新一条各一次
+        with self.assertNumQueries(6):
+            data = Conversation.serialize_list(Conversation.objects.order_by("id"), alice.userId)
+        self.assertEqual(data[0]['otherUserId'], bob.userId)
+        self.assertEqual([member['userId'] for member in data[0]['members']], [bob.userId])
+        self.assertEqual(data[1], group.serialize(alice.userId))
+        self.assertEqual(data[1]['adminIdList'], [bob.userId])
+        self.assertEqual(data[1]['latestNotification']['content'], "notice")
+        self.assertEqual(data[1]['latestNotification']['userName'], alice.userName)
+        self.assertEqual(data[1]['notificationCount'], 2)
+        self.assertNotIn('groupNotificationList', data[1])
+
+        # 补足到 500 个会话后查询次数不变
+        conversations = Conversation.objects.bulk_create([
+            Conversation(type="group_chat", host=alice, groupName=f"group {i}") if i % 2 else Conversation(type="private_chat")
+            for i in range(498)
+        ])
+        Members = Conversation.members.through
+        Members.objects.bulk_create([
+            Members(conversation_id=conversation.id, user_id=user.id)
+            for conversation in conversations for user in [alice, bob, carol][:3 if conversation.type == "group_chat" else 2]
+        ])
+        Admins = Conversation.admins.through
+        Admins.objects.bulk_create([
+            Admins(conversation_id=conversation.id, user_id=carol.id)
+            for conversation in conversations if conversation.type == "group_chat"
+        ])
+        with self.assertNumQueries(6):
+            data = Conversation.serialize_list(Conversation.objects.order_by("id"), alice.userId)
+        self.assertEqual(len(data), 500)
+        self.assertEqual(data[-1]['adminIdList'], [carol.userId])
+        self.assertEqual(data[-2]['otherUserId'], bob.userId)
+
+    def test_sync_messages_by_seq(self):
+        token1, token2 = self.create_friendship_for_test(self.data1, self.data2)
+        self.create_friendship_for_test(self.data1, self.data3)
+        message_data = {
+            "userId": self.data1['userId'],
+            "conversationId": 1,
+            "content": "Hello, I'm Alice"
+        }
+        for i in range(3):
+            self.client.post('/chat/messages/', data=message_data, HTTP_AUTHORIZATION=token1, content_type='application/json')
+        self.assertEqual(list(Message.objects.filter(conversation_id=1).values_list('seq', flat=True)), [1, 2, 3, 4])
+        self.assertEqual(list(Message.objects.filter(conversation_id=2).values_list('seq', flat=True)), [1])
+        self.assertEqual(Conversation.objects.get(id=1).lastSeq, 4)
+
+        response = self.client.get(f'/chat/sync/?userId={self.data1["userId"]}&conversationId=1&afterSeq=1&limit=2', HTTP_AUTHORIZATION=token1)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([message['seq'] for message in response.json()['messages']], [2, 3])
+        self.assertTrue(response.json()['hasNext'])
+        self.assertEqual(response.json()['lastSeq'], 3)
+
+        # 回复会改写原消息的 updateTime，但不会让它在按 seq 同步时再次出现
+        message_data['replyId'] = 3
+        self.client.post('/chat/messages/', data=message_data, HTTP_AUTHORIZATION=token1, content_type='application/json')
+        response = self.client.get(f'/chat/sync/?userId={self.data1["userId"]}&conversationId=1&afterSeq=3', HTTP_AUTHORIZATION=token1)
+        self.assertEqual([message['seq'] for message in response.json()['messages']], [4, 5])
+        self.assertFalse(response.json()['hasNext'])
+        response = self.client.get(f'/chat/sync/?userId={self.data1["userId"]}&conversationId=1&limit=0', HTTP_AUTHORIZATION=token1)
+        self.assertEqual(response.status_code, 400)
+
+    def test_backfill_message_seq(self):
+        self.create_friendship_for_test(self.data1, self.data2)
+        sender = User.objects.get(userId=self.data1['userId'])
+        message = Message.objects.get(id=1)
+        for _ in range(2):
+            Message.objects.create(conversation_id=1, sender=sender, sendTime=message.sendTime, updateTime=message.updateTime)
+        call_command('backfill_message_seq', stdout=StringIO())
+        self.assertEqual(list(Message.objects.order_by('id').values_list('seq', flat=True)), [1, 2, 3])
+        self.assertEqual(Conversation.objects.get(id=1).lastSeq, 3)
+
+    def test_membership_visibility(self):
+        token1 = self.login_for_test(self.data1)
+        self.create_new_user_for_test()
+        self.create_group_for_test()
+        message_data = {
+            "userId": self.data1['userId'],
+            "conversationId": 1,
+            "content": "before dave joined"
+        }
+        for _ in range(2):
+            self.client.post('/chat/messages/', data=message_data, HTTP_AUTHORIZATION=token1, content_type='application/json')
+        # 发消息不再为每个成员写接收记录
+        self.assertEqual(Message.receivers.through.objects.count(), 0)
+
+        invite_data = {'opId': self.data1['userId'], 'groupId': 1, 'memberIds': [self.data4['userId']]}
+        self.client.post('/chat/invite_member/', data=invite_data, HTTP_AUTHORIZATION=token1, content_type='application/json')
+        message_data['content'] = "after dave joined"
+        self.client.post('/chat/messages/', data=message_data, HTTP_AUTHORIZATION=token1, content_type='application/json')
+        kick_data = {'opId': self.data1['userId'], 'groupId': 1, 'memberId': self.data3['userId']}
+        self.client.post('/chat/kick_member/', data=kick_data, HTTP_AUTHORIZATION=token1, content_type='application/json')
+        message_data['content'] = "after carol left"
+        self.client.post('/chat/messages/', data=message_data, HTTP_AUTHORIZATION=token1, content_type='application/json')
+
+        visibleSeqs = {}
+        for data in [self.data1, self.data3, self.data4]:
+            token = self.login_for_test(data)
+            response = self.client.get(f'/chat/messages/?userId={data["userId"]}', HTTP_AUTHORIZATION=token)
+            visibleSeqs[data['userId']] = [message['seq'] for message in response.json()['messages']]
+        self.assertEqual(visibleSeqs[self.data1['userId']], [1, 2, 3, 4])
+        self.assertEqual(visibleSeqs[self.data3['userId']], [1, 2, 3])
+        self.assertEqual(visibleSeqs[self.data4['userId']], [3, 4])
+
+    def test_backfill_memberships(self):
+        token1 = self.login_for_test(self.data1)
+        self.create_group_for_test()
+        for _ in range(2):
+            self.client.post('/chat/messages/', data={"userId": self.data1['userId'], "conversationId": 1, "content": "hi"}, HTTP_AUTHORIZATION=token1, content_type='application/json')
+        Membership.objects.all().delete()
+        users = {user.userId: user for user in User.objects.all()}
+        # 旧数据：carol 只收到第一条消息后离开
+        for message in Message.objects.all():
+            message.receivers.set([users['alice'], users['bob']] + ([users['carol']] if message.seq == 1 else []))
+        Conversation.objects.get(id=1).members.remove(users['carol'])
+
+        call_command('backfill_memberships', stdout=StringIO())
+        self.assertEqual(Message.receivers.through.objects.count(), 0)
+        carol = Membership.objects.get(user=users['carol'])
+        self.assertEqual((carol.joinedSeq, carol.leftSeq), (0, 1))
+        self.assertEqual(Membership.objects.filter(leftSeq__isnull=True).count(), 2)
+
     def test_reply_message(self):
         token1, token2 = self.create_friendship_for_test(self.data1, self.data2)
         conversation_id = 1
@@ -247,7 +646,7 @@ class ChatTest(TestCase):
             response = self.client.post('/chat/messages/', data=message_data, HTTP_AUTHORIZATION=token2, content_type='application/json')
             self.assertEqual(response.status_code, 200)
             message = Message.objects.get(id=i+2)
-            self.assertEqual(message.readUsers.count(), 0)
+            self.assertEqual(message.serialize()['readList'], [])
 
         read_data = {
             "userId": self.data1['userId'],
@@ -258,12 +657,35 @@ class ChatTest(TestCase):
 
         self.assertEqual(response.status_code, 200)
         
+        # 已读只写一行水位线，不再逐条写已读记录
+        self.assertEqual(ReadState.objects.count(), 1)
+        self.assertEqual(ReadState.objects.get(user__userId=self.data1['userId']).lastReadSeq, 11)
+        self.assertEqual(Message.readUsers.through.objects.count(), 0)
         for i in range(1,11):
             message = Message.objects.get(id=i)
-            read_list = message.readUsers.all().values_list('userId', flat=True)
-            self.assertEqual(len(read_list), 1)
-            self.assertEqual(read_list[0], self.data1['userId'])
-            self.assertNotEqual(message.sendTime, message.updateTime)
+            self.assertEqual(message.serialize()['readList'], [self.data1['userName']])
+
+        response = self.client.get(f'/chat/get_unread_count/?userId={self.data1["userId"]}&conversationId={conversation_id}', HTTP_AUTHORIZATION=token1)
+        self.assertEqual(response.json()['count'], 0)
+
+        # 已读帧的版本号逐帧加一，与水位线跳跃的幅度无关
+        self.client.post('/chat/read_message/', data={"userId": self.data2['userId'], "conversationId": conversation_id}, HTTP_AUTHORIZATION=token2, content_type='application/json')
+        versions = [event.payload["version"] for event in OutboxEvent.objects.filter(payload__event="read").order_by("id")]
+        self.assertEqual(versions, [1, 2])
+
+    def test_backfill_read_states(self):
+        token1, token2 = self.create_friendship_for_test(self.data1, self.data2)
+        for i in range(3):
+            self.client.post('/chat/messages/', data={"userId": self.data2['userId'], "conversationId": 1, "content": f"{i}"}, HTTP_AUTHORIZATION=token2, content_type='application/json')
+        alice = User.objects.get(userId=self.data1['userId'])
+        for message in Message.objects.filter(seq__lte=3):
+            message.readUsers.add(alice)
+
+        call_command('backfill_read_states', stdout=StringIO())
+        self.assertEqual(ReadState.objects.get(conversation_id=1, user=alice).lastReadSeq, 3)
+        self.assertEqual(Message.readUsers.through.objects.count(), 0)
+        self.assertEqual(Message.objects.get(seq=3).serialize()['readList'], [self.data1['userName']])
+        self.assertEqual(Message.objects.get(seq=4).serialize()['readList'], [])
                  
     def test_delete_message(self):
         token1, token2 = self.create_friendship_for_test(self.data1, self.data2)
@@ -277,11 +699,73 @@ class ChatTest(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(response.json()['messages']), 0)
         message = Message.objects.get(id=1)
-        self.assertTrue(message.deleteUsers.filter(userId=self.data1['userId']).exists())
-        self.assertFalse(message.deleteUsers.filter(userId=self.data2['userId']).exists())
+        self.assertEqual(message.serialize()['deleteList'], [self.data1['userId']])
         response = self.client.get(f'/chat/messages/?userId={self.data2["userId"]}&conversationId=1', HTTP_AUTHORIZATION=token2, content_type='application/json')
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(response.json()['messages']), 1)
+        response = self.client.post('/chat/delete_message/', data=delete_data, HTTP_AUTHORIZATION=token1, content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.json()['info'], '消息已删除')
+
+    def test_delete_messages_in_bulk(self):
+        token1, token2 = self.create_friendship_for_test(self.data1, self.data2)
+        for i in range(5):
+            self.client.post('/chat/messages/', data={"userId": self.data2['userId'], "conversationId": 1, "content": f"{i}"}, HTTP_AUTHORIZATION=token2, content_type='application/json')
+        delete_data = {
+            "userId": self.data1['userId'],
+            "messageIds": [1, 2, 3, 5],
+        }
+        # 用户、消息、被删除的未读数统计各一次查询，写入删除区间时在保存点内查询相接的旧区间再批量写入，与消息条数无关
+        with self.assertNumQueries(7):
+            response = self.client.post('/chat/delete_messages/', data=delete_data, HTTP_AUTHORIZATION=token1, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 4)
+        # seq 1-3 合并为一个区间
+        self.assertEqual(list(MessageTombstone.objects.order_by('startSeq').values_list('startSeq', 'endSeq')), [(1, 3), (5, 5)])
+
+        response = self.client.get(f'/chat/messages/?userId={self.data1["userId"]}', HTTP_AUTHORIZATION=token1)
+        self.assertEqual([message['id'] for message in response.json()['messages']], [4, 6])
+        response = self.client.get(f'/chat/sync/?userId={self.data1["userId"]}&conversationId=1', HTTP_AUTHORIZATION=token1)
+        self.assertEqual([message['seq'] for message in response.json()['messages']], [4, 6])
+
+        # 已删除的消息不再计数；新区间与相邻、重叠的旧区间合并为一行
+        response = self.client.post('/chat/delete_messages/', data={**delete_data, "messageIds": [3, 4, 5]}, HTTP_AUTHORIZATION=token1, content_type='application/json')
+        self.assertEqual(response.json()['count'], 1)
+        self.assertEqual(list(MessageTombstone.objects.values_list('startSeq', 'endSeq')), [(1, 5)])
+        response = self.client.post('/chat/delete_messages/', data={**delete_data, "messageIds": [1, 2]}, HTTP_AUTHORIZATION=token1, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(MessageTombstone.objects.values_list('startSeq', 'endSeq')), [(1, 5)])
+        for messageIds in [["abc"], ["1"], [1.5], [None]]:
+            response = self.client.post('/chat/delete_messages/', data={**delete_data, "messageIds": messageIds}, HTTP_AUTHORIZATION=token1, content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+
+    def test_tombstone_ranges_merge(self):
+        self.create_group_for_test()
+        alice = User.objects.get(userId=self.data1['userId'])
+        MessageTombstone.hide(alice.id, {1: [2, 3, 8, 9, 20]})
+        # 与 (2, 3) 相邻、覆盖 (8, 9)，(20, 20) 不受影响
+        MessageTombstone.hide(alice.id, {1: [4, 5, 6, 7, 8, 9, 10]})
+        self.assertEqual(list(MessageTombstone.objects.order_by('startSeq').values_list('startSeq', 'endSeq')), [(2, 10), (20, 20)])
+        MessageTombstone.hide(alice.id, {1: [1, 11, 19]})
+        self.assertEqual(list(MessageTombstone.objects.order_by('startSeq').values_list('startSeq', 'endSeq')), [(1, 11), (19, 20)])
+        # 其他用户的区间互不合并
+        bob = User.objects.get(userId=self.data2['userId'])
+        MessageTombstone.hide(bob.id, {1: [12]})
+        self.assertEqual(list(MessageTombstone.objects.filter(user=alice).order_by('startSeq').values_list('startSeq', 'endSeq')), [(1, 11), (19, 20)])
+
+    def test_backfill_message_tombstones(self):
+        token1, token2 = self.create_friendship_for_test(self.data1, self.data2)
+        for i in range(3):
+            self.client.post('/chat/messages/', data={"userId": self.data2['userId'], "conversationId": 1, "content": f"{i}"}, HTTP_AUTHORIZATION=token2, content_type='application/json')
+        alice = User.objects.get(userId=self.data1['userId'])
+        for message in Message.objects.filter(seq__in=[2, 3]):
+            message.deleteUsers.add(alice)
+
+        call_command('backfill_message_tombstones', stdout=StringIO())
+        self.assertEqual(list(MessageTombstone.objects.values_list('startSeq', 'endSeq')), [(2, 3)])
+        self.assertEqual(Message.deleteUsers.through.objects.count(), 0)
+        response = self.client.get(f'/chat/sync/?userId={self.data1["userId"]}&conversationId=1', HTTP_AUTHORIZATION=token1)
+        self.assertEqual([message['seq'] for message in response.json()['messages']], [1, 4])
         
     def test_get_unread_count(self):
         token1, token2 = self.create_friendship_for_test(self.data1, self.data2)
@@ -302,7 +786,177 @@ class ChatTest(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.json()['count'], 11)
 
-    
+
+    def test_unread_counter_lifecycle(self):
+        token1, token2 = self.create_friendship_for_test(self.data1, self.data2)
+        url = f'/chat/get_unread_count/?userId={self.data1["userId"]}&conversationId=1'
+        # 首次读取时从数据库重建：好友申请通过后的第一条消息未读
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION=token1).json()['count'], 1)
+
+        for i in range(3):
+            self.client.post('/chat/messages/', data={"userId": self.data2['userId'], "conversationId": 1, "content": f"{i}"}, HTTP_AUTHORIZATION=token2, content_type='application/json')
+        self.client.post('/chat/messages/', data={"userId": self.data1['userId'], "conversationId": 1, "content": "mine"}, HTTP_AUTHORIZATION=token1, content_type='application/json')
+        self.assertEqual(get_unread(self.data1['userId']), {1: 4})
+
+        self.client.post('/chat/delete_messages/', data={"userId": self.data1['userId'], "messageIds": [2, 3, 5]}, HTTP_AUTHORIZATION=token1, content_type='application/json')
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION=token1).json()['count'], 2)
+
+        self.client.post('/chat/read_message/', data={"userId": self.data1['userId'], "conversationId": 1}, HTTP_AUTHORIZATION=token1, content_type='application/json')
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION=token1).json()['count'], 0)
+
+        # 哈希丢失后重建的结果与增量维护一致
+        self.client.post('/chat/messages/', data={"userId": self.data2['userId'], "conversationId": 1, "content": "again"}, HTTP_AUTHORIZATION=token2, content_type='application/json')
+        self.assertEqual(get_unread(self.data1['userId']), {1: 1})
+        get_redis_connection("default").delete(f"unread:{self.data1['userId']}")
+        self.assertEqual(get_unread(self.data1['userId']), {1: 1})
+        self.assertGreater(get_redis_connection("default").ttl(f"unread:{self.data1['userId']}"), 0)
+
+    def test_unread_increment_during_rebuild(self):
+        token1 = self.login_for_test(self.data1)
+        token2 = self.login_for_test(self.data2)
+        self.create_group_for_test()
+        self.client.post('/chat/messages/', data={"userId": self.data2['userId'], "conversationId": 1, "content": "hello"}, HTTP_AUTHORIZATION=token2, content_type='application/json')
+        messageId = Message.objects.get(content="hello").id
+        get_redis_connection("default").delete(f"unread:{self.data1['userId']}")
+
+        # 重建查询数据库之后、写入哈希之前到达的增量不会丢失
+        count = chat.unread.count_unread_among
+        def count_then_update(*args):
+            counts = count(*args)
+            for content in ["again", "and again"]:
+                self.client.post('/chat/messages/', data={"userId": self.data2['userId'], "conversationId": 1, "content": content}, HTTP_AUTHORIZATION=token2, content_type='application/json')
+            self.client.post('/chat/delete_message/', data={"userId": self.data1['userId'], "messageId": messageId}, HTTP_AUTHORIZATION=token1, content_type='application/json')
+            return counts
+        with mock.patch("chat.unread.count_unread_among", count_then_update):
+            get_unread(self.data1['userId'])
+        self.assertEqual(get_unread(self.data1['userId']), {1: 2})
+        self.assertFalse(get_redis_connection("default").exists(f"unread:{self.data1['userId']}:journal"))
+
+    def test_get_inbox(self):
+        token1 = self.login_for_test(self.data1)
+        self.create_group_for_test()
+        _, token2 = self.create_friendship_for_test(self.data1, self.data2)
+        self.client.post('/chat/messages/', data={"userId": self.data1['userId'], "conversationId": 1, "content": "hello group"}, HTTP_AUTHORIZATION=token1, content_type='application/json')
+        self.client.post('/chat/messages/', data={"userId": self.data2['userId'], "conversationId": 2, "content": "x" * 80}, HTTP_AUTHORIZATION=token2, content_type='application/json')
+        get_unread(self.data1['userId'])
+
+        # 用户、当前页会话、私聊对方用户各一次查询，与会话数无关
+        with self.assertNumQueries(3):
+            response = self.client.get(f'/chat/inbox/?userId={self.data1["userId"]}&limit=1', HTTP_AUTHORIZATION=token1)
+        self.assertEqual(response.status_code, 200)
+        first = response.json()['conversations']
+        self.assertTrue(response.json()['hasNext'])
+        self.assertEqual([conversation['id'] for conversation in first], [2])
+        self.assertEqual(first[0]['otherUser']['userId'], self.data2['userId'])
+        self.assertEqual(first[0]['lastMessage']['snippet'], "x" * 50)
+        self.assertEqual(first[0]['lastMessage']['senderId'], self.data2['userId'])
+        self.assertEqual(first[0]['unreadCount'], 2)
+
+        cursor = response.json()['nextCursor']
+        response = self.client.get(f'/chat/inbox/?userId={self.data1["userId"]}&limit=1&cursor={cursor}', HTTP_AUTHORIZATION=token1)
+        second = response.json()['conversations']
+        self.assertFalse(response.json()['hasNext'])
+        self.assertEqual([conversation['id'] for conversation in second], [1])
+        self.assertEqual(second[0]['lastMessage']['snippet'], "hello group")
+        self.assertEqual(second[0]['hostId'], self.data1['userId'])
+        self.assertEqual(second[0]['unreadCount'], 0)
+        for limit in ["abc", "0", "-1"]:
+            response = self.client.get(f'/chat/inbox/?userId={self.data1["userId"]}&limit={limit}', HTTP_AUTHORIZATION=token1)
+            self.assertEqual(response.status_code, 400)
+        for cursor in [encode_cursor(10 ** 30, 1), encode_cursor(2 ** 62, 1)]:
+            response = self.client.get(f'/chat/inbox/?userId={self.data1["userId"]}&cursor={cursor}', HTTP_AUTHORIZATION=token1)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json()['info'], "游标格式错误")
+
+        for _ in range(5):
+            self.create_group_for_test()
+        with self.assertNumQueries(3):
+            response = self.client.get(f'/chat/inbox/?userId={self.data1["userId"]}', HTTP_AUTHORIZATION=token1)
+        self.assertEqual(len(response.json()['conversations']), 7)
+
+    def test_backfill_last_message(self):
+        token1, token2 = self.create_friendship_for_test(self.data1, self.data2)
+        self.client.post('/chat/messages/', data={"userId": self.data1['userId'], "conversationId": 1, "content": "latest"}, HTTP_AUTHORIZATION=token1, content_type='application/json')
+        summary = Conversation.objects.get(id=1).serialize_last_message()
+        Conversation.objects.update(lastMessageId=None, lastMessageSnippet="")
+        call_command("backfill_last_message", stdout=StringIO())
+        self.assertEqual(Conversation.objects.get(id=1).serialize_last_message(), summary)
+
+    def test_convert_avatars(self):
+        self.create_friendship_for_test(self.data1, self.data2)
+        with tempfile.TemporaryDirectory() as root, self.settings(AVATAR_ROOT=root):
+            User.objects.update(avatarUrl=user_default_avatarUrl)
+            User.objects.filter(userId=self.data2['userId']).update(avatarUrl="data:image/jpeg;base64,???")
+            call_command("convert_avatars", stdout=StringIO())
+
+            avatarUrl = User.objects.get(userId=self.data1['userId']).avatarUrl
+            self.assertRegex(avatarUrl, r'^/avatars/[0-9a-f]{64}\.jpg$')
+            self.assertEqual(self.client.get(avatarUrl).status_code, 200)
+            # 无法解析的取值保持不变
+            self.assertEqual(User.objects.get(userId=self.data2['userId']).avatarUrl, "data:image/jpeg;base64,???")
+
+    def test_backfill_pair_keys(self):
+        self.create_friendship_for_test(self.data1, self.data2)
+        alice, bob = User.objects.get(userId=self.data1['userId']), User.objects.get(userId=self.data2['userId'])
+        # 历史上同一对用户的重复私聊：配对键给有效的那个
+        stale = Conversation.objects.create(type="private_chat", status=False)
+        stale.members.set([alice, bob])
+        Conversation.objects.update(pairKey=None)
+        call_command("backfill_pair_keys", stdout=StringIO())
+        self.assertEqual(Conversation.objects.get(id=1).pairKey, "alice:bob")
+        self.assertIsNone(Conversation.objects.get(id=stale.id).pairKey)
+        self.assertEqual(Conversation.private_between("bob", "alice").id, 1)
+
+    def test_get_unread_counts(self):
+        token1 = self.login_for_test(self.data1)
+        self.create_group_for_test()
+        _, token2 = self.create_friendship_for_test(self.data1, self.data2)
+        for i in range(2):
+            self.client.post('/chat/messages/', data={"userId": self.data2['userId'], "conversationId": 1, "content": f"{i}"}, HTTP_AUTHORIZATION=token2, content_type='application/json')
+
+        # 冷缓存：用户、会话列表、分组聚合各一次查询，与会话数无关
+        with self.assertNumQueries(3):
+            response = self.client.get(f'/chat/unread_counts/?userId={self.data1["userId"]}', HTTP_AUTHORIZATION=token1)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['counts'], [{"conversationId": 1, "count": 2}, {"conversationId": 2, "count": 1}])
+        self.assertEqual(response.json()['total'], 3)
+
+        with self.assertNumQueries(0):
+            response = self.client.get(f'/chat/unread_counts/?userId={self.data1["userId"]}&conversationIds=2,99', HTTP_AUTHORIZATION=token1)
+        self.assertEqual(response.json()['counts'], [{"conversationId": 2, "count": 1}])
+
+        response = self.client.get(f'/chat/unread_counts/?userId={self.data1["userId"]}&conversationIds=a', HTTP_AUTHORIZATION=token1)
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(f'/chat/unread_counts/?userId={self.data2["userId"]}', HTTP_AUTHORIZATION=token1)
+        self.assertEqual(response.status_code, 401)
+
+    def test_unread_counter_concurrent_senders(self):
+        self.create_friendship_for_test(self.data1, self.data2)
+        self.assertEqual(get_unread(self.data1['userId']), {1: 1})
+
+        def send():
+            for _ in range(50):
+                incr_unread([self.data1['userId']], 1)
+
+        threads = [Thread(target=send) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(get_unread(self.data1['userId']), {1: 1 + 8 * 50})
+
+    def test_unread_counter_membership(self):
+        token1 = self.login_for_test(self.data1)
+        self.create_group_for_test()
+        for data in [self.data1, self.data2, self.data3]:
+            self.assertEqual(get_unread(data['userId']), {1: 0})
+
+        self.client.post('/chat/messages/', data={"userId": self.data1['userId'], "conversationId": 1, "content": "hi"}, HTTP_AUTHORIZATION=token1, content_type='application/json')
+        self.assertEqual(get_unread(self.data2['userId']), {1: 1})
+        self.client.post('/chat/kick_member/', data={"opId": self.data1['userId'], "groupId": 1, "memberId": self.data2['userId']}, HTTP_AUTHORIZATION=token1, content_type='application/json')
+        self.assertEqual(get_unread(self.data2['userId']), {})
+        self.assertEqual(get_unread(self.data3['userId']), {1: 1})
+
     def test_create_group_conversation(self):
         token1 = self.login_for_test(self.data1)
         group_data = {
@@ -318,7 +972,7 @@ class ChatTest(TestCase):
         self.assertEqual(conversation.type, "group_chat")
         self.assertEqual(list(conversation.members.all().values_list('userId', flat=True)), [self.data1['userId'], self.data2['userId'], self.data3['userId']])
         self.assertEqual(conversation.host.userId, self.data1['userId'])
-        self.assertEqual(conversation.groupNotificationList.count(), 0)
+        self.assertEqual(conversation.notifications.count(), 0)
   
     def test_create_group_conversation_invalid_member(self):
         token1 = self.login_for_test(self.data1)
@@ -357,11 +1011,109 @@ class ChatTest(TestCase):
         response = self.client.post('/chat/upload_notification/', data=notification_data, HTTP_AUTHORIZATION=token1, content_type='application/json')
 
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(Conversation.objects.get(id=1).groupNotificationList.count(), 1)
+        self.assertEqual(Conversation.objects.get(id=1).notifications.count(), 1)
         self.assertEqual(Notification.objects.get(id=1).content, "This is a test notification")
-        self.assertEqual(Notification.objects.get(id=1).userId, self.data1['userId'])
+        self.assertEqual(Notification.objects.get(id=1).user.userId, self.data1['userId'])
         self.assertEqual(Notification.objects.get(id=1).conversation.id, 1)
 
+    def test_get_notifications_paginated(self):
+        token1 = self.login_for_test(self.data1)
+        self.create_group_for_test()
+        for i in range(5):
+            self.client.post('/chat/upload_notification/', data={"userId": self.data1['userId'], "groupId": 1, "content": f"notice {i}"}, HTTP_AUTHORIZATION=token1, content_type='application/json')
+        group = self.client.get(f'/chat/conversations/?userId={self.data1["userId"]}&id=1', HTTP_AUTHORIZATION=token1).json()['conversations'][0]
+        self.assertEqual(group['latestNotification']['content'], "notice 4")
+        self.assertEqual(group['notificationCount'], 5)
+
+        url = f'/chat/notifications/?userId={self.data1["userId"]}&conversationId=1&limit=2'
+        contents, cursor = [], None
+        while True:
+            # 成员校验、一页公告连同发布者各一次查询
+            with self.assertNumQueries(2):
+                response = self.client.get(url + (f'&cursor={cursor}' if cursor else ''), HTTP_AUTHORIZATION=token1)
+            self.assertEqual(response.status_code, 200)
+            contents += [notification['content'] for notification in response.json()['notifications']]
+            cursor = response.json()['nextCursor']
+            if not response.json()['hasNext']:
+                break
+        self.assertEqual(contents, [f"notice {i}" for i in reversed(range(5))])
+        self.assertEqual(response.json()['notifications'][0]['userId'], self.data1['userId'])
+
+        User.objects.create(**{**self.data4, "password": make_password(self.data4['password'])})
+        token4 = self.login_for_test(self.data4)
+        response = self.client.get(f'/chat/notifications/?userId={self.data4["userId"]}&conversationId=1', HTTP_AUTHORIZATION=token4)
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(url + '&cursor=!', HTTP_AUTHORIZATION=token1)
+        self.assertEqual(response.status_code, 400)
+        for limit in ["abc", "0", "-1"]:
+            response = self.client.get(f'/chat/notifications/?userId={self.data1["userId"]}&conversationId=1&limit={limit}', HTTP_AUTHORIZATION=token1)
+            self.assertEqual(response.status_code, 400)
+
+    def test_search_messages(self):
+        token1 = self.login_for_test(self.data1)
+        token2 = self.login_for_test(self.data2)
+        self.create_group_for_test()
+        for content in ["hello world", "say hello to <b>bob</b>", "你好世界，今天天气不错", "goodbye"]:
+            self.client.post('/chat/messages/', data={"conversationId": 1, "userId": self.data1['userId'], "content": content}, HTTP_AUTHORIZATION=token1, content_type=self.content_type)
+
+        url = f'/chat/search/?userId={self.data2["userId"]}'
+        response = self.client.get(url + '&q=hello', HTTP_AUTHORIZATION=token2)
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual({result['message']['content'] for result in results}, {"hello world", "say hello to <b>bob</b>"})
+        self.assertIn("<mark>hello</mark>", results[0]['snippet'])
+        # 摘要中的用户内容经过转义
+        snippet = next(result['snippet'] for result in results if "bob" in result['snippet'])
+        self.assertIn("&lt;b&gt;bob&lt;/b&gt;", snippet)
+
+        # 多个关键词须同时命中；中文按子串命中
+        response = self.client.get(url + '&q=hello world', HTTP_AUTHORIZATION=token2)
+        self.assertEqual([result['message']['content'] for result in response.json()['results']], ["hello world"])
+        response = self.client.get(url + '&q=天气不错', HTTP_AUTHORIZATION=token2)
+        self.assertEqual(response.json()['results'][0]['message']['content'], "你好世界，今天天气不错")
+        # 不足 3 个字符的关键词退化为子串扫描
+        response = self.client.get(url + '&q=你好', HTTP_AUTHORIZATION=token2)
+        self.assertEqual(response.json()['results'][0]['snippet'], "<mark>你好</mark>世界，今天天气不错")
+        # 长短关键词混合时短关键词在索引命中的结果上过滤
+        response = self.client.get(url + '&q=hello 世界', HTTP_AUTHORIZATION=token2)
+        self.assertEqual(response.json()['results'], [])
+        response = self.client.get(url + '&q=天气不错 世界', HTTP_AUTHORIZATION=token2)
+        self.assertEqual([result['message']['content'] for result in response.json()['results']], ["你好世界，今天天气不错"])
+        # 退化扫描只覆盖最近 FALLBACK_SCAN_LIMIT 条可见消息
+        with mock.patch("chat.search.FALLBACK_SCAN_LIMIT", 2):
+            response = self.client.get(url + '&q=ll', HTTP_AUTHORIZATION=token2)
+            self.assertEqual(response.json()['results'], [])
+            response = self.client.get(url + '&q=oo', HTTP_AUTHORIZATION=token2)
+            self.assertEqual([result['message']['content'] for result in response.json()['results']], ["goodbye"])
+
+        # 修改正文后索引随触发器更新
+        Message.objects.filter(content="goodbye").update(content="farewell")
+        self.assertEqual(self.client.get(url + '&q=goodbye', HTTP_AUTHORIZATION=token2).json()['results'], [])
+        self.assertEqual(len(self.client.get(url + '&q=farewell', HTTP_AUTHORIZATION=token2).json()['results']), 1)
+
+        # 分页
+        response = self.client.get(url + '&q=hello&limit=1', HTTP_AUTHORIZATION=token2)
+        self.assertTrue(response.json()['hasNext'])
+        first = response.json()['results'][0]['message']['id']
+        response = self.client.get(url + f'&q=hello&limit=1&cursor={response.json()["nextCursor"]}', HTTP_AUTHORIZATION=token2)
+        self.assertFalse(response.json()['hasNext'])
+        self.assertNotEqual(response.json()['results'][0]['message']['id'], first)
+
+        # 只能搜到自己所在会话中的消息
+        User.objects.create(**{**self.data4, "password": make_password(self.data4['password'])})
+        token4 = self.login_for_test(self.data4)
+        response = self.client.get(f'/chat/search/?userId={self.data4["userId"]}&q=hello', HTTP_AUTHORIZATION=token4)
+        self.assertEqual(response.json()['results'], [])
+        self.assertEqual(self.client.get(url + '&q=', HTTP_AUTHORIZATION=token2).status_code, 400)
+        for limit in ["abc", "0", "-1"]:
+            self.assertEqual(self.client.get(url + f'&q=hello&limit={limit}', HTTP_AUTHORIZATION=token2).status_code, 400)
+
+    def test_backfill_notification_users(self):
+        self.create_group_for_test()
+        Notification.objects.create(conversation_id=1, content="legacy", userId=self.data1['userId'], timestamp=datetime.now(timezone.utc))
+        call_command("backfill_notification_users", stdout=StringIO())
+        self.assertEqual(Notification.objects.get().user.userId, self.data1['userId'])
+
     def test_upload_notification_invalid_user(self):
         token2 = self.login_for_test(self.data2)
         self.create_group_for_test()
@@ -376,7 +1128,7 @@ class ChatTest(TestCase):
         self.assertEqual(response.status_code, 403)
         self.assertEqual(response.json()['info'], '权限不足')
         self.assertEqual(response.json()['code'], -4)
-        self.assertEqual(Conversation.objects.get(id=1).groupNotificationList.count(), 0)
+        self.assertEqual(Conversation.objects.get(id=1).notifications.count(), 0)
 
     def test_set_host_valid(self):
         token1 = self.login_for_test(self.data1)
@@ -573,6 +1325,20 @@ class ChatTest(TestCase):
         self.assertEqual(admins.count(), 0)
         self.assertEqual(members.count(), 2)
         self.assertFalse(members.filter(userId=self.data2['userId']).exists())
+        # 退群成员的 leave 帧与其余成员的会话帧共用一次递增的版本号
+        snapshot = OutboxEvent.objects.filter(groups=["conversation.1"]).latest("id").payload
+        leave = OutboxEvent.objects.filter(payload__type="unsubscribe").latest("id").payload["frame"]
+        self.assertEqual(leave["event"], "leave")
+        self.assertEqual(leave["version"], snapshot["version"])
+
+        # 最后一名成员退群时 leave 帧单独递增版本号
+        token3 = self.login_for_test(self.data3)
+        self.client.post('/chat/exit_group/', data={'userId': self.data3['userId'], 'groupId': 1}, HTTP_AUTHORIZATION=token3, content_type='application/json')
+        lastVersion = Conversation.objects.get(id=1).version
+        self.client.post('/chat/exit_group/', data={'userId': self.data1['userId'], 'groupId': 1}, HTTP_AUTHORIZATION=token1, content_type='application/json')
+        self.assertFalse(Conversation.objects.filter(id=1).exists())
+        leave = OutboxEvent.objects.filter(payload__type="unsubscribe").latest("id").payload["frame"]
+        self.assertEqual(leave["version"], lastVersion + 1)
 
     def test_exit_from_group_invalid(self):
         token1 = self.login_for_test(self.data1)
@@ -644,6 +1410,24 @@ class ChatTest(TestCase):
         invitation = Invitation.objects.get(conversation__id=1)
         self.assertEqual(invitation.sender.userId, self.data3['userId'])
         self.assertEqual(invitation.receiver.userId, self.data4['userId'])
+        # 邀请帧的版本号按会话递增
+        self.client.post('/chat/invite_member/', data=invite_data, HTTP_AUTHORIZATION=token3, content_type='application/json')
+        versions = [event.payload["version"] for event in OutboxEvent.objects.filter(payload__event="invitation").order_by("id")]
+        self.assertEqual(versions, [1, 2])
+
+    def test_friend_request_frames_versioned(self):
+        self.create_new_user_for_test()
+        for data in [self.data1, self.data3]:
+            token = self.login_for_test(data)
+            self.client.post('/friends/add_friend/', data={"userId": data['userId'], "searchId": self.data4['userId'], "message": "hi"}, HTTP_AUTHORIZATION=token, content_type='application/json')
+        events = OutboxEvent.objects.filter(payload__event="friend_request").order_by("id")
+        self.assertEqual([event.groups for event in events], [[f"user.{self.data4['userId']}"]] * 2)
+        self.assertEqual([event.payload["version"] for event in events], [1, 2])
+        # 整行保存用户资料不会回写版本号
+        user = User.objects.get(userId=self.data4['userId'])
+        User.bump_friend_request_version(self.data4['userId'])
+        user.save()
+        self.assertEqual(User.objects.get(userId=self.data4['userId']).friendRequestVersion, 3)
 
     def test_invite_members(self):
         token1 = self.login_for_test(self.data1)
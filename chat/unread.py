@@ -0,0 +1,86 @@
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django_redis import get_redis_connection
+from account.models import User
+from utils.utils_rebuild import HASH_PLACEHOLDER, rebuild_hash, update
+from .models import Conversation, Message, ReadState
+
+# 每个用户一个 Redis 哈希 unread:{userId}，字段为会话 id，值为该会话的未读数
+# 哈希存在即视为完整，不存在时由 get_unread 从数据库整体重建，重建期间的增量见 utils.utils_rebuild
+# 哈希设置过期时间，兜底重建日志仍无法消除的偏差（增量在日志打开前已提交、之后才写入 Redis 时会重复计入）
+UNREAD_TIMEOUT = 60 * 60 * 24
+
+
+def _key(userId: str) -> str:
+    return f"unread:{userId}"
+
+
+# 原子地给若干用户在某会话的未读数加 amount，amount 为负时不低于 0
+def incr_unread(userIds, conversationId: int, amount: int = 1) -> None:
+    if userIds and amount:
+        update("hincr", [(_key(userId), conversationId, amount) for userId in userIds])
+
+
+# 已读或新加入会话时置 0
+def reset_unread(userIds, conversationId: int) -> None:
+    if userIds:
+        update("hset", [(_key(userId), conversationId, 0) for userId in userIds])
+
+
+# 离开会话时删除该字段
+def remove_unread(userIds, conversationId: int) -> None:
+    if userIds:
+        update("hdel", [(_key(userId), conversationId, "") for userId in userIds])
+
+
+# 统计一批消息中对该用户仍计为未读的条数，按会话分组：已读水位线之后、对其可见且不是本人发送
+# 删除消息时需在写入删除区间之前调用
+def count_unread_among(messages, userId: str, id: int) -> dict:
+    lastReadSeq = ReadState.objects.filter(
+        conversation_id=OuterRef("conversation_id"), user_id=id
+    ).values("lastReadSeq")[:1]
+    rows = (
+        messages.filter(seq__gt=Coalesce(Subquery(lastReadSeq), Value(0)))
+        .filter(Message.visible_to(userId))
+        .exclude(sender_id=id)
+        .values("conversation_id")
+        .annotate(count=Count("id"))
+        .order_by()
+    )
+    return {row["conversation_id"]: row["count"] for row in rows}
+
+
+# 用一次分组查询算出该用户全部会话的未读数并写入哈希
+def rebuild_unread(userId: str) -> dict:
+    id = User.objects.filter(userId=userId).values_list("id", flat=True).first()
+    if id is None:
+        return {}
+
+    def load():
+        conversationIds = list(Conversation.objects.filter(members__id=id).values_list("id", flat=True))
+        counts = dict.fromkeys(conversationIds, 0)
+        counts.update(count_unread_among(Message.objects.filter(conversation_id__in=conversationIds), userId, id))
+        return counts
+    return rebuild_hash(_key(userId), load, UNREAD_TIMEOUT)
+
+
+# 返回 {conversationId: 未读数}，给出 conversationIds 时只读取这些字段且只返回用户所在的会话；哈希不存在时先重建
+def get_unread(userId: str, conversationIds=None) -> dict:
+    connection = get_redis_connection("default")
+    if conversationIds is None:
+        raw = connection.hgetall(_key(userId))
+        if raw:
+            return {int(field): int(count) for field, count in raw.items() if field != HASH_PLACEHOLDER.encode()}
+        return rebuild_unread(userId)
+
+    conversationIds = list(conversationIds)
+    if not conversationIds:
+        return {}
+    exists, values = connection.pipeline(transaction=False).exists(_key(userId)).hmget(_key(userId), conversationIds).execute()
+    if exists:
+        return {
+            conversationId: int(count)
+            for conversationId, count in zip(conversationIds, values) if count is not None
+        }
+    counts = rebuild_unread(userId)
+    return {conversationId: counts[conversationId] for conversationId in conversationIds if conversationId in counts}
@@ -3,12 +3,18 @@ from . import views
 
 urlpatterns = [
     path('messages/', views.messages),
+    path('sync/', views.sync_messages),
     path('conversations/', views.conversations),
     path('delete_message/', views.delete_message),
+    path('delete_messages/', views.delete_messages),
     path('read_message/', views.read_message),
     path('get_conversation_ids/', views.get_conversation_ids),
+    path('inbox/', views.get_inbox),
     path('get_unread_count/', views.get_unread_count),
+    path('unread_counts/', views.get_unread_counts),
     path('upload_notification/', views.upload_notification),
+    path('notifications/', views.get_notifications),
+    path('search/', views.search),
     path('set_host/', views.set_host),
     path('set_admin/', views.set_admin),
     path('remove_admin/', views.remove_admin),
@@ -1,19 +1,29 @@
-import json
 import re
 from datetime import datetime, timezone
-from django.http import JsonResponse, HttpResponse, HttpRequest
+from django.http import HttpResponse, HttpRequest
 from django.views.decorators.http import require_http_methods
 from account.models import User
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
-from .models import Invitation, Message, Conversation, Notification
+from .models import Invitation, Membership, Message, MessageTombstone, Conversation, Notification, ReadState
+from .search import search_messages
+from .snapshot import get_conversations
+from .unread import count_unread_among, get_unread, incr_unread, remove_unread, reset_unread
+from .outbox import (
+    conversation_frame,
+    leave_frame,
+    make_frame,
+    publish,
+    publish_subscribe,
+    publish_to_conversation,
+    publish_unsubscribe,
+)
 from utils.utils_request import request_failed, request_success, BAD_METHOD
-from utils.utils_require import require
-from utils.utils_jwt import check_jwt_token, jwt_required
-from utils.constants import group_default_avatarUrl
+from utils.utils_require import Schema, request_body
+from utils.utils_jwt import jwt_required
+from utils.utils_cursor import encode_cursor, decode_cursor
+from utils.utils_time import datetime_to_micros, micros_to_datetime
+from utils.utils_avatar import default_group_avatar, normalize_avatar
 from django.db import transaction
 from django.db.models import F, Q
-from django.core.cache import cache
 
 
 # Create your views here.
@@ -36,21 +46,12 @@ def conversations(request: HttpRequest) -> HttpResponse:
     else:
         return BAD_METHOD
 
+SEND_MESSAGE_SCHEMA = Schema(conversationId="int", userId="string", content="string")
+
 @jwt_required
 def send_message(request: HttpRequest) -> HttpResponse:
-    body = json.loads(request.body.decode("utf-8"))
-    conversationId = require(
-        body,
-        "conversationId",
-        "int",
-        err_msg="Missing or error type of [conversationId]",
-    )
-    userId = require(
-        body, "userId", "string", err_msg="Missing or error type of [userId]"
-    )
-    content = require(
-        body, "content", "string", err_msg="Missing or error type of [content]"
-    )
+    body = request_body(request)
+    conversationId, userId, content = SEND_MESSAGE_SCHEMA.parse(body)
     replyId = body.get("replyId", None)
 
     senderId = User.objects.filter(userId=userId, isDeleted=False).values_list('id', flat=True).first()
@@ -83,75 +84,135 @@ def send_message(request: HttpRequest) -> HttpResponse:
                 return request_failed(-2, "原消息不存在", 400)
 
         # 创建消息
-        message = Message.objects.create(
-            conversation_id=conversationId,
+        message = Message.create_next(
+            conversationId,
             sender_id=senderId,
             content=content,
             replyTo_id=replyId if replyId else None,
             sendTime=datetime.now(tz=timezone.utc),
             updateTime=datetime.now(tz=timezone.utc),
         )
+        # 新消息尚无人已读、也未被任何人删除，无需查询水位线与删除区间
+        publish_to_conversation(
+            conversation.id,
+            make_frame("notify", "message", conversation.id, message.seq, message.serialize([], [])),
+        )
 
-    message.receivers.set(conversation.members.all())
-
-    channelLayer = get_channel_layer()
-    for member in conversation.members.all():
-        async_to_sync(channelLayer.group_send)(member.userId, {"type": "notify"})
-        cacheKey = f"unread_count_{conversation.id}_{member.userId}"
-        if member.userId != userId and cache.get(cacheKey, -1) != -1:
-            cache.set(cacheKey, cache.get(cacheKey, -1) + 1, 60*5)
+    # 事务提交后再累加未读数，回滚的消息不会被计入
+    incr_unread(
+        [member.userId for member in conversation.members.all() if member.userId != userId],
+        conversation.id,
+    )
     return request_success({})
 
 
 def get_message(request: HttpRequest) -> HttpResponse:
     userId: str = request.GET.get("userId")
     conversationId: str = request.GET.get("conversationId")
-    after: str = request.GET.get("after", "0")
-    afterDatetime = datetime.fromtimestamp((int(after) + 1) / 1000.0, tz=timezone.utc)
-    limit: int = int(request.GET.get("limit", "100"))
-   
-    token = request.headers.get("Authorization")
-    payload = check_jwt_token(token)
+    cursor: str = request.GET.get("cursor")
+
     # 验证 token
-    if payload is None or payload["userId"] != userId:
+    if request.jwtUserId is None or request.jwtUserId != userId:
         return request_failed(-3, "JWT 验证失败", 401)
 
-    messagesQuery = Message.objects.filter(updateTime__gte=afterDatetime).order_by(
-        "updateTime"
-    ).prefetch_related("conversation")
+    try:
+        limit = int(request.GET.get("limit", "100"))
+    except ValueError:
+        return request_failed(-2, "limit 格式错误", 400)
+    if limit <= 0:
+        return request_failed(-2, "limit 格式错误", 400)
+
+    if cursor:
+        # 游标模式：(updateTime, id) 严格大于上一页最后一条，同一时刻的消息不会被跳过
+        position = decode_cursor(cursor, 2)
+        if position is None:
+            return request_failed(-2, "游标格式错误", 400)
+        # 超出 datetime 表示范围的时间同样视为格式错误
+        try:
+            cursorTime = micros_to_datetime(position[0])
+        except OverflowError:
+            return request_failed(-2, "游标格式错误", 400)
+        # 冗余的 updateTime__gte 让 SQLite 直接在复合索引上做范围扫描
+        after = Q(updateTime__gte=cursorTime) & (
+            Q(updateTime__gt=cursorTime) | Q(updateTime=cursorTime, id__gt=position[1])
+        )
+    else:
+        # 兼容旧客户端的毫秒时间戳 after 参数
+        try:
+            afterMillis = int(request.GET.get("after", "0"))
+        except ValueError:
+            return request_failed(-2, "after 格式错误", 400)
+        after = Q(updateTime__gte=datetime.fromtimestamp((afterMillis + 1) / 1000.0, tz=timezone.utc))
+
+    # 由用户的在场记录限定会话，逐会话在 (conversation, updateTime, id) 索引上范围扫描，
+    # 不再沿全表的 (updateTime, id) 索引扫过其他会话的消息；给出 conversationId 时只取该会话
+    if conversationId:
+        try:
+            conversationIds = [int(conversationId)]
+        except ValueError:
+            return request_failed(-2, "会话不存在", 400)
+    else:
+        conversationIds = Membership.objects.filter(user__userId=userId).values("conversation_id")
 
-    if messagesQuery.count() == 0:
-        return JsonResponse({"messages": [], "hasNext": False}, status=200)
+    # 多取一条判断是否还有下一页，不再单独 count / exists
+    messages = list(Message.page_for(userId, conversationIds, after, limit).select_related("sender"))
+    hasNext = len(messages) > limit
+    messages = messages[:limit]
+    messagesData = Message.serialize_list(messages)
 
-    if userId:
-        messagesQuery = messagesQuery.filter(receivers__userId=userId).exclude(
-                deleteUsers__userId=userId
-            )
-        if not messagesQuery.exists():            
-            return JsonResponse({"messages": [], "hasNext": False}, status=200)
-    elif conversationId:
-        messagesQuery = messagesQuery.filter(conversation_id=conversationId)
-        if not messagesQuery.exists():
-            return JsonResponse({"messages": [], "hasNext": False}, status=200)
-    else:
-        return request_failed(-2, "用户或会话不存在", 400)
+    nextCursor = cursor
+    if messages:
+        nextCursor = encode_cursor(datetime_to_micros(messages[-1].updateTime), messages[-1].id)
+    return request_success({"messages": messagesData, "hasNext": hasNext, "nextCursor": nextCursor})
 
-    messages = list(messagesQuery[: limit + 1])
-    messagesData = [message.serialize() for message in messages]
 
-    # 检查是否还有更多消息
-    hasNext = False
-    if len(messagesData) > limit:
-        hasNext = True
-        messagesData = messagesData[:limit]
-    return request_success({"messages": messagesData, "hasNext": hasNext})
+def sync_messages(request: HttpRequest) -> HttpResponse:
+    if request.method != "GET":
+        return BAD_METHOD
+
+    userId: str = request.GET.get("userId")
+    # 验证 token
+    if request.jwtUserId is None or request.jwtUserId != userId:
+        return request_failed(-3, "JWT 验证失败", 401)
+
+    try:
+        conversationId = int(request.GET.get("conversationId"))
+        afterSeq = int(request.GET.get("afterSeq", "0"))
+        limit = int(request.GET.get("limit", "100"))
+    except (TypeError, ValueError):
+        return request_failed(-2, "Missing or error type of [conversationId]", 400)
+    if limit <= 0:
+        return request_failed(-2, "limit 格式错误", 400)
+
+    # seq 写入后不再变化，按 (conversation, seq) 范围扫描，同一条消息不会被重复返回
+    messagesQuery = (
+        Message.objects.filter(conversation_id=conversationId, seq__gt=afterSeq)
+        .filter(Message.visible_to(userId))
+        .order_by("seq")
+        .select_related("sender")
+    )
+    messages = list(messagesQuery[: limit + 1])
+    hasNext = len(messages) > limit
+    messages = messages[:limit]
+
+    # 附带各成员的已读水位线，客户端据此刷新旧消息的已读状态而无需重新拉取
+    readStates = ReadState.states_for([conversationId]).get(conversationId, [])
+    return request_success({
+        "messages": Message.serialize_list(messages),
+        "hasNext": hasNext,
+        "lastSeq": messages[-1].seq if messages else afterSeq,
+        "readStates": [
+            {"userName": userName, "lastReadSeq": lastReadSeq}
+            for (_, userName, lastReadSeq) in readStates
+        ],
+    })
+
+CREATE_CONVERSATION_SCHEMA = Schema(userId="string")
 
 @jwt_required
 def create_conversation(request: HttpRequest) -> HttpResponse:
-    body = json.loads(request.body.decode("utf-8"))
-    userId = require(
-        body, "userId", "string", err_msg="Missing or error type of [userId]"
-    )
+    body = request_body(request)
+    userId = CREATE_CONVERSATION_SCHEMA.parse(body)[0]
     memberIds = body.get("memberIds", [])
     memberIds.append(userId)
     memberIds = list(set(memberIds))
@@ -165,50 +226,32 @@ def create_conversation(request: HttpRequest) -> HttpResponse:
         return request_failed(-2, "群聊人数过少", 400)
 
     host = User.objects.get(userId=userId)
-    conversation = Conversation.objects.create(type="group_chat", host=host, avatarUrl=group_default_avatarUrl)
-    conversation.members.set(members)
-    conversation.groupName = ", ".join([member.userName for member in members])
-    if len(conversation.groupName) > 20:
-        conversation.groupName = (
-            ", ".join([member.userName for member in members])[:17] + "..."
-        )
-    conversation.save()
-
-    channelLayer = get_channel_layer()
-    async_to_sync(channelLayer.group_send)(userId, {"type": "notify"})
-    for memberId in memberIds:
-        cacheKey = f'conversations_{memberId}'
-        if cache.get(cacheKey) != None:
-            cache.delete(cacheKey)
-        async_to_sync(channelLayer.group_send)(memberId, {"type": "notify"})
+    with transaction.atomic():
+        conversation = Conversation.objects.create(type="group_chat", host=host, avatarUrl=default_group_avatar())
+        conversation.members.set(members)
+        Membership.join(conversation.id, [member.id for member in members])
+        conversation.groupName = ", ".join([member.userName for member in members])
+        if len(conversation.groupName) > 20:
+            conversation.groupName = (
+                ", ".join([member.userName for member in members])[:17] + "..."
+            )
+        conversation.save()
+        publish_subscribe(memberIds, conversation.id, conversation_frame(conversation))
 
+    reset_unread(memberIds, conversation.id)
     return request_success(conversation.serialize(userId))
 
 
 def get_conversation(request: HttpRequest) -> HttpResponse:
     userId: str = request.GET.get("userId")
-    token = request.headers.get("Authorization")
-    payload = check_jwt_token(token)
 
     # 验证 token
-    if payload is None or payload["userId"] != userId:
+    if request.jwtUserId is None or request.jwtUserId != userId:
         return request_failed(-3, "JWT 验证失败", 401)
 
     conversationIds = request.GET.getlist("id", [])
-    conversations = Conversation.objects.filter(
-        id__in=conversationIds
-    ).prefetch_related("members")
-    response_data = []
-    cacheKey = f'conversations_{userId}'
-    response_data = cache.get(cacheKey, [])
-    if len(response_data) == 0:
-        for conv in conversations:
-            otherUserId = None
-            if conv.type == "private_chat":
-                otherUserId = conv.members.exclude(userId=userId).values_list(
-                "userId", flat=True).first()
-            response_data.append(conv.serialize(userId, otherUserId))
-        cache.set(cacheKey, response_data, 60*5)    
+    # 每个会话的快照按版本号缓存，按当前用户组装
+    response_data = get_conversations(conversationIds, userId)
 
     return request_success({"conversations": response_data})
 
@@ -218,11 +261,9 @@ def get_conversation_ids(request: HttpRequest) -> HttpResponse:
         return BAD_METHOD
 
     userId: str = request.GET.get("userId")
-    token = request.headers.get("Authorization")
-    payload = check_jwt_token(token)
 
     # 验证 token
-    if payload is None or payload["userId"] != userId:
+    if request.jwtUserId is None or request.jwtUserId != userId:
         return request_failed(-3, "JWT 验证失败", 401)
 
     conversationIds = list(
@@ -231,80 +272,174 @@ def get_conversation_ids(request: HttpRequest) -> HttpResponse:
 
     return request_success({"conversationIds": conversationIds})
 
+def get_inbox(request: HttpRequest) -> HttpResponse:
+    if request.method != "GET":
+        return BAD_METHOD
+
+    userId: str = request.GET.get("userId")
+    cursor: str = request.GET.get("cursor")
+
+    # 验证 token
+    if request.jwtUserId is None or request.jwtUserId != userId:
+        return request_failed(-3, "JWT 验证失败", 401)
+
+    try:
+        limit = int(request.GET.get("limit", "50"))
+    except ValueError:
+        return request_failed(-2, "limit 格式错误", 400)
+    if limit <= 0:
+        return request_failed(-2, "limit 格式错误", 400)
+
+    id = User.objects.filter(userId=userId).values_list("id", flat=True).first()
+    if id is None:
+        return request_failed(-2, "用户不存在", 400)
+
+    # 按最后活跃时间倒序，游标为上一页最后一个会话的 (updateTime, id)
+    pageQuery = Conversation.objects.filter(members__id=id).order_by("-updateTime", "-id")
+    if cursor:
+        position = decode_cursor(cursor, 2)
+        if position is None:
+            return request_failed(-2, "游标格式错误", 400)
+        try:
+            cursorTime = micros_to_datetime(position[0])
+        except OverflowError:
+            return request_failed(-2, "游标格式错误", 400)
+        pageQuery = pageQuery.filter(updateTime__lte=cursorTime).filter(
+            Q(updateTime__lt=cursorTime) | Q(updateTime=cursorTime, id__lt=position[1])
+        )
+    # 先在子查询中只对 id 排序取一页，再取整行，会话很多时排序的数据量小得多
+    conversations = list(
+        Conversation.objects.filter(id__in=pageQuery.values("id")[: limit + 1])
+        .select_related("host")
+        .order_by("-updateTime", "-id")
+    )
+    hasNext = len(conversations) > limit
+    conversations = conversations[:limit]
+
+    # 私聊的对方用户一次查询取出
+    privateIds = [conversation.id for conversation in conversations if conversation.type == "private_chat"]
+    otherUsers = {}
+    if privateIds:
+        Members = Conversation.members.through
+        for member in Members.objects.filter(conversation_id__in=privateIds).exclude(user_id=id).select_related("user"):
+            otherUsers[member.conversation_id] = member.user.serialize()
+
+    unread = get_unread(userId, [conversation.id for conversation in conversations])
+    items = []
+    for conversation in conversations:
+        item = {
+            "id": conversation.id,
+            "type": conversation.type,
+            "status": conversation.status,
+            "version": conversation.version,
+            "updateTime": int(conversation.updateTime.timestamp() * 1_000),
+            "lastMessage": conversation.serialize_last_message(),
+            "unreadCount": unread.get(conversation.id, 0),
+        }
+        if conversation.type == "private_chat":
+            item["otherUser"] = otherUsers.get(conversation.id)
+        else:
+            item["groupName"] = conversation.groupName
+            item["avatarUrl"] = conversation.avatarUrl
+            item["hostId"] = conversation.host.userId if conversation.host else None
+        items.append(item)
+
+    nextCursor = None
+    if hasNext:
+        last = conversations[-1]
+        nextCursor = encode_cursor(datetime_to_micros(last.updateTime), last.id)
+
+    return request_success({"conversations": items, "hasNext": hasNext, "nextCursor": nextCursor})
+
+DELETE_MESSAGE_SCHEMA = Schema(userId="string", messageId="int")
+
 @jwt_required
 def delete_message(request: HttpRequest) -> HttpResponse:
     if request.method != "POST":
         return BAD_METHOD
 
-    body = json.loads(request.body.decode("utf-8"))
-    userId = require(
-        body, "userId", "string", err_msg="Missing or error type of [userId]"
-    )
-    messageId = require(
-        body, "messageId", "int", err_msg="Missing or error type of [messageId]"
-    )
+    body = request_body(request)
+    userId, messageId = DELETE_MESSAGE_SCHEMA.parse(body)
 
-    try:
-        message = Message.objects.get(id=messageId)
-    except Message.DoesNotExist:
+    id = User.objects.filter(userId=userId).values_list("id", flat=True).first()
+    if id is None:
+        return request_failed(-2, "用户不存在", 400)
+    message = Message.objects.filter(id=messageId).annotate(
+        deleted=MessageTombstone.covers(userId)
+    ).values("conversation_id", "seq", "deleted").first()
+    if message is None:
         return request_failed(-2, "消息不存在", 400)
-    user, _ = User.objects.get_or_create(userId=userId)
-    if not message.deleteUsers.filter(userId=userId).exists():
-        message.deleteUsers.add(user.id)
-        message.save()
-    else:
+    if message["deleted"]:
         return request_failed(-4, "消息已删除", 403)
+
+    hiddenUnread = count_unread_among(Message.objects.filter(id=messageId), userId, id)
+    MessageTombstone.hide(id, {message["conversation_id"]: [message["seq"]]})
+    for conversationId, count in hiddenUnread.items():
+        incr_unread([userId], conversationId, -count)
     return request_success({"info": "删除成功"})
 
+DELETE_MESSAGES_SCHEMA = Schema(userId="string", messageIds="list")
+
 @jwt_required
-def read_message(request: HttpRequest) -> HttpResponse:
+def delete_messages(request: HttpRequest) -> HttpResponse:
     if request.method != "POST":
         return BAD_METHOD
 
-    body = json.loads(request.body.decode("utf-8"))
-    userId = require(
-        body, "userId", "string", err_msg="Missing or error type of [userId]"
-    )
-    conversationId = require(
-        body,
-        "conversationId",
-        "int",
-        err_msg="Missing or error type of [conversationId]",
-    )
+    body = request_body(request)
+    userId, messageIds = DELETE_MESSAGES_SCHEMA.parse(body)
 
-    id = User.objects.filter(userId=userId).values_list('id', flat=True).first()
-    if id is None:    
+    if not all(type(messageId) is int for messageId in messageIds):
+        return request_failed(-2, "messageIds 格式错误", 400)
+    id = User.objects.filter(userId=userId).values_list("id", flat=True).first()
+    if id is None:
         return request_failed(-2, "用户不存在", 400)
 
-    messages = (
-        Message.objects.filter(conversation_id=conversationId)
-        .exclude(Q(sender=id) | Q(readUsers__in=[id]))
-        .prefetch_related("readUsers")
-    )
+    # 已被该用户删除的消息不再写入区间，也不计入删除条数
+    messages = Message.objects.filter(id__in=messageIds, seq__isnull=False).exclude(MessageTombstone.covers(userId))
+    seqsByConversation = {}
+    for conversationId, seq in messages.values_list("conversation_id", "seq"):
+        seqsByConversation.setdefault(conversationId, []).append(seq)
+    if not seqsByConversation:
+        return request_failed(-2, "消息不存在", 400)
 
-    # 更新所有选中消息的updateTime
-    Message.objects.filter(id__in=messages.values_list('id', flat=True)).update(updateTime=datetime.now(tz=timezone.utc))
+    # 被删除的未读消息不再计入未读数，需在写入删除区间之前统计
+    hiddenUnread = count_unread_among(Message.objects.filter(id__in=messageIds), userId, id)
+    # 连续的 seq 合并成区间后一次性写入
+    MessageTombstone.hide(id, seqsByConversation)
+    for conversationId, count in hiddenUnread.items():
+        incr_unread([userId], conversationId, -count)
+    count = sum(len(seqs) for seqs in seqsByConversation.values())
+    return request_success({"info": "删除成功", "count": count})
 
-    # 批量处理多对多关系的添加
-    ReadUser_Message = Message.readUsers.through
-    readuser_message_objects = [
-        ReadUser_Message(user_id=id, message_id=message.id) for message in messages
-    ]
+READ_MESSAGE_SCHEMA = Schema(userId="string", conversationId="int")
 
-    # 使用数据库事务确保所有操作都能一次性成功，否则全部回滚
-    with transaction.atomic():
-        # 批量创建多对多关系
-        ReadUser_Message.objects.bulk_create(readuser_message_objects, ignore_conflicts=True)
+@jwt_required
+def read_message(request: HttpRequest) -> HttpResponse:
+    if request.method != "POST":
+        return BAD_METHOD
 
-    cacheKey = f"unread_count_{conversationId}_{userId}"
-    cache.set(cacheKey, 0, 60*5)
+    body = request_body(request)
+    userId, conversationId = READ_MESSAGE_SCHEMA.parse(body)
 
-    channelLayer = get_channel_layer()
-    memberIds = Conversation.objects.filter(id=conversationId).values_list(
-        "members__userId", flat=True
-    )
-    for memberId in memberIds:
-        async_to_sync(channelLayer.group_send)(memberId, {"type": "notify"})
+    reader = User.objects.filter(userId=userId).values_list('id', 'userName').first()
+    if reader is None:    
+        return request_failed(-2, "用户不存在", 400)
+    id, userName = reader
+
+    lastSeq = Conversation.objects.filter(id=conversationId).values_list("lastSeq", flat=True).first()
+    if lastSeq is None:
+        return request_failed(-2, "会话不存在", 400)
+
+    # 只推进该成员在会话中的已读水位线，不再逐条写已读记录、不再改写消息的 updateTime
+    # 已读帧的版本号为会话的 readVersion，逐帧加一，不连续即说明漏收
+    with transaction.atomic():
+        ReadState.mark_read(conversationId, id, lastSeq)
+        publish_to_conversation(conversationId, make_frame(
+            "notify", "read", conversationId, Conversation.bump_read_version(conversationId),
+            {"userId": userId, "userName": userName, "lastReadSeq": lastSeq},
+        ))
+
+    reset_unread([userId], conversationId)
 
     return request_success({"info": "已读成功"})
 
@@ -316,31 +451,140 @@ def get_unread_count(request: HttpRequest) -> HttpResponse:
     userId: str = request.GET.get("userId")
     conversationId: int = request.GET.get("conversationId")
 
-    cacheKey = f"unread_count_{conversationId}_{userId}"
-    count = cache.get(cacheKey, -1)
-    if count == -1:
-        id = User.objects.filter(userId=userId).values_list("id", flat=True).first()
-        count = (
-            Message.objects.filter(conversation_id=conversationId)
-            .exclude(Q(sender__id=id) | Q(readUsers__in=[id]))
-            .count()
-        )
-        cache.set(cacheKey, count, 60*5)
+    # 未读数来自 Redis 哈希，仅在哈希不存在时从数据库重建
+    try:
+        count = get_unread(userId, [int(conversationId)]).get(int(conversationId), 0)
+    except (TypeError, ValueError):
+        return request_failed(-2, "会话不存在", 400)
 
     return request_success({"count": count})
 
+def get_unread_counts(request: HttpRequest) -> HttpResponse:
+    if request.method != "GET":
+        return BAD_METHOD
+
+    userId: str = request.GET.get("userId")
+    conversationIds: str = request.GET.get("conversationIds")
+
+    # 验证 token
+    if request.jwtUserId is None or request.jwtUserId != userId:
+        return request_failed(-3, "JWT 验证失败", 401)
+
+    if conversationIds:
+        try:
+            conversationIds = [int(conversationId) for conversationId in conversationIds.split(",")]
+        except ValueError:
+            return request_failed(-2, "会话列表格式错误", 400)
+    else:
+        conversationIds = None
+    # 一次取出该用户全部会话（或给定会话中用户所在的会话）的未读数，哈希不存在时由一条分组聚合查询重建
+    counts = get_unread(userId, conversationIds)
+
+    return request_success({
+        "counts": [
+            {"conversationId": conversationId, "count": count}
+            for conversationId, count in sorted(counts.items())
+        ],
+        "total": sum(counts.values()),
+    })
+
+def search(request: HttpRequest) -> HttpResponse:
+    if request.method != "GET":
+        return BAD_METHOD
+
+    userId: str = request.GET.get("userId")
+    query: str = request.GET.get("q", "").strip()
+    cursor: str = request.GET.get("cursor")
+
+    # 验证 token
+    if request.jwtUserId is None or request.jwtUserId != userId:
+        return request_failed(-3, "JWT 验证失败", 401)
+
+    try:
+        limit = int(request.GET.get("limit", "20"))
+    except ValueError:
+        return request_failed(-2, "limit 格式错误", 400)
+    if limit <= 0:
+        return request_failed(-2, "limit 格式错误", 400)
+    if not query:
+        return request_failed(-2, "关键词不能为空", 400)
+    conversationId = request.GET.get("conversationId")
+    if conversationId is not None:
+        try:
+            conversationId = int(conversationId)
+        except ValueError:
+            return request_failed(-2, "会话不存在", 400)
+
+    # 结果按相关度排序，游标为已返回的条数
+    offset = 0
+    if cursor:
+        position = decode_cursor(cursor, 1)
+        if position is None:
+            return request_failed(-2, "游标格式错误", 400)
+        offset = position[0]
+
+    hits, hasNext = search_messages(userId, query, conversationId, offset, limit)
+    serialized = Message.serialize_list([message for message, _ in hits])
+    return request_success({
+        "results": [
+            {"message": message, "snippet": snippet}
+            for message, (_, snippet) in zip(serialized, hits)
+        ],
+        "hasNext": hasNext,
+        "nextCursor": encode_cursor(offset + len(hits)) if hasNext else None,
+    })
+
+def get_notifications(request: HttpRequest) -> HttpResponse:
+    if request.method != "GET":
+        return BAD_METHOD
+
+    userId: str = request.GET.get("userId")
+    cursor: str = request.GET.get("cursor")
+
+    # 验证 token
+    if request.jwtUserId is None or request.jwtUserId != userId:
+        return request_failed(-3, "JWT 验证失败", 401)
+
+    try:
+        limit = int(request.GET.get("limit", "20"))
+    except ValueError:
+        return request_failed(-2, "limit 格式错误", 400)
+    if limit <= 0:
+        return request_failed(-2, "limit 格式错误", 400)
+
+    try:
+        conversationId = int(request.GET.get("conversationId"))
+    except (TypeError, ValueError):
+        return request_failed(-2, "会话不存在", 400)
+    if not Conversation.objects.filter(id=conversationId, members__userId=userId).exists():
+        return request_failed(-2, "会话不存在", 400)
+
+    # 按发布顺序倒序，游标为上一页最后一条公告的 id
+    notifications = Notification.objects.filter(conversation_id=conversationId).select_related("user").order_by("-id")
+    if cursor:
+        position = decode_cursor(cursor, 1)
+        if position is None:
+            return request_failed(-2, "游标格式错误", 400)
+        notifications = notifications.filter(id__lt=position[0])
+    notifications = list(notifications[: limit + 1])
+    hasNext = len(notifications) > limit
+    notifications = notifications[:limit]
+
+    return request_success({
+        "notifications": [notification.serialize() for notification in notifications],
+        "hasNext": hasNext,
+        "nextCursor": encode_cursor(notifications[-1].id) if hasNext else None,
+    })
+
+UPLOAD_NOTIFICATION_SCHEMA = Schema(userId="string", groupId="int")
+
 @jwt_required
 def upload_notification(request: HttpRequest) -> HttpResponse:
     if request.method != "POST":
         return BAD_METHOD
 
-    body = json.loads(request.body.decode("utf-8"))
-    userId = require(
-        body, "userId", "string", err_msg="Missing or error type of [userId]"
-    )
-    groupId = require(
-        body, "groupId", "int", err_msg="Missing or error type of [groupId]"
-    )
+    body = request_body(request)
+    userId, groupId = UPLOAD_NOTIFICATION_SCHEMA.parse(body)
     
     content = body.get("content", "")
     if len(content) == 0:
@@ -359,47 +603,28 @@ def upload_notification(request: HttpRequest) -> HttpResponse:
     if user not in conversation.admins.all() and user != conversation.host:
         return request_failed(-4, "权限不足", 403)
 
-    newNotification = Notification.objects.create(
-        conversation_id=groupId,
-        content=content,
-        userId=userId,
-        userName=user.userName,
-        avatarUrl=user.avatarUrl,
-        timestamp=datetime.now(timezone.utc),
-    )
-
-    conversation.groupNotificationList.add(newNotification)
-    conversation.save()
-
-    channelLayer = get_channel_layer()
-    memberIds = conversation.members.values_list("userId", flat=True)
-    for memberId in memberIds:
-        cacheKey = f"conversations_{memberId}"
-        if cache.get(cacheKey) != None:
-           cache.delete(cacheKey)
-        async_to_sync(channelLayer.group_send)(memberId, {"type": "notify"})
+    with transaction.atomic():
+        Notification.objects.create(
+            conversation_id=groupId,
+            content=content,
+            user=user,
+            timestamp=datetime.now(timezone.utc),
+        )
+        publish_to_conversation(conversation.id, conversation_frame(conversation))
 
     return request_success({})
 
 
+SET_HOST_SCHEMA = Schema(oldHostId="string", newHostId="string", groupId="int")
+
 def set_host(request: HttpRequest) -> HttpResponse:
     if request.method != "POST":
         return BAD_METHOD
 
-    body = json.loads(request.body.decode("utf-8"))
-    oldHostId = require(
-        body, "oldHostId", "string", err_msg="Missing or error type of [userId]"
-    )
-    newHostId = require(
-        body, "newHostId", "string", err_msg="Missing or error type of [newHostId]"
-    )
-    groupId = require(
-        body, "groupId", "int", err_msg="Missing or error type of [groupId]"
-    )
+    body = request_body(request)
+    oldHostId, newHostId, groupId = SET_HOST_SCHEMA.parse(body)
 
-    token = request.headers.get("Authorization")
-    payload = check_jwt_token(token)
-    if payload is None or payload["userId"] != oldHostId:
+    if request.jwtUserId is None or request.jwtUserId != oldHostId:
         return request_failed(-3, "JWT 验证失败", 401)
 
     try:
@@ -416,43 +641,29 @@ def set_host(request: HttpRequest) -> HttpResponse:
         return request_failed(-4, "权限不足", 403)
     if user == newHost:
         return request_failed(-4, "新群主不能与旧群主相同", 403)
-    if newHost in conversation.admins.all():
-        conversation.admins.remove(newHost)
-
-    conversation.host = newHost
-    conversation.save()
+    with transaction.atomic():
+        if newHost in conversation.admins.all():
+            conversation.admins.remove(newHost)
 
-    channelLayer = get_channel_layer()
-    memberIds = conversation.members.values_list("userId", flat=True)
-    for memberId in memberIds:
-        cacheKey = f"conversations_{memberId}"
-        if cache.get(cacheKey) is not None:
-           cache.delete(cacheKey)
-        async_to_sync(channelLayer.group_send)(memberId, {"type": "notify"})
+        conversation.host = newHost
+        conversation.save()
+        publish_to_conversation(conversation.id, conversation_frame(conversation))
 
     return request_success({})
 
 
+SET_ADMIN_SCHEMA = Schema(hostId="string", groupId="int", adminId="string")
+
 def set_admin(request: HttpRequest) -> HttpResponse:
     if request.method != "POST":
         return BAD_METHOD
 
-    body = json.loads(request.body.decode("utf-8"))
-    hostId = require(
-        body, "hostId", "string", err_msg="Missing or error type of [hostId]"
-    )
-    groupId = require(
-        body, "groupId", "int", err_msg="Missing or error type of [groupId]"
-    )
-    adminId = require(
-        body, "adminId", "string", err_msg="Missing or error type of [adminId]"
-    )
+    body = request_body(request)
+    hostId, groupId, adminId = SET_ADMIN_SCHEMA.parse(body)
 
-    token = request.headers.get("Authorization")
-    payload = check_jwt_token(token)
 
     # 验证 token
-    if payload is None or payload["userId"] != hostId:
+    if request.jwtUserId is None or request.jwtUserId != hostId:
         return request_failed(-3, "JWT 验证失败", 401)
 
     try:
@@ -475,41 +686,26 @@ def set_admin(request: HttpRequest) -> HttpResponse:
     if admin in conversation.admins.all() or admin == conversation.host:
         return request_failed(-4, "权限已存在", 403)
 
-    conversation.admins.add(admin)
-    conversation.save()
-
-    channelLayer = get_channel_layer()
-    memberIds = conversation.members.values_list("userId", flat=True)
-    for memberId in memberIds:
-        cacheKey = f"conversations_{memberId}"
-        convs = cache.get(cacheKey)
-        if convs is not None:
-            cache.delete(cacheKey)
-        async_to_sync(channelLayer.group_send)(memberId, {"type": "notify"})
+    with transaction.atomic():
+        conversation.admins.add(admin)
+        conversation.save()
+        publish_to_conversation(conversation.id, conversation_frame(conversation))
 
     return request_success({})
 
 
+REMOVE_ADMIN_SCHEMA = Schema(hostId="string", groupId="int", adminId="string")
+
 def remove_admin(request: HttpRequest) -> HttpResponse:
     if request.method != "POST":
         return BAD_METHOD
 
-    body = json.loads(request.body.decode("utf-8"))
-    hostId = require(
-        body, "hostId", "string", err_msg="Missing or error type of [userId]"
-    )
-    groupId = require(
-        body, "groupId", "int", err_msg="Missing or error type of [groupId]"
-    )
-    adminId = require(
-        body, "adminId", "string", err_msg="Missing or error type of [adminId]"
-    )
+    body = request_body(request)
+    hostId, groupId, adminId = REMOVE_ADMIN_SCHEMA.parse(body)
 
-    token = request.headers.get("Authorization")
-    payload = check_jwt_token(token)
 
     # 验证 token
-    if payload is None or payload["userId"] != hostId:
+    if request.jwtUserId is None or request.jwtUserId != hostId:
         return request_failed(-3, "JWT 验证失败", 401)
 
     try:
@@ -532,39 +728,26 @@ def remove_admin(request: HttpRequest) -> HttpResponse:
     if admin not in conversation.admins.all():
         return request_failed(-4, "权限不存在", 403)
 
-    conversation.admins.remove(admin)
-    conversation.save()
-
-    channelLayer = get_channel_layer()
-    memberIds = conversation.members.values_list("userId", flat=True)
-    for memberId in memberIds:
-        cacheKey = f"conversations_{memberId}"
-        convs = cache.get(cacheKey)
-        if convs is not None:
-              cache.delete(cacheKey)
-        async_to_sync(channelLayer.group_send)(memberId, {"type": "notify"})
+    with transaction.atomic():
+        conversation.admins.remove(admin)
+        conversation.save()
+        publish_to_conversation(conversation.id, conversation_frame(conversation))
 
     return request_success({})
 
 
+KICK_MEMBER_SCHEMA = Schema(opId="string", groupId="int", memberId="string")
+
 def kick_member(request: HttpRequest) -> HttpResponse:
     if request.method != "POST":
         return BAD_METHOD
 
-    body = json.loads(request.body.decode("utf-8"))
-    opId = require(body, "opId", "string", err_msg="Missing or error type of [opId]")
-    groupId = require(
-        body, "groupId", "int", err_msg="Missing or error type of [groupId]"
-    )
-    memberId = require(
-        body, "memberId", "string", err_msg="Missing or error type of [memberId]"
-    )
+    body = request_body(request)
+    opId, groupId, memberId = KICK_MEMBER_SCHEMA.parse(body)
 
-    token = request.headers.get("Authorization")
-    payload = check_jwt_token(token)
 
     # 验证 token
-    if payload is None or payload["userId"] != opId:
+    if request.jwtUserId is None or request.jwtUserId != opId:
         return request_failed(-3, "JWT 验证失败", 401)
 
     try:
@@ -587,38 +770,30 @@ def kick_member(request: HttpRequest) -> HttpResponse:
         user != conversation.host and member in conversation.admins.all()
     ):
         return request_failed(-4, "权限不足", 403)
-    conversation.members.remove(member)
-    if member in conversation.admins.all():
-        conversation.admins.remove(member)
-    conversation.save()
-
-    channelLayer = get_channel_layer()
-    cacheKey = f"conversations_{memberId}"
-    if cache.get(cacheKey) is not None:
-        cache.delete(cacheKey)
-    async_to_sync(channelLayer.group_send)(memberId, {"type": "kick_member"})
-
-    memberIds = conversation.members.values_list("userId", flat=True)
-    for memberId in memberIds:
-        cacheKey = f"conversations_{memberId}"
-        if cache.get(cacheKey) is not None:
-            cache.delete(cacheKey)
-        async_to_sync(channelLayer.group_send)(memberId, {"type": "kick_member"})
+    with transaction.atomic():
+        conversation.members.remove(member)
+        Membership.leave(conversation.id, member.id)
+        if member in conversation.admins.all():
+            conversation.admins.remove(member)
+        conversation.save()
+        # 被踢成员的连接退订会话组，只收到 leave 帧；剩余成员通过会话组收到新的会话快照
+        frame = conversation_frame(conversation, "kick_member")
+        publish_to_conversation(conversation.id, frame, exclude=[memberId])
+        publish_unsubscribe([memberId], conversation.id, leave_frame(conversation, memberId, "kick_member", frame["version"]))
+
+    remove_unread([memberId], conversation.id)
 
     return request_success({})
 
+EXIT_GROUP_SCHEMA = Schema(userId="string", groupId="int")
+
 @jwt_required
 def exit_group(request: HttpRequest) -> HttpResponse:
     if request.method != "POST":
         return BAD_METHOD
 
-    body = json.loads(request.body.decode("utf-8"))
-    userId = require(
-        body, "userId", "string", err_msg="Missing or error type of [userId]"
-    )
-    groupId = require(
-        body, "groupId", "int", err_msg="Missing or error type of [groupId]"
-    )
+    body = request_body(request)
+    userId, groupId = EXIT_GROUP_SCHEMA.parse(body)
 
 
     try:
@@ -632,49 +807,38 @@ def exit_group(request: HttpRequest) -> HttpResponse:
         return request_failed(-4, "权限不足", 403)
     
     memberCount = conversation.members.count()
-    channelLayer = get_channel_layer()
-    if memberCount == 1:
-        conversation.delete()
-    else:    
-        if user == conversation.host:
-            return request_failed(-4, "群主不能退群", 403)
-        conversation.members.remove(user)
-        if user in conversation.admins.all():
-            conversation.admins.remove(user)
-        conversation.save()
-        memberIds = conversation.members.values_list("userId", flat=True)
-        for memberId in memberIds:
-            cacheKey = f"conversations_{memberId}"
-            if cache.get(cacheKey) is not None:
-                cache.delete(cacheKey)
-            async_to_sync(channelLayer.group_send)(memberId, {"type": "notify"})
-
-    cacheKey = f"conversations_{userId}"
-    if cache.get(cacheKey) is not None:
-        cache.delete(cacheKey)
-    async_to_sync(channelLayer.group_send)(userId, {"type": "notify"})
-    
+    if memberCount != 1 and user == conversation.host:
+        return request_failed(-4, "群主不能退群", 403)
+    remove_unread([userId], conversation.id)
+    with transaction.atomic():
+        if memberCount == 1:
+            publish_unsubscribe([userId], conversation.id, leave_frame(conversation, userId))
+            conversation.delete()
+        else:
+            conversation.members.remove(user)
+            Membership.leave(conversation.id, user.id)
+            if user in conversation.admins.all():
+                conversation.admins.remove(user)
+            conversation.save()
+            frame = conversation_frame(conversation)
+            publish_to_conversation(conversation.id, frame, exclude=[userId])
+            publish_unsubscribe([userId], conversation.id, leave_frame(conversation, userId, version=frame["version"]))
+
     return request_success({})
 
 
+INVITE_MEMBER_SCHEMA = Schema(opId="string", groupId="int", memberIds="list")
+
 def invite_member(request: HttpRequest) -> HttpResponse:
     if request.method != "POST":
         return BAD_METHOD
 
 
-    body = json.loads(request.body.decode("utf-8"))
-    opId = require(body, "opId", "string", err_msg="Missing or error type of [opId]")
-    groupId = require(
-        body, "groupId", "int", err_msg="Missing or error type of [groupId]"
-    )
-    memberIds = require(
-        body, "memberIds", "list", err_msg="Missing or error type of [memberIds]"
-    )
+    body = request_body(request)
+    opId, groupId, memberIds = INVITE_MEMBER_SCHEMA.parse(body)
 
-    token = request.headers.get("Authorization")
-    payload = check_jwt_token(token)
     # 验证 token
-    if payload is None or payload["userId"] != opId:
+    if request.jwtUserId is None or request.jwtUserId != opId:
         return request_failed(-3, "JWT 验证失败", 401)
 
 
@@ -697,38 +861,36 @@ def invite_member(request: HttpRequest) -> HttpResponse:
 
 
     if (user != conversation.host) and (user not in conversation.admins.all()):
-        for member in members:
-            invitation = Invitation.objects.create(
-                conversation=conversation,
-                sender=user,
-                receiver=member,
-                timestamp=datetime.now(timezone.utc),
-            )
-
-        channelLayer = get_channel_layer()
-        for member in conversation.admins.all():
-            async_to_sync(channelLayer.group_send)(
-                member.userId, {"type": "group_request"}
-            )
-        async_to_sync(channelLayer.group_send)(
-            conversation.host.userId, {"type": "group_request"}
-        )
+        adminIds = [admin.userId for admin in conversation.admins.all()]
+        with transaction.atomic():
+            invitations = [
+                Invitation.objects.create(
+                    conversation=conversation,
+                    sender=user,
+                    receiver=member,
+                    timestamp=datetime.now(timezone.utc),
+                )
+                for member in members
+            ]
+            publish(adminIds + [conversation.host.userId], make_frame(
+                "group_request", "invitation", conversation.id, Conversation.bump_invitation_version(conversation.id),
+                [invitation.serialize() for invitation in invitations],
+            ))
 
         return request_success({})
 
     elif user in conversation.admins.all() or user == conversation.host:
-        for member in members:
-            conversation.members.add(member)
-        conversation.save()
-
-        channelLayer = get_channel_layer()
-        memberIds = conversation.members.values_list("userId", flat=True)
-        for memberId in memberIds:
-            cacheKey = f"conversations_{memberId}"
-            convs = cache.get(cacheKey)
-            if convs is not None:
-                cache.delete(cacheKey)
-            async_to_sync(channelLayer.group_send)(memberId, {"type": "notify"})
+        with transaction.atomic():
+            for member in members:
+                conversation.members.add(member)
+            Membership.join(conversation.id, [member.id for member in members])
+            conversation.save()
+            # 新成员订阅会话组时单独收到快照，若同时经会话组收到重复帧，可按版本号去重
+            frame = conversation_frame(conversation)
+            publish_to_conversation(conversation.id, frame)
+            publish_subscribe([member.userId for member in members], conversation.id, frame)
+
+        reset_unread([member.userId for member in members], conversation.id)
 
         return request_success({})
 
@@ -737,11 +899,9 @@ def group_requests(request: HttpRequest, userId: str) -> HttpResponse:
     if request.method != "GET":
         return BAD_METHOD
 
-    token = request.headers.get("Authorization")
-    payload = check_jwt_token(token)
 
     # 验证 token
-    if payload is None or payload["userId"] != userId:
+    if request.jwtUserId is None or request.jwtUserId != userId:
         return request_failed(-3, "JWT 验证失败", 401)
 
     conversations = Conversation.objects.filter(members__userId=userId)
@@ -753,18 +913,15 @@ def group_requests(request: HttpRequest, userId: str) -> HttpResponse:
 
     return request_success([invitation.serialize() for invitation in invitations])
 
+ACCEPT_INVITATION_SCHEMA = Schema(userId="string", invitationId="int")
+
 @jwt_required
 def accept_invitation(request: HttpRequest) -> HttpResponse:
     if request.method != "POST":
         return BAD_METHOD
 
-    body = json.loads(request.body.decode("utf-8"))
-    userId = require(
-        body, "userId", "string", err_msg="Missing or error type of [userId]"
-    )
-    invitationId = require(
-        body, "invitationId", "int", err_msg="Missing or error type of [invitationId]"
-    )
+    body = request_body(request)
+    userId, invitationId = ACCEPT_INVITATION_SCHEMA.parse(body)
 
 
     try:
@@ -781,39 +938,37 @@ def accept_invitation(request: HttpRequest) -> HttpResponse:
     if user not in conversation.admins.all() and user != conversation.host:
         return request_failed(-4, "权限不足", 403)
 
-    if invitation.receiver not in conversation.members.all():
-        conversation.members.add(invitation.receiver)
+    with transaction.atomic():
+        joined = invitation.receiver not in conversation.members.all()
+        if joined:
+            conversation.members.add(invitation.receiver)
+            Membership.join(conversation.id, [invitation.receiver_id])
 
-    conversation.save()
+        conversation.save()
+        frame = conversation_frame(conversation, "group_request")
+        publish_to_conversation(conversation.id, frame)
+        if joined:
+            publish_subscribe([invitation.receiver.userId], conversation.id, frame)
 
-    invitationList = Invitation.objects.filter(
-        conversation=conversation, receiver=invitation.receiver
-    )
-    invitationList.delete()
+        invitationList = Invitation.objects.filter(
+            conversation=conversation, receiver=invitation.receiver
+        )
+        invitationList.delete()
 
-    channelLayer = get_channel_layer()
-    memberIds = conversation.members.values_list("userId", flat=True)
-    for memberId in memberIds:
-        cacheKey = f"conversations_{memberId}"
-        convs = cache.get(cacheKey)
-        if convs is not None:
-            cache.delete(cacheKey)
-        async_to_sync(channelLayer.group_send)(memberId, {"type": "group_request"})
+    if joined:
+        reset_unread([invitation.receiver.userId], conversation.id)
 
     return request_success({})
 
+UPDATE_GROUP_SCHEMA = Schema(userId="string", groupId="int")
+
 @jwt_required
 def update_group(request: HttpRequest) -> HttpResponse:
     if request.method != "POST":
         return BAD_METHOD
     
-    body = json.loads(request.body.decode("utf-8"))
-    userId = require(
-        body, "userId", "string", err_msg="Missing or error type of [userId]"
-    )
-    groupId = require(
-        body, "groupId", "int", err_msg="Missing or error type of [groupId]"
-    )
+    body = request_body(request)
+    userId, groupId = UPDATE_GROUP_SCHEMA.parse(body)
 
     try:
         user = User.objects.get(userId=userId, isDeleted=False)
@@ -835,21 +990,12 @@ def update_group(request: HttpRequest) -> HttpResponse:
             return request_failed(-4,"群聊名称格式错误",403)
         conversation.groupName = newName
     if "newAvatarUrl" in body:
-        conversation.avatarUrl = body["newAvatarUrl"]
-    conversation.save()    
-    
-    channelLayer = get_channel_layer()
-    memberIds = conversation.members.values_list("userId", flat=True)
-    for memberId in memberIds:
-        cacheKey = f'conversations_{memberId}'
-        convs = cache.get(cacheKey)
-        if convs is not None:
-            for conv in convs:
-                if conv["id"] == conversation.id:
-                    conv["groupName"] = conversation.groupName
-                    conv["avatarUrl"] = conversation.avatarUrl
-                    break
-            cache.set(cacheKey, convs, 60*5)
-        async_to_sync(channelLayer.group_send)(memberId, {"type": "group_modify"})
+        try:
+            conversation.avatarUrl = normalize_avatar(body["newAvatarUrl"])
+        except ValueError:
+            return request_failed(-4, "头像格式错误", 403)
+    with transaction.atomic():
+        conversation.save()
+        publish_to_conversation(conversation.id, conversation_frame(conversation, "group_modify"))
 
     return request_success({})
\ No newline at end of file
@@ -0,0 +1,54 @@
+import hashlib
+from django.core.cache import cache
+from django.db.models import OuterRef, Subquery
+from account.models import User
+from utils.utils_request import dumps
+from .models import Friendship
+
+# 每个用户的好友列表编码后整体缓存在 friend_list_{userId}，值为 (ETag, JSON 字节)
+# 好友关系、备注变化时删除双方或本人的缓存；用户改昵称头像、注销时删除所有把他当作好友的人的缓存
+# ETag 由内容计算，缓存被淘汰后重建出的相同列表 ETag 不变
+FRIEND_LIST_TIMEOUT = 60 * 60 * 24
+
+
+def _key(userId: str) -> str:
+    return f"friend_list_{userId}"
+
+
+# 一次查询：好友关系连同好友的昵称、头像、注销状态，只取列表需要的列
+def query_friend_list(userId: str) -> list:
+    friend = User.objects.filter(userId=OuterRef("friendId"))
+    rows = (
+        Friendship.objects.filter(userId=userId, status=True)
+        .annotate(
+            friendName=Subquery(friend.values("userName")[:1]),
+            friendAvatarUrl=Subquery(friend.values("avatarUrl")[:1]),
+            friendIsDeleted=Subquery(friend.values("isDeleted")[:1]),
+        )
+        .filter(friendName__isnull=False)
+        .order_by("id")
+        .values_list("friendId", "friendName", "friendAvatarUrl", "friendIsDeleted", "tag")
+    )
+    return [
+        {"userId": friendId, "userName": userName, "avatarUrl": avatarUrl, "isDeleted": bool(isDeleted), "tag": tag}
+        for friendId, userName, avatarUrl, isDeleted, tag in rows
+    ]
+
+
+def get_friend_list(userId: str):
+    cached = cache.get(_key(userId))
+    if cached is not None:
+        return cached
+    encoded = dumps(query_friend_list(userId))
+    cached = (f'"{hashlib.sha1(encoded).hexdigest()}"', encoded)
+    cache.set(_key(userId), cached, FRIEND_LIST_TIMEOUT)
+    return cached
+
+
+def invalidate_friend_lists(userIds) -> None:
+    cache.delete_many([_key(userId) for userId in userIds])
+
+
+# 用户资料变化后，删除所有好友列表中含有该用户的缓存
+def invalidate_friend_lists_containing(userId: str) -> None:
+    invalidate_friend_lists(Friendship.objects.filter(friendId=userId, status=True).values_list("userId", flat=True))
@@ -0,0 +1,41 @@
+from django_redis import get_redis_connection
+from utils.utils_rebuild import rebuild_set, update
+from .models import Friendship
+
+# 每个用户一个 Redis 集合 friends:{userId}，成员为其好友的 userId
+# 集合存在即视为完整：接受、删除好友时只增删已存在的集合，集合不存在时才由 is_friend 从数据库整体重建
+# 重建期间的增删见 utils.utils_rebuild；增删本身幂等，重放后与数据库一致，过期时间只兜底日志也过期等异常情况
+FRIEND_SET_TIMEOUT = 60 * 60 * 24
+
+
+def _key(userId: str) -> str:
+    return f"friends:{userId}"
+
+
+# 成为好友后双向加入对方
+def add_friends(userId: str, friendId: str) -> None:
+    update("sadd", [(_key(userId), friendId, ""), (_key(friendId), userId, "")])
+
+
+# 删除好友后双向移除
+def remove_friends(userId: str, friendId: str) -> None:
+    update("srem", [(_key(userId), friendId, ""), (_key(friendId), userId, "")])
+
+
+def rebuild_friend_set(userId: str) -> set:
+    return rebuild_set(
+        _key(userId),
+        lambda: set(Friendship.objects.filter(userId=userId, status=True).values_list("friendId", flat=True)),
+        FRIEND_SET_TIMEOUT,
+    )
+
+
+# 一次集合成员查询判断是否为好友；集合不存在时先重建
+def is_friend(userId: str, friendId: str) -> bool:
+    if not friendId:
+        return False
+    connection = get_redis_connection("default")
+    exists, member = connection.pipeline(transaction=False).exists(_key(userId)).sismember(_key(userId), friendId).execute()
+    if exists:
+        return bool(member)
+    return friendId in rebuild_friend_set(userId)
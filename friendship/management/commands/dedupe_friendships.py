@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Count
+
+from friendship.models import Friendship
+
+
+class Command(BaseCommand):
+    help = "合并重复的 (userId, friendId) 好友行，需在 migrate 建立唯一约束之前执行，可重复执行"
+
+    def handle(self, *args, **options):
+        # 首次部署时表尚未创建，无需处理
+        if Friendship._meta.db_table not in connection.introspection.table_names():
+            return
+
+        duplicates = (
+            Friendship.objects.values("userId", "friendId")
+            .annotate(count=Count("id"))
+            .filter(count__gt=1)
+            .order_by()
+        )
+        total = 0
+        for pair in duplicates.iterator():
+            # 保留仍为好友且最新的一行，其余删除
+            rows = Friendship.objects.filter(userId=pair["userId"], friendId=pair["friendId"]).order_by("-status", "-id")
+            keep = rows.values_list("id", flat=True).first()
+            total += rows.exclude(id=keep).delete()[0]
+        self.stdout.write(f"已删除 {total} 条重复的好友行")
@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import OuterRef, Subquery
 from utils.utils_time import get_timestamp
 from account.models import User
 from utils.utils_time import timestamp_to_datetime
@@ -13,6 +14,14 @@ class Friendship(models.Model):
 
     class Meta:
         db_table = 'friendship'
+        constraints = [
+            # 每对 (userId, friendId) 只有一行，删除好友只把 status 置为 False，再次成为好友时复用
+            models.UniqueConstraint(fields=["userId", "friendId"], name="friendship_user_friend_uniq"),
+        ]
+        indexes = [
+            # 好友列表与好友集合重建按 (userId, status) 取行
+            models.Index(fields=["userId", "status", "friendId"], name="friendship_user_status_idx"),
+        ]
 
     def serialize(self):
         friendInfo = User.objects.filter(userId=self.friendId).values("userId", "userName", "avatarUrl", "isDeleted").first()
@@ -29,13 +38,28 @@ class FriendshipRequest(models.Model):
 
     class Meta:
         db_table = 'friendship_request'
+        indexes = [
+            # 收到的申请按 id 倒序分页
+            models.Index(fields=["receiverId", "id"], name="friendship_request_inbox_idx"),
+        ]
+
+    # 在同一次查询中带上发送者的昵称和头像，serialize 不再逐条查询用户
+    @staticmethod
+    def with_sender(queryset):
+        sender = User.objects.filter(userId=OuterRef("senderId"))
+        return queryset.annotate(
+            senderName=Subquery(sender.values("userName")[:1]),
+            senderAvatarUrl=Subquery(sender.values("avatarUrl")[:1]),
+        )
 
     def serialize(self):
-        senderInfo = User.objects.filter(userId=self.senderId).values("userName", "avatarUrl").first()
+        if not hasattr(self, "senderName"):
+            senderInfo = User.objects.filter(userId=self.senderId).values("userName", "avatarUrl").first()
+            self.senderName, self.senderAvatarUrl = senderInfo["userName"], senderInfo["avatarUrl"]
         return {
             "id": self.senderId,
-            "name": senderInfo["userName"],
-            "avatarUrl": senderInfo["avatarUrl"],
+            "name": self.senderName,
+            "avatarUrl": self.senderAvatarUrl,
             "message": self.message,
             "sendTime": timestamp_to_datetime(self.sendTime),
             "status": self.status,
@@ -1,7 +1,14 @@
+import time
+import uuid
+from unittest import mock
+from django.core.cache import cache
+from django_redis import get_redis_connection
 from django.test import TestCase
 from account.models import User
 from django.contrib.auth.hashers import make_password
 from friendship.models import Friendship,FriendshipRequest
+from friendship.friend_set import is_friend, rebuild_friend_set
+from utils.utils_throttle import take_token
 from chat.models import Conversation
 from django.db.models import Count
 
@@ -9,6 +16,8 @@ from django.db.models import Count
 class FriendshipTestCase(TestCase):
 
     def setUp(self):
+        # 好友列表缓存在共享的 Redis 中，每个用例前删除用例涉及的键
+        self.clear_redis_for_test()
         self.data1 = {"userName": "user1", "userId":"user1", "password": "123456"}
         self.data2 = {'userName': "user2", "userId":"user2", "password": '123456'}
         data1 = self.data1.copy()
@@ -18,6 +27,15 @@ class FriendshipTestCase(TestCase):
         self.user1 = User.objects.create(**data1)
         self.user2 = User.objects.create(**data2)
 
+    # 只删除用例涉及的键，不清空共享的 Redis
+    def clear_redis_for_test(self):
+        userIds = ["user1", "user2", "user3"]
+        connection = get_redis_connection("default")
+        patterns = [f"{prefix}:{userId}*" for userId in userIds for prefix in ("friends", "throttle:friend_request")]
+        keys = [key for pattern in patterns for key in connection.scan_iter(pattern)]
+        connection.delete("throttle:test", *keys)
+        cache.delete_many([f"friend_list_{userId}" for userId in userIds])
+
     def login_for_test(self, data):
         response = self.client.post('/login/', data=data, content_type='application/json')
         token = response.json()['token']
@@ -205,6 +223,76 @@ class FriendshipTestCase(TestCase):
         self.assertEqual(response.json()['data'][1]['userId'], self.data2["userId"])
         self.assertEqual(response.json()['data'][1]['userName'],self.data2["userName"])
    
+    def test_friend_list_cached_with_etag(self):
+        token1 = self.login_for_test(self.data1)
+        self.add_friend_for_test(token1, {"userId": self.data1["userId"], "searchId": self.data2["userId"], "message": "hi"})
+        token2 = self.login_for_test(self.data2)
+        self.accept_friend_for_test(token2, {"senderId": self.data1["userId"], "receiverId": self.data2["userId"]})
+        url = f'/friends/myfriends/{self.data1["userId"]}/'
+
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_AUTHORIZATION=token1)
+        self.assertEqual(response.json()['data'], [{
+            "userId": self.data2["userId"], "userName": self.data2["userName"],
+            "avatarUrl": self.user2.avatarUrl, "isDeleted": False, "tag": "",
+        }])
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_AUTHORIZATION=token1, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # 备注与好友资料变化后缓存失效，ETag 随之改变
+        self.client.post('/friends/add_tag/', data={"userId": self.data1["userId"], "friendId": self.data2["userId"], "tag": "Hola"}, HTTP_AUTHORIZATION=token1, content_type='application/json')
+        response = self.client.get(url, HTTP_AUTHORIZATION=token1, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['data'][0]['tag'], "Hola")
+        self.assertNotEqual(response['ETag'], etag)
+
+        self.client.post(f'/update_profile/{self.data2["userId"]}/', data={"password": self.data2["password"], "newName": "renamed"}, HTTP_AUTHORIZATION=token2, content_type='application/json')
+        response = self.client.get(url, HTTP_AUTHORIZATION=token1)
+        self.assertEqual(response.json()['data'][0]['userName'], "renamed")
+
+        self.client.post('/friends/delete_friend/', data={"userId": self.data1["userId"], "friendId": self.data2["userId"]}, HTTP_AUTHORIZATION=token1, content_type='application/json')
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION=token1).json()['data'], [])
+
+    def test_private_chat_found_by_pair_key(self):
+        data3 = {"userName": "user3", "userId": "user3", "password": "123456"}
+        self.client.post("/register/", data=data3, content_type='application/json')
+        token1 = self.login_for_test(self.data1)
+        for friend in [self.data2, data3]:
+            self.add_friend_for_test(token1, {"userId": self.data1["userId"], "searchId": friend["userId"], "message": "hi"})
+            self.accept_friend_for_test(self.login_for_test(friend), {"senderId": self.data1["userId"], "receiverId": friend["userId"]})
+
+        # 每对好友各有自己的私聊，不会误用与第三人的私聊
+        first = Conversation.private_between(self.data2["userId"], self.data1["userId"])
+        second = Conversation.private_between(self.data1["userId"], data3["userId"])
+        self.assertNotEqual(first.id, second.id)
+        self.assertEqual(first.pairKey, "user1:user2")
+        self.assertEqual(sorted(first.members.values_list("userId", flat=True)), ["user1", "user2"])
+
+        with self.assertNumQueries(1):
+            Conversation.private_between(self.data1["userId"], self.data2["userId"])
+
+        self.client.post('/friends/delete_friend/', data={"userId": self.data1["userId"], "friendId": self.data2["userId"]}, HTTP_AUTHORIZATION=token1, content_type='application/json')
+        self.assertFalse(Conversation.objects.get(id=first.id).status)
+        self.assertTrue(Conversation.objects.get(id=second.id).status)
+
+        # 重新成为好友时复用原来的私聊
+        self.add_friend_for_test(token1, {"userId": self.data1["userId"], "searchId": self.data2["userId"], "message": "again"})
+        self.accept_friend_for_test(self.login_for_test(self.data2), {"senderId": self.data1["userId"], "receiverId": self.data2["userId"]})
+        self.assertTrue(Conversation.objects.get(id=first.id).status)
+        self.assertEqual(Conversation.objects.filter(type="private_chat").count(), 2)
+
+    def test_private_chat_rolled_back_with_members(self):
+        token1 = self.login_for_test(self.data1)
+        self.add_friend_for_test(token1, {"userId": self.data1["userId"], "searchId": self.data2["userId"], "message": "hi"})
+
+        # 成员区间写入失败时，私聊本身也不应提交
+        with mock.patch("friendship.views.Membership.join", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.accept_friend_for_test(self.login_for_test(self.data2), {"senderId": self.data1["userId"], "receiverId": self.data2["userId"]})
+        self.assertFalse(Conversation.objects.filter(pairKey="user1:user2").exists())
+
     def test_get_requests_list(self):
         newData ={
             "userName": "user3", "userId":"user3", "password": "123456"
@@ -235,6 +323,50 @@ class FriendshipTestCase(TestCase):
         self.assertEqual(response.json()['data'][1]['id'], self.data1["userId"])
         self.assertEqual(response.json()['data'][1]['message'], 'hello react')
 
+    def test_requests_list_paged_in_one_query(self):
+        for i in range(5):
+            User.objects.create(userId=f"sender{i}", userName=f"sender{i}", password="-")
+            FriendshipRequest.objects.create(senderId=f"sender{i}", receiverId="user1", message=f"hello {i}")
+        token = self.login_for_test(self.data1)
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/friends/myrequests/user1/?limit=3', HTTP_AUTHORIZATION=token)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['id'] for item in response.json()['data']], ["sender4", "sender3", "sender2"])
+        self.assertEqual(response.json()['data'][0]['name'], "sender4")
+        self.assertTrue(response.json()['hasNext'])
+
+        response = self.client.get(f'/friends/myrequests/user1/?limit=3&cursor={response.json()["nextCursor"]}', HTTP_AUTHORIZATION=token)
+        self.assertEqual([item['id'] for item in response.json()['data']], ["sender1", "sender0"])
+        self.assertFalse(response.json()['hasNext'])
+        self.assertIsNone(response.json()['nextCursor'])
+
+        response = self.client.get('/friends/myrequests/user1/?cursor=%%%', HTTP_AUTHORIZATION=token)
+        self.assertEqual(response.status_code, 400)
+
+    def test_friend_request_token_bucket(self):
+        self.assertTrue(take_token("test", 2, 0.05))
+        self.assertTrue(take_token("test", 2, 0.05))
+        self.assertFalse(take_token("test", 2, 0.05))
+        time.sleep(0.06)
+        self.assertTrue(take_token("test", 2, 0.05))
+        self.assertFalse(take_token("test", 2, 0.05))
+
+        # 被限流的申请不访问数据库
+        token = self.login_for_test(self.data1)
+        data = {"userId": "user1", "searchId": "user2", "message": "hello world"}
+        self.add_friend_for_test(token, data)
+        with self.assertNumQueries(0):
+            response = self.add_friend_for_test(token, data)
+        self.assertEqual(response.json()['info'], '发送申请过于频繁')
+        # 再次申请取代此前未处理的申请
+        self.clear_redis_for_test()
+        self.add_friend_for_test(token, data)
+        self.assertEqual(
+            list(FriendshipRequest.objects.filter(senderId="user1", receiverId="user2").order_by("id").values_list("status", flat=True)),
+            [2, 0],
+        )
+
     def test_check_friendship(self):
         data = {
             "userId": self.data1["userId"],
@@ -270,6 +402,48 @@ class FriendshipTestCase(TestCase):
         self.assertTrue(response.json()['deleteStatus'])
         self.assertFalse(response.json()['friendshipStatus'])
         
+    def test_friend_set_follows_accept_and_delete(self):
+        token = self.login_for_test(self.data1)
+        self.add_friend_for_test(token, {"userId": "user1", "searchId": "user2", "message": "hello world"})
+        # 接受前先把双方的集合加载进 Redis，之后只靠增量更新
+        self.assertFalse(is_friend("user1", "user2"))
+        self.assertFalse(is_friend("user2", "user1"))
+        newToken = self.login_for_test(self.data2)
+        self.accept_friend_for_test(newToken, {"senderId": "user1", "receiverId": "user2"})
+        with self.assertNumQueries(0):
+            self.assertTrue(is_friend("user1", "user2"))
+            self.assertTrue(is_friend("user2", "user1"))
+            self.assertFalse(is_friend("user1", ""))
+
+        self.client.post('/friends/delete_friend/', data={"userId": "user1", "friendId": "user2"}, HTTP_AUTHORIZATION=token, content_type='application/json')
+        with self.assertNumQueries(0):
+            self.assertFalse(is_friend("user1", "user2"))
+            self.assertFalse(is_friend("user2", "user1"))
+        # 集合失效后从数据库重建，结果一致
+        self.clear_redis_for_test()
+        self.assertFalse(is_friend("user1", "user2"))
+        self.assertEqual(rebuild_friend_set("user2"), set())
+        self.assertGreater(get_redis_connection("default").ttl("friends:user1"), 0)
+
+    def test_friend_set_add_during_rebuild(self):
+        token = self.login_for_test(self.data1)
+        self.add_friend_for_test(token, {"userId": "user1", "searchId": "user2", "message": "hello world"})
+        newToken = self.login_for_test(self.data2)
+        self.assertFalse(is_friend("user2", "user1"))
+        get_redis_connection("default").delete("friends:user1")
+
+        # 重建查询数据库之后、写入集合之前接受的申请不会丢失；重建生成临时键名时已查询完数据库，此时接受申请
+        # 只在首次调用时接受，避免接受过程中再次触发重建
+        def accept_then_uuid4():
+            staging.uuid4.side_effect = uuid.uuid4
+            self.accept_friend_for_test(newToken, {"senderId": "user1", "receiverId": "user2"})
+            return uuid.uuid4()
+        with mock.patch("utils.utils_rebuild.uuid") as staging:
+            staging.uuid4.side_effect = accept_then_uuid4
+            self.assertEqual(rebuild_friend_set("user1"), set())
+        with self.assertNumQueries(0):
+            self.assertTrue(is_friend("user1", "user2"))
+
     def test_add_tag(self):
         token = self.login_for_test(self.data1)
         add_data = {
@@ -1,36 +1,41 @@
 from django.http import HttpRequest, HttpResponse
-from utils.utils_request import request_failed, request_success,BAD_METHOD
-from utils.utils_require import require
-from utils.utils_jwt import check_jwt_token, jwt_required
-from utils.utils_time import  get_timestamp
+from django.utils.http import parse_etags
+from utils.utils_request import RawJSON, request_failed, request_success,BAD_METHOD
+from utils.utils_require import Schema, request_body
+from utils.utils_jwt import jwt_required
+from utils.utils_cursor import decode_cursor, encode_cursor
+from utils.utils_throttle import take_token
 from .models import Friendship, FriendshipRequest  
+from .friend_list import get_friend_list as get_cached_friend_list, invalidate_friend_lists
+from .friend_set import add_friends, is_friend, remove_friends
 from account.models import User
-import json
 from datetime import datetime, timezone
 from chat.models import Conversation
-from chat.models import Message
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
+from chat.models import Membership, Message
+from chat.outbox import make_frame, publish, publish_subscribe, publish_to_conversation
+from chat.unread import incr_unread, reset_unread
+from django.db import IntegrityError, transaction
 from django.db.models import Q
-from django.db.models import Count
-from django.core.cache import cache
 # Create your views here.
+# 同一用户向同一人发送申请的频率限制：每 10 秒一次
+FRIEND_REQUEST_INTERVAL = 10
+
+ADD_FRIEND_SCHEMA = Schema(userId="string", searchId="string", message="string")
+
 @jwt_required
 def add_friend(request:HttpRequest) -> HttpResponse:
     if request.method != 'POST':
         return BAD_METHOD
     
-    body = json.loads(request.body.decode('utf-8'))
-    userId = require(body,"userId", "string",
-                     err_msg="Missing or error type of [userId]")
-    searchId = require(body,"searchId", "string",
-                     err_msg="Missing or error type of [searchId]")
-    message = require(body,"message", "string",
-                     err_msg="Missing or error type of [message]")
+    body = request_body(request)
+    userId, searchId, message = ADD_FRIEND_SCHEMA.parse(body)
     
     
     if searchId == userId:
         return request_failed(-4, "不能添加自己为好友", 403)
+    # 避免频繁发送请求，在访问数据库之前先从令牌桶取令牌
+    if not take_token(f"friend_request:{userId}:{searchId}", 1, FRIEND_REQUEST_INTERVAL):
+        return request_failed(-4, "发送申请过于频繁", 403)
     
     try:
         User.objects.get(userId=searchId, isDeleted=False)
@@ -38,37 +43,27 @@ def add_friend(request:HttpRequest) -> HttpResponse:
         return request_failed(-1, "用户不存在或已注销", 404)
 
    
-    if Friendship.objects.filter(userId=userId, friendId=searchId, status=True).exists():
+    if is_friend(userId, searchId):
             return request_failed(-4, "已经是好友", 403)
-    try:
-        # 避免频繁发送请求，这里采取限制，同一用户一定时间内只能发送一次请求，方便测试采用1s
-        friendshipRequest = FriendshipRequest.objects.filter(senderId=userId, receiverId=searchId).latest("sendTime")
-        if get_timestamp() - friendshipRequest.sendTime < 10 :
-            return request_failed(-4, "发送申请过于频繁", 403)
-        else:
-            friendshipRequest.status = 2
-            friendshipRequest.save()
-    except FriendshipRequest.DoesNotExist:
-        pass
-        
-    friendshipRequest = FriendshipRequest(senderId=userId, receiverId=searchId, message=message)
-    friendshipRequest.save()
-    
-    channelLayer = get_channel_layer()
-    async_to_sync(channelLayer.group_send)(
-        searchId, {"type": "friend_request", "message":  friendshipRequest.serialize()})
+    with transaction.atomic():
+        # 新申请取代此前未处理的申请
+        FriendshipRequest.objects.filter(senderId=userId, receiverId=searchId, status=0).update(status=2)
+        friendshipRequest = FriendshipRequest(senderId=userId, receiverId=searchId, message=message)
+        friendshipRequest.save()
+        publish([searchId], make_frame(
+            "friend_request", "friend_request", None, User.bump_friend_request_version(searchId), friendshipRequest.serialize()
+        ))
     return request_success({"message": "成功发送请求"})
 
+DELETE_FRIEND_SCHEMA = Schema(userId="string", friendId="string")
+
 @jwt_required
 def delete_friend(request:HttpRequest) -> HttpResponse:
     if request.method != 'POST':
         return BAD_METHOD
     
-    body = json.loads(request.body.decode('utf-8'))
-    userId = require(body, "userId", "string",
-                    err_msg="Missing or error type of [userId]")
-    friendId = require(body, "friendId", "string",
-                    err_msg="Missing or error type of [friendId]")
+    body = request_body(request)
+    userId, friendId = DELETE_FRIEND_SCHEMA.parse(body)
     
     try:
         # 将双方的好友关系设置为False，清空tag，并删除会话
@@ -76,12 +71,12 @@ def delete_friend(request:HttpRequest) -> HttpResponse:
             (Q(userId=userId) & Q(friendId=friendId)) | (Q(userId=friendId) & Q(friendId=userId)),
             status=True
         ).update(status=False, tag="")
+        remove_friends(userId, friendId)
+        invalidate_friend_lists([userId, friendId])
 
-        user_ids = User.objects.filter(userId__in=[userId, friendId]).values_list('id', flat=True)
-        if len(user_ids) != 2:
+        if User.objects.filter(userId__in=[userId, friendId]).count() != 2:
             return request_failed(-1, "用户不存在", 404)
-        conversation = Conversation.objects.filter( type='private_chat', members__in=user_ids,
-            ).annotate(num_members=Count('members')).filter(num_members=2).first()
+        conversation = Conversation.private_between(userId, friendId)
         if conversation is not None:
             conversation.status = False
             conversation.save()
@@ -92,21 +87,18 @@ def delete_friend(request:HttpRequest) -> HttpResponse:
 
     return request_success({"message": "删除成功"})
 
+ACCEPT_FRIEND_SCHEMA = Schema(receiverId="string", senderId="string")
+
 def accept_friend(request:HttpRequest) -> HttpResponse:
     if request.method != 'POST':
         return BAD_METHOD
     
-    body = json.loads(request.body.decode('utf-8'))
-    token = request.headers.get('Authorization')
-    payload = check_jwt_token(token)
-    receiverId = require(body, "receiverId", "string",
-                     err_msg="Missing or error type of [userId]")
-    senderId = require(body, "senderId", "string",
-                     err_msg="Missing or error type of [friendId]")
-    if payload is None or payload["userId"] != receiverId:
+    body = request_body(request)
+    receiverId, senderId = ACCEPT_FRIEND_SCHEMA.parse(body)
+    if request.jwtUserId is None or request.jwtUserId != receiverId:
         return request_failed(-3, "JWT 验证失败", 401)
     
-    if Friendship.objects.filter(userId=receiverId, friendId=senderId, status=True).exists():
+    if is_friend(receiverId, senderId):
         return request_failed(-4, "已经是好友", 403)
     
     # 更新好友请求状态为已处理
@@ -129,6 +121,8 @@ def accept_friend(request:HttpRequest) -> HttpResponse:
         )
     except Exception as e:
         return request_failed(-1, str(e), 500)
+    add_friends(receiverId, senderId)
+    invalidate_friend_lists([receiverId, senderId])
     
     if User.objects.filter(userId=senderId).exists() is False:
         return request_failed(-1, "用户不存在", 404)
@@ -136,37 +130,44 @@ def accept_friend(request:HttpRequest) -> HttpResponse:
         return request_failed(-1, "用户不存在", 404)
     
     try:
-        conversation = Conversation.objects.filter( type='private_chat', members__userId__in=[receiverId, senderId],
-            ).annotate(num_members=Count('members')).filter(num_members=2).first()
-        if conversation is None:
-            conversation = Conversation.objects.create(type="private_chat")
-            conversation.members.set(User.objects.filter(userId__in=[receiverId, senderId]))
-        else:
+        conversation = Conversation.private_between(receiverId, senderId)
+        created = conversation is None
+        if created:
+            # 建会话、加成员与成员区间一并提交，中途失败时不留下没有成员的私聊
+            try:
+                with transaction.atomic():
+                    conversation = Conversation.objects.create(
+                        type="private_chat", pairKey=Conversation.pair_key(receiverId, senderId)
+                    )
+                    members = list(User.objects.filter(userId__in=[receiverId, senderId]))
+                    conversation.members.set(members)
+                    Membership.join(conversation.id, [member.id for member in members])
+            except IntegrityError:
+                # 并发接受时对方已建好私聊
+                conversation = Conversation.private_between(receiverId, senderId)
+                created = False
+        if not created:
             conversation.status = True
-        conversation.save()
-        for userId in [receiverId, senderId]:
-            cacheKey = f'conversations_{userId}'
-            if cache.get(cacheKey) is not None:
-                cache.delete(cacheKey)
+            conversation.save()
         
       
     except User.DoesNotExist:
         return request_failed(-1, "用户不存在", 404)
  
     receiver = User.objects.get(userId=receiverId)
-    message = Message.objects.create(
-            conversation=conversation, sender=receiver, content="我们已经成为好友了",
-            sendTime = datetime.now(tz=timezone.utc), updateTime = datetime.now(tz=timezone.utc)
-        )
-    cacheKey = f"unread_count_{conversation.id}_{senderId}"
-    cache.set(cacheKey, 1, 60*5)
-    message.receivers.set(conversation.members.all())
-    conversation.updateTime = datetime.now(tz=timezone.utc)
-    conversation.save()
-
-    channelLayer = get_channel_layer()
-    for member in conversation.members.all():
-        async_to_sync(channelLayer.group_send)(member.userId, {"type": "friend_request"})        
+    with transaction.atomic():
+        message = Message.create_next(
+                conversation.id, sender=receiver, content="我们已经成为好友了",
+                sendTime = datetime.now(tz=timezone.utc), updateTime = datetime.now(tz=timezone.utc)
+            )
+        frame = make_frame("friend_request", "message", conversation.id, message.seq, message.serialize([], []))
+        if created:
+            publish_subscribe([receiverId, senderId], conversation.id, frame)
+        else:
+            publish_to_conversation(conversation.id, frame)
+    if created:
+        reset_unread([receiverId, senderId], conversation.id)
+    incr_unread([senderId], conversation.id)
     return request_success({"message": "接受成功"})
 
 
@@ -175,16 +176,20 @@ def get_friend_list(request:HttpRequest, userId:str) -> HttpResponse:
     if request.method != 'GET':
         return BAD_METHOD
     
-    token = request.headers.get('Authorization')
-    payload = check_jwt_token(token)
-    if payload is None or payload["userId"] != userId:
+    if request.jwtUserId is None or request.jwtUserId != userId:
         return request_failed(-3, "JWT 验证失败", 401)
     
 
-    friendships = Friendship.objects.filter(userId=userId, status=True)
-    friendList = [friendship.serialize() for friendship in friendships]
-
-    return request_success(friendList)
+    # 好友列表连同好友资料一次查询并按用户缓存，内容未变时返回 304
+    etag, encoded = get_cached_friend_list(userId)
+    etags = parse_etags(request.headers.get("If-None-Match", ""))
+    if etag in etags or "*" in etags:
+        response = HttpResponse(status=304)
+    else:
+        response = request_success({"data": RawJSON(encoded)})
+    response["ETag"] = etag
+    response["Cache-Control"] = "private, no-cache"
+    return response
 
 
 # 从数据库中筛选出发给自己的好友请求，返回一个list
@@ -192,26 +197,42 @@ def get_friendshipRequest_list(request:HttpRequest, userId:str) -> HttpResponse:
     if request.method != 'GET':
         return BAD_METHOD
     
-    token = request.headers.get('Authorization')
-    payload = check_jwt_token(token)
-    
-    if payload is None or payload["userId"] != userId:  
+    if request.jwtUserId is None or request.jwtUserId != userId:
         return request_failed(-3, "JWT 验证失败", 401)
     
-    friendshipRequests = FriendshipRequest.objects.filter(receiverId=userId).order_by("-sendTime")[:30]
-    requestList = [friendshipRequest.serialize() for friendshipRequest in friendshipRequests]
+    cursor: str = request.GET.get("cursor")
+    try:
+        limit = int(request.GET.get("limit", "30"))
+    except ValueError:
+        return request_failed(-2, "limit 格式错误", 400)
+    if limit <= 0:
+        return request_failed(-2, "limit 格式错误", 400)
 
-    return request_success(requestList)
+    # 申请的 sendTime 在创建时写入，按 id 倒序即按发送时间倒序；游标为上一页最后一条申请的 id
+    friendshipRequests = FriendshipRequest.with_sender(FriendshipRequest.objects.filter(receiverId=userId)).order_by("-id")
+    if cursor:
+        position = decode_cursor(cursor, 1)
+        if position is None:
+            return request_failed(-2, "游标格式错误", 400)
+        friendshipRequests = friendshipRequests.filter(id__lt=position[0])
+    friendshipRequests = list(friendshipRequests[: limit + 1])
+    hasNext = len(friendshipRequests) > limit
+    friendshipRequests = friendshipRequests[:limit]
+
+    return request_success({
+        "data": [friendshipRequest.serialize() for friendshipRequest in friendshipRequests],
+        "hasNext": hasNext,
+        "nextCursor": encode_cursor(friendshipRequests[-1].id) if hasNext else None,
+    })
+
+CHECK_FRIENDSHIP_SCHEMA = Schema(userId="string", friendId="string")
 
 @jwt_required
 def check_friendship(request:HttpRequest) -> HttpResponse:
     if request.method != 'POST':
         return BAD_METHOD
-    body = json.loads(request.body.decode('utf-8'))
-    userId = require(body, "userId", "string",
-                     err_msg="Missing or error type of [userId]")
-    friendId = require(body, "friendId", "string",
-                     err_msg="Missing or error type of [friendId]")
+    body = request_body(request)
+    userId, friendId = CHECK_FRIENDSHIP_SCHEMA.parse(body)
 
     
     try:
@@ -220,21 +241,18 @@ def check_friendship(request:HttpRequest) -> HttpResponse:
         return request_failed(-1, "用户不存在", 404)
     
     deleteStatus = True if friend.isDeleted == True else False
-    friendshipStatus = True if Friendship.objects.filter(userId=userId, friendId=friendId, status=True).exists() else False
+    friendshipStatus = is_friend(userId, friendId)
     return request_success({"deleteStatus": deleteStatus,"friendshipStatus": friendshipStatus})
 
+ADD_TAG_SCHEMA = Schema(userId="string", friendId="string", tag="string")
+
 @jwt_required
 def add_tag(request:HttpRequest) -> HttpResponse:
     if request.method != 'POST':
         return BAD_METHOD
-    body = json.loads(request.body.decode('utf-8'))
+    body = request_body(request)
 
-    userId = require(body, "userId", "string",
-                     err_msg="Missing or error type of [userId]")
-    friendId = require(body, "friendId", "string",
-                     err_msg="Missing or error type of [friendId]")
-    tag = require(body, "tag", "string",
-                     err_msg="Missing or error type of [tag]")
+    userId, friendId, tag = ADD_TAG_SCHEMA.parse(body)
     
   
     if User.objects.filter(userId=friendId, isDeleted=False).exists() is False:
@@ -242,11 +260,9 @@ def add_tag(request:HttpRequest) -> HttpResponse:
     if len(tag) > 30:
         return request_failed(-2, "tag长度不能超过30", 400)
     
-    try:
-        friendship = Friendship.objects.get(userId=userId, friendId=friendId,status=True)
-        friendship.tag = tag
-        friendship.save()
-    except Friendship.DoesNotExist:
+    if not is_friend(userId, friendId):
         return request_failed(-1, "好友关系不存在", 404)
+    Friendship.objects.filter(userId=userId, friendId=friendId, status=True).update(tag=tag)
+    invalidate_friend_lists([userId])
     
     return request_success({"message": "tag添加成功"})
@@ -2,7 +2,18 @@
 service redis-server start
 
 python3 manage.py makemigrations account friendship chat
+python3 manage.py dedupe_friendships
 python3 manage.py migrate
+python3 manage.py backfill_message_seq
+python3 manage.py backfill_read_states
+python3 manage.py backfill_message_tombstones
+python3 manage.py backfill_memberships
+python3 manage.py backfill_last_message
+python3 manage.py backfill_notification_users
+python3 manage.py backfill_pair_keys
+python3 manage.py convert_avatars
+
+python3 manage.py dispatch_outbox &
 
 
 daphne -b 0.0.0.0 -p 80 tasright_backend.asgi:application 
\ No newline at end of file
@@ -1,16 +1,43 @@
 import json
+from urllib.parse import parse_qs
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
+from utils.utils_channel import conversation_group, user_group
+
+
+@database_sync_to_async
+def get_conversation_ids(userId: str) -> list:
+    # 延迟导入，asgi.py 在 django.setup() 之前导入本模块
+    from chat.models import Conversation
+
+    return list(Conversation.objects.filter(members__userId=userId).values_list("id", flat=True))
 
 
 class ChatConsumer(AsyncWebsocketConsumer):
     # 当客户端尝试建立 WebSocket 连接时调用
     async def connect(self) -> None:
-        # 从查询字符串中提取用户名
-        self.userId: str = self.scope["query_string"].decode("utf-8").split("=")[1]
+        # 从查询字符串中提取用户名与 token；浏览器的 WebSocket 无法设置请求头，token 也可放在查询字符串中
+        query = parse_qs(self.scope["query_string"].decode("utf-8"))
+        self.userId: str = query.get("userId", [""])[0]
+        token = query.get("token", [None])[0] or dict(self.scope["headers"]).get(b"authorization", b"").decode("utf-8")
+
+        # 推送帧携带消息正文与会话快照，token 缺失或与 userId 不符时拒绝连接
+        # 延迟导入，utils_jwt 导入时需要已配置的 settings
+        from utils.utils_jwt import check_jwt_token
+
+        payload = check_jwt_token(token)
+        if not self.userId or payload is None or payload["userId"] != self.userId:
+            await self.close()
+            return
 
         # 将当前 WebSocket 连接添加到一个全体用户组中
         # 这样可以确保发给这个组的所有消息都会被转发给目前连接的所有客户端
-        await self.channel_layer.group_add(self.userId, self.channel_name)
+        await self.channel_layer.group_add(user_group(self.userId), self.channel_name)
+
+        # 同时加入用户所在的每个会话组，会话内的通知只需向会话组发送一次
+        self.conversationIds = set(await get_conversation_ids(self.userId))
+        for conversationId in self.conversationIds:
+            await self.channel_layer.group_add(conversation_group(conversationId), self.channel_name)
 
         # 接受 WebSocket 连接
         await self.accept()
@@ -18,48 +45,38 @@ class ChatConsumer(AsyncWebsocketConsumer):
     # 当 WebSocket 连接关闭时调用
     async def disconnect(self, close_code: int) -> None:
         # 将当前 WebSocket 从其所在的组中移除
-        await self.channel_layer.group_discard(self.userId, self.channel_name)
-
-    # 向指定用户组发送 notification
-    async def notify(self, event) -> None:
-        await self.send(text_data=json.dumps({"type": "notify"}))
+        await self.channel_layer.group_discard(user_group(self.userId), self.channel_name)
+        for conversationId in getattr(self, "conversationIds", ()):
+            await self.channel_layer.group_discard(conversation_group(conversationId), self.channel_name)
 
-    async def friend_request(self, event):
-        # 处理好友请求通知
-        await self.send(
-            text_data=json.dumps(
-                {
-                    "type": "friend_request",
-                }
-            )
-        )
+    # 成员加入会话后订阅会话组，并把推送帧转发给客户端
+    async def subscribe(self, event) -> None:
+        self.conversationIds.add(event["conversationId"])
+        await self.channel_layer.group_add(conversation_group(event["conversationId"]), self.channel_name)
+        await self.send(text_data=json.dumps(event["frame"]))
 
-    async def group_request(self, event):
-        # 处理创建群组通知
-        await self.send(
-            text_data=json.dumps(
-                {
-                    "type": "group_request",
-                }
-            )
-        )
+    # 成员离开会话后退订会话组，并把推送帧转发给客户端
+    async def unsubscribe(self, event) -> None:
+        self.conversationIds.discard(event["conversationId"])
+        await self.channel_layer.group_discard(conversation_group(event["conversationId"]), self.channel_name)
+        await self.send(text_data=json.dumps(event["frame"]))
 
-    async def kick_member(self, event):
-        # 处理踢人通知
-        await self.send(
-            text_data=json.dumps(
-                {
-                    "type": "kick_member",
-                }
-            )
-        )
+    # 推送帧由 chat.outbox.make_frame 生成，原样转发给客户端：
+    # 旧客户端只看 type 并重新拉取，新客户端按 event 直接应用 data
+    # exclude 中的用户（如刚被移出会话的成员）不转发
+    # 退订帧按 outbox 顺序先于其后写入的会话帧到达，处理时已移出 conversationIds；
+    # group_discard 生效前仍经会话组到达的帧，其会话不在 conversationIds 中，直接丢弃
+    async def forward(self, event) -> None:
+        exclude = event.pop("exclude", ())
+        if self.userId in exclude:
+            return
+        conversationId = event.get("conversationId")
+        if conversationId is not None and conversationId not in self.conversationIds:
+            return
+        await self.send(text_data=json.dumps(event))
 
-    async def group_modify(self, event):
-        # 处理群组信息修改通知
-        await self.send(
-            text_data=json.dumps(
-                {
-                    "type": "group_modify",
-                }
-            )
-        )
+    notify = forward
+    friend_request = forward
+    group_request = forward
+    kick_member = forward
+    group_modify = forward
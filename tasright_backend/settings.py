@@ -55,6 +55,10 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     # 'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # 验证 Authorization 中的 JWT，身份挂在 request.jwtUserId 上
+    'utils.utils_jwt.JwtMiddleware',
+    # 请求参数校验失败时返回 400
+    'utils.utils_require.RequestErrorMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -91,6 +95,25 @@ DATABASES = {
     }
 }
 
+# SQLite 生产环境调优，设置环境变量 SQLITE_PROFILE=production 时启用，见 tasright_backend/sqlite_backend
+# WAL 下读写互不阻塞，synchronous=NORMAL 只在检查点时 fsync；写事务以 BEGIN IMMEDIATE 开始，锁冲突时最多等待 timeout 秒
+SQLITE_PRODUCTION_PROFILE = {
+    'ENGINE': 'tasright_backend.sqlite_backend',
+    'OPTIONS': {
+        'timeout': 20,
+        'transaction_mode': 'IMMEDIATE',
+        'pragmas': {
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            'mmap_size': 256 * 1024 * 1024,
+            'cache_size': -64 * 1024,  # 负数单位为 KiB，即 64 MiB
+        },
+    },
+}
+
+if os.getenv('SQLITE_PROFILE') == 'production':
+    DATABASES['default'].update(SQLITE_PRODUCTION_PROFILE)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -128,6 +151,9 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# 头像按内容哈希存放的目录，见 utils/utils_avatar.py
+AVATAR_ROOT = BASE_DIR / 'media/avatars'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.1/ref/settings/#default-auto-field
 
@@ -161,4 +187,7 @@ CACHES = {
     }
 }
 
-CORS_ALLOW_ALL_ORIGINS = True
\ No newline at end of file
+CORS_ALLOW_ALL_ORIGINS = True
+
+# 响应编码器："orjson" 或 "json"，不设置时装有 orjson 则用 orjson，见 utils/utils_request.py
+RESPONSE_JSON_ENCODER = None
\ No newline at end of file
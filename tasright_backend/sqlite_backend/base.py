@@ -0,0 +1,24 @@
+from django.db.backends.sqlite3 import base
+
+
+# 在 Django 自带的 SQLite 后端上增加两个 OPTIONS：
+# pragmas：每个新连接建立后依次执行的 PRAGMA，如 WAL 日志模式、synchronous、mmap_size、cache_size
+# transaction_mode：atomic 开启事务时使用的 BEGIN 类型，IMMEDIATE 在事务开始时就取得写锁，
+# 先读后写的事务不会在升级写锁时直接报 database is locked，而是在 timeout 内排队等待
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        # 这两项不是 sqlite3.connect 的参数
+        kwargs.pop("pragmas", None)
+        kwargs.pop("transaction_mode", None)
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        connection = super().get_new_connection(conn_params)
+        for name, value in self.settings_dict["OPTIONS"].get("pragmas", {}).items():
+            connection.execute(f"PRAGMA {name} = {value}")
+        return connection
+
+    def _start_transaction_under_autocommit(self):
+        mode = self.settings_dict["OPTIONS"].get("transaction_mode")
+        self.cursor().execute(f"BEGIN {mode}" if mode else "BEGIN")
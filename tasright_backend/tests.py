@@ -0,0 +1,53 @@
+import sqlite3
+import tempfile
+from pathlib import Path
+from django.conf import settings
+from django.db import connections, transaction
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from tasright_backend.sqlite_backend.base import DatabaseWrapper
+
+# Create your tests here.
+class SqliteBackendTests(TestCase):
+
+    def setUp(self):
+        # 按生产配置连接一个临时文件数据库（WAL 不适用于内存数据库），注册为单独的别名供 atomic 使用
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = str(Path(self.directory.name) / "production.sqlite3")
+        settings_dict = {
+            **connections["default"].settings_dict,
+            **settings.SQLITE_PRODUCTION_PROFILE,
+            "NAME": self.path,
+        }
+        self.connection = DatabaseWrapper(settings_dict, alias="production")
+        setattr(connections._connections, "production", self.connection)
+
+    def tearDown(self):
+        self.connection.close()
+        delattr(connections._connections, "production")
+        self.directory.cleanup()
+
+    def test_pragmas_applied_on_connect(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode")
+            self.assertEqual(cursor.fetchone()[0], "wal")
+            cursor.execute("PRAGMA synchronous")
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+        # 这两项不会传给 sqlite3.connect
+        params = self.connection.get_connection_params()
+        self.assertNotIn("pragmas", params)
+        self.assertNotIn("transaction_mode", params)
+
+    def test_atomic_begins_immediate(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute("CREATE TABLE counter (value INTEGER)")
+        with CaptureQueriesContext(self.connection) as queries:
+            with transaction.atomic(using="production"):
+                with self.connection.cursor() as cursor:
+                    cursor.execute("SELECT count(*) FROM counter")
+                # 事务开始时即持有写锁，其他连接此时无法开始写事务
+                other = sqlite3.connect(self.path, timeout=0)
+                with self.assertRaisesRegex(sqlite3.OperationalError, "locked"):
+                    other.execute("BEGIN IMMEDIATE")
+                other.close()
+        self.assertEqual(queries[0]["sql"], "BEGIN IMMEDIATE")
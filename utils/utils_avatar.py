@@ -0,0 +1,94 @@
+import base64
+import binascii
+import hashlib
+import os
+import re
+import tempfile
+from pathlib import Path
+from typing import Optional, Tuple
+
+from django.conf import settings
+
+from utils.constants import group_default_avatarUrl, user_default_avatarUrl
+
+# 头像按内容的 sha256 存成磁盘上的文件，行中只保存 /avatars/<hash>.<ext>，同一张图片只存一份
+AVATAR_URL_PREFIX = "/avatars/"
+
+CONTENT_TYPES = {
+    "image/jpeg": "jpg",
+    "image/png": "png",
+    "image/gif": "gif",
+    "image/webp": "webp",
+}
+EXTENSIONS = {extension: contentType for contentType, extension in CONTENT_TYPES.items()}
+
+_DATA_URI = re.compile(r"^data:(?P<type>image/[a-z]+);base64,(?P<data>.*)$", re.S)
+_NAME = re.compile(r"^(?P<hash>[0-9a-f]{64})\.(?P<extension>[a-z]+)$")
+
+
+def _path(name: str) -> Path:
+    return Path(settings.AVATAR_ROOT) / name[:2] / name
+
+
+def is_data_uri(value) -> bool:
+    return isinstance(value, str) and value.startswith("data:")
+
+
+# 解析 data URI 并写入存储，返回头像地址；格式或类型不支持时抛出 ValueError
+def store_data_uri(value: str) -> str:
+    match = _DATA_URI.match(value)
+    if match is None or match["type"] not in CONTENT_TYPES:
+        raise ValueError("unsupported avatar data URI")
+    try:
+        content = base64.b64decode(match["data"], validate=True)
+    except binascii.Error as error:
+        raise ValueError("invalid base64 avatar") from error
+    return store_avatar(content, match["type"])
+
+
+def store_avatar(content: bytes, contentType: str) -> str:
+    name = f"{hashlib.sha256(content).hexdigest()}.{CONTENT_TYPES[contentType]}"
+    path = _path(name)
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # 先写临时文件再改名，并发写入同一张图片时读到的总是完整文件
+        fd, temporary = tempfile.mkstemp(dir=path.parent)
+        with os.fdopen(fd, "wb") as file:
+            file.write(content)
+        os.replace(temporary, path)
+    return AVATAR_URL_PREFIX + name
+
+
+# data URI 转存后返回地址，其余取值（外部链接、已转存的地址）原样返回
+def normalize_avatar(value: str) -> str:
+    return store_data_uri(value) if is_data_uri(value) else value
+
+
+# 按文件名查找头像，返回 (路径, sha256, Content-Type)，文件名不合法或不存在时返回 None
+def find_avatar(name: str) -> Optional[Tuple[Path, str, str]]:
+    match = _NAME.match(name)
+    if match is None or match["extension"] not in EXTENSIONS:
+        return None
+    path = _path(name)
+    if not path.is_file():
+        return None
+    return path, match["hash"], EXTENSIONS[match["extension"]]
+
+
+# 默认头像每个 AVATAR_ROOT 只解码、计算哈希并写入一次，之后直接返回缓存的地址
+_defaultAvatars = {}
+
+
+def _default_avatar(value: str) -> str:
+    key = (str(settings.AVATAR_ROOT), value)
+    if key not in _defaultAvatars:
+        _defaultAvatars[key] = store_data_uri(value)
+    return _defaultAvatars[key]
+
+
+def default_user_avatar() -> str:
+    return _default_avatar(user_default_avatarUrl)
+
+
+def default_group_avatar() -> str:
+    return _default_avatar(group_default_avatarUrl)
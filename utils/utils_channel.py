@@ -0,0 +1,11 @@
+# channel 组名：用户组为 user.<userId>，会话组为 conversation.<id>
+# userId 只含 \w 字符，不会出现 "."，两类组名不会相互冒充
+
+# 每个用户对应一个 channel 组，该用户的所有连接在建立时加入
+def user_group(userId: str) -> str:
+    return f"user.{userId}"
+
+
+# 每个会话对应一个 channel 组，成员的连接在建立时及成员变动时加入或离开该组
+def conversation_group(conversationId: int) -> str:
+    return f"conversation.{conversationId}"
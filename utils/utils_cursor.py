@@ -0,0 +1,25 @@
+import base64
+from typing import Optional, Tuple
+
+
+# 游标对客户端不透明，内容为若干整数以 "." 拼接后的 base64url 编码
+def encode_cursor(*values: int) -> str:
+    raw = ".".join(str(int(value)) for value in values)
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("utf-8").rstrip("=")
+
+
+# 游标中的 id、偏移量与微秒时间都是非负整数，且须能存入 SQLite 的 64 位整数
+_MAX_VALUE = 2 ** 63 - 1
+
+
+# 解析失败、长度不符或数值越界时返回 None，由调用方决定如何报错
+def decode_cursor(cursor: str, length: int) -> Optional[Tuple[int, ...]]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode("utf-8")).decode("utf-8")
+        values = tuple(int(value) for value in raw.split("."))
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if len(values) != length or not all(0 <= value <= _MAX_VALUE for value in values):
+        return None
+    return values
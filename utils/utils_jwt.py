@@ -5,10 +5,12 @@ import hmac
 import time
 import json
 import base64
+import threading
+from collections import OrderedDict
 from typing import Optional
 from functools import wraps
 from utils.utils_request import request_failed
-from utils.utils_require import require
+from utils.utils_require import request_body, require
 import inspect
 # 根据环境变量决定 SALT
 DJANGO_ENV = os.getenv('DJANGO_ENV', 'development')
@@ -65,49 +67,109 @@ def generate_jwt_token(userId: str):
     return header_b64 + "." + payload_b64 + "." + signature_b64
 
 
-def check_jwt_token(token: str) -> Optional[dict]:
-    # * Split token
+class VerifiedTokenCache:
+    # 已验证 token 的 LRU：命中时只需检查过期时间，不再重复 base64 解码、HMAC 与 json.loads
+    # 只缓存验证通过的 token，伪造的 token 无法挤占容量；daphne 在线程池中执行同步视图，需加锁
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, token: str, now: float) -> Optional[dict]:
+        with self.lock:
+            entry = self.entries.get(token)
+            if entry is None:
+                return None
+            data, exp = entry
+            if exp < now:
+                del self.entries[token]
+                return None
+            self.entries.move_to_end(token)
+            return data
+
+    def put(self, token: str, data: dict, exp: float) -> None:
+        with self.lock:
+            self.entries[token] = (data, exp)
+            self.entries.move_to_end(token)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+
+VERIFIED_TOKENS = VerifiedTokenCache(maxsize=10_000)
+
+
+# 完整验证签名与过期时间，返回 (data, exp)；任何格式错误都视为验证失败
+def verify_jwt_token(token: str):
     try:
         header_b64, payload_b64, signature_b64 = token.split(".")
-    except:
+    except (AttributeError, ValueError):
         return None
 
-    payload_str = b64url_decode(payload_b64)
-    
     # * Check signature
     signature_str_check = header_b64 + "." + payload_b64
     signature_check = hmac.new(SALT, signature_str_check.encode("utf-8"), digestmod=hashlib.sha256).digest()
     signature_b64_check = b64url_encode(signature_check)
-    
-    if signature_b64_check != signature_b64:
+
+    if not hmac.compare_digest(signature_b64_check, signature_b64):
         return None
-    
+
     # Check expire
-    payload = json.loads(payload_str)
-    if payload["exp"] < time.time():
+    try:
+        payload = json.loads(b64url_decode(payload_b64))
+        data, exp = payload["data"], payload["exp"]
+    except (ValueError, KeyError, TypeError):
         return None
-    
-    return payload["data"]
+    if exp < time.time():
+        return None
+
+    return data, exp
+
+
+def check_jwt_token(token: str) -> Optional[dict]:
+    if not token:
+        return None
+    data = VERIFIED_TOKENS.get(token, time.time())
+    if data is not None:
+        return data
+
+    verified = verify_jwt_token(token)
+    if verified is None:
+        return None
+    data, exp = verified
+    VERIFIED_TOKENS.put(token, data, exp)
+    return data
+
+
+class JwtMiddleware:
+    # 每个请求只验证一次 Authorization，把身份挂在 request.jwtUserId 上，视图直接比较，不再重新验证
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        payload = check_jwt_token(request.headers.get("Authorization"))
+        request.jwtUserId = payload["userId"] if payload is not None else None
+        return self.get_response(request)
+
 
 def jwt_required(f):
+    # 被装饰函数是否从 URL 中取 userId，在装饰时确定一次，不必每个请求都取函数签名
+    userIdInUrl = "userId" in inspect.signature(f).parameters
+
     @wraps(f)
     def decorated_function(request, *args, **kwargs):
-        token = request.headers.get("Authorization")
-        payload = check_jwt_token(token)
-
-        body = json.loads(request.body.decode("utf-8"))
-        # 获取被装饰函数的参数签名
-        signature = inspect.signature(f)
-        # 检查是否有名为 userId 的参数
-        if "userId" in signature.parameters:
+        if userIdInUrl:
             userId = kwargs.get("userId")  # 从关键字参数中获取 userId
         elif request.method == "POST":
-            userId = require(body, "userId",
+            userId = require(request_body(request), "userId",
                          err_msg='Missing or error type of [userId]')
         else:
             return request_failed(-3, "JWT 验证失败", 401)
-    
-        if payload is None or payload["userId"] != userId:
+
+        if request.jwtUserId is None or request.jwtUserId != userId:
             return request_failed(-3, "JWT 验证失败", 401)
         return f(request, *args, **kwargs)
     return decorated_function
@@ -0,0 +1,106 @@
+import uuid
+from django_redis import get_redis_connection
+
+# 可从数据库整体重建的 Redis 哈希或集合，如未读数哈希 unread:{userId}、好友集合 friends:{userId}
+# 键存在即视为完整：增量更新只作用于已存在的键，键不存在时由调用方从数据库整体重建
+# 哈希的字段 "_"、集合的成员 "" 为占位，保证内容为空的键也存在，不会每次都重建
+# 重建在查询数据库之前打开日志列表 {key}:journal，键不存在期间的增量记入日志，改名后按顺序重放，
+# 不会因重建晚于增量而丢失；日志只需覆盖一次重建的耗时
+JOURNAL_TIMEOUT = 60
+HASH_PLACEHOLDER = "_"
+SET_PLACEHOLDER = ""
+
+# 日志中每项为操作、字段、值三个元素：hincr 加上 value 且不低于 0，hset 置为 value，hdel 删除字段，
+# sadd、srem 增删成员 field（value 不使用）
+_APPLY = """
+local function apply(key, op, field, value)
+    if op == 'hincr' then
+        if redis.call('HINCRBY', key, field, value) < 0 then
+            redis.call('HSET', key, field, 0)
+        end
+    elseif op == 'hset' then
+        redis.call('HSET', key, field, value)
+    elseif op == 'hdel' then
+        redis.call('HDEL', key, field)
+    elseif op == 'sadd' then
+        redis.call('SADD', key, field)
+    elseif op == 'srem' then
+        redis.call('SREM', key, field)
+    end
+end
+"""
+
+_UPDATE = _APPLY + """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    apply(KEYS[1], ARGV[1], ARGV[2], ARGV[3])
+elseif redis.call('EXISTS', KEYS[2]) == 1 then
+    redis.call('RPUSH', KEYS[2], ARGV[1], ARGV[2], ARGV[3])
+end
+"""
+
+# 重建结果先分批写入临时键再整体改名，避免大哈希或大集合超出 Lua 的参数上限；改名后重放日志并设置过期时间
+# 期间若已有其他请求完成重建（其已重放日志），保留先写入的键
+_REBUILD = _APPLY + """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('DEL', KEYS[2])
+    return
+end
+redis.call('RENAME', KEYS[2], KEYS[1])
+local journal = redis.call('LRANGE', KEYS[3], 0, -1)
+for i = 1, #journal, 3 do
+    apply(KEYS[1], journal[i], journal[i + 1], journal[i + 2])
+end
+redis.call('DEL', KEYS[3])
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+"""
+
+
+def _journal_key(key: str) -> str:
+    return f"{key}:journal"
+
+
+# 对若干键执行同一增量操作，updates 为 [(key, field, value), ...]，一次往返完成
+def update(op: str, updates) -> None:
+    connection = get_redis_connection("default")
+    command = connection.register_script(_UPDATE)
+    pipeline = connection.pipeline(transaction=False)
+    for key, field, value in updates:
+        command(keys=[key, _journal_key(key)], args=[op, field, value], client=pipeline)
+    pipeline.execute()
+
+
+def _rebuild(key: str, load, write, timeout: int):
+    # 查询数据库之前打开日志；首项为空操作，保证日志列表存在
+    connection = get_redis_connection("default")
+    pipeline = connection.pipeline(transaction=False)
+    pipeline.rpush(_journal_key(key), "", "", "")
+    pipeline.expire(_journal_key(key), JOURNAL_TIMEOUT)
+    pipeline.execute()
+    result = load()
+
+    stagingKey = f"{key}:rebuild:{uuid.uuid4().hex}"
+    pipeline = connection.pipeline(transaction=False)
+    write(pipeline, stagingKey, result)
+    connection.register_script(_REBUILD)(
+        keys=[key, stagingKey, _journal_key(key)], args=[timeout], client=pipeline
+    )
+    pipeline.execute()
+    return result
+
+
+# load 返回 {字段: 值}，写入哈希 key 后原样返回
+def rebuild_hash(key: str, load, timeout: int) -> dict:
+    def write(pipeline, stagingKey, mapping):
+        fields = [(HASH_PLACEHOLDER, 0)] + list(mapping.items())
+        for start in range(0, len(fields), 1_000):
+            pipeline.hset(stagingKey, mapping=dict(fields[start:start + 1_000]))
+    return _rebuild(key, load, write, timeout)
+
+
+# load 返回成员集合，写入集合 key 后原样返回
+def rebuild_set(key: str, load, timeout: int) -> set:
+    def write(pipeline, stagingKey, members):
+        members = [SET_PLACEHOLDER] + list(members)
+        for start in range(0, len(members), 1_000):
+            pipeline.sadd(stagingKey, *members[start:start + 1_000])
+    return _rebuild(key, load, write, timeout)
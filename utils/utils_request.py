@@ -1,8 +1,75 @@
-from django.http import JsonResponse
+import json
+import re
+import secrets
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class RawJSON:
+    # 已编码好的 JSON 片段（如缓存的会话快照），写入响应时原样拼接，不再解码再编码
+    __slots__ = ("encoded",)
+
+    def __init__(self, encoded: bytes):
+        self.encoded = encoded
+
+
+_DJANGO_ENCODER = DjangoJSONEncoder()
+
+
+def _encode(dumps, obj) -> bytes:
+    # 片段先以带随机串的占位字符串编码，再整体替换为原始字节；随机串保证用户内容无法伪造占位符
+    fragments = []
+    nonce = None
+
+    def default(value):
+        nonlocal nonce
+        if isinstance(value, RawJSON):
+            if nonce is None:
+                nonce = secrets.token_hex(8)
+            fragments.append(value.encoded)
+            return f"rawjson:{nonce}:{len(fragments) - 1}"
+        # datetime、Decimal、UUID 等与 JsonResponse 的输出保持一致
+        return _DJANGO_ENCODER.default(value)
+
+    encoded = dumps(obj, default)
+    if fragments:
+        placeholder = re.compile(b'"rawjson:' + nonce.encode() + rb':(\d+)"')
+        encoded = placeholder.sub(lambda match: fragments[int(match[1])], encoded)
+    return encoded
+
+
+def _orjson_dumps(obj, default) -> bytes:
+    return orjson.dumps(obj, default=default, option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS)
+
+
+def _stdlib_dumps(obj, default) -> bytes:
+    return json.dumps(obj, default=default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+ENCODERS = {"json": _stdlib_dumps}
+if orjson is not None:
+    ENCODERS["orjson"] = _orjson_dumps
+
+
+# 按 settings.RESPONSE_JSON_ENCODER 选择编码器，未配置时有 orjson 则用 orjson，否则用标准库
+def dumps(obj) -> bytes:
+    name = getattr(settings, "RESPONSE_JSON_ENCODER", None) or ("orjson" if orjson is not None else "json")
+    return _encode(ENCODERS[name], obj)
+
+
+def json_response(data, status=200) -> HttpResponse:
+    return HttpResponse(dumps(data), content_type="application/json", status=status)
 
 
 def request_failed(code, info, status_code=400):
-    return JsonResponse({
+    return json_response({
         "code": code,
         "info": info
     }, status=status_code)
@@ -10,24 +77,24 @@ def request_failed(code, info, status_code=400):
 
 def request_success(data):
     if  isinstance(data, dict):
-        return JsonResponse({
+        return json_response({
         "code": 0,
         "info": "Succeed",
         **data
         })
     elif isinstance(data, list):
 
-        return JsonResponse({
+        return json_response({
             "code": 0,
             "info": "Succeed",
             "data": data
         })
     else:
-        return JsonResponse({
+        return json_response({
             "code": -1,
             "info": "Invalid data type"
         })
-    
+
 
 
 def return_field(obj_dict, field_list):
@@ -1,7 +1,20 @@
+import json
 from functools import wraps
 
 from utils.utils_request import request_failed
 
+# 装有 orjson 时用它解码请求体，否则退回标准库
+try:
+    import orjson
+
+    def loads(raw: bytes):
+        return orjson.loads(raw)
+    JSONDecodeError = orjson.JSONDecodeError
+except ImportError:
+    def loads(raw: bytes):
+        return json.loads(raw.decode("utf-8"))
+    JSONDecodeError = (json.JSONDecodeError, UnicodeDecodeError)
+
 MAX_CHAR_LENGTH = 255
 
 # A decorator function for processing `require` in view function.
@@ -17,12 +30,88 @@ def CheckRequire(check_fn):
     return decorated
 
 
+class RequestError(KeyError):
+    # 请求参数错误，args 为 (err_msg, err_code)；继承 KeyError 以兼容原先捕获 require 异常的代码
+    pass
+
+
+class RequestErrorMiddleware:
+    # 视图中抛出的 RequestError 统一转为 400 响应
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_exception(self, request, exception):
+        if isinstance(exception, RequestError):
+            return request_failed(exception.args[1], exception.args[0], 400)
+        return None
+
+
+# 请求体只解码一次并缓存在 request 上，装饰器与视图共用；空请求体视为 {}
+def request_body(request) -> dict:
+    body = getattr(request, "_jsonBody", None)
+    if body is None:
+        raw = request.body
+        try:
+            body = loads(raw) if raw else {}
+        except JSONDecodeError:
+            raise RequestError("Invalid JSON body", -2)
+        if not isinstance(body, dict):
+            raise RequestError("Invalid JSON body", -2)
+        request._jsonBody = body
+    return body
+
+
+def _to_int(val):
+    return int(val)
+
+
+def _to_float(val):
+    return float(val)
+
+
+def _to_list(val):
+    if not isinstance(val, list):
+        raise TypeError(val)
+    return val
+
+
+_CONVERTERS = {
+    "int": _to_int,
+    "float": _to_float,
+    "string": str,
+    "list": _to_list,
+}
+
+
+class Schema:
+    # 声明式的请求体字段，在模块导入时编译为 (键, 转换函数, 错误信息) 列表，
+    # parse 按声明顺序返回各字段的值，校验规则与 require 相同
+    def __init__(self, err_code=-2, **fields):
+        self.err_code = err_code
+        self.fields = [
+            (key, _CONVERTERS[type], f"Missing or error type of [{key}]")
+            for key, type in fields.items()
+        ]
+
+    def parse(self, body: dict) -> tuple:
+        values = []
+        for key, convert, err_msg in self.fields:
+            try:
+                values.append(convert(body[key]))
+            except (KeyError, TypeError, ValueError):
+                raise RequestError(err_msg, self.err_code)
+        return tuple(values)
+
+
 # Here err_code == -2 denotes "Error in request body"
 # And err_code == -1 denotes "Error in request URL parsing"
 def require(body, key, type="string", err_msg=None, err_code=-2):
     
     if key not in body.keys():
-        raise KeyError(err_msg if err_msg is not None 
+        raise RequestError(err_msg if err_msg is not None
                        else f"Invalid parameters. Expected `{key}`, but not found.", err_code)
     
     val = body[key]
@@ -35,28 +124,28 @@ def require(body, key, type="string", err_msg=None, err_code=-2):
             val = int(val)
             return val
         except:
-            raise KeyError(err_msg, err_code)
+            raise RequestError(err_msg, err_code)
     
     elif type == "float":
         try:
             val = float(val)
             return val
         except:
-            raise KeyError(err_msg, err_code)
+            raise RequestError(err_msg, err_code)
     
     elif type == "string":
         try:
             val = str(val)
             return val
         except:
-            raise KeyError(err_msg, err_code)
+            raise RequestError(err_msg, err_code)
     
     elif type == "list":
         try:
             assert isinstance(val, list)
             return val
         except:
-            raise KeyError(err_msg, err_code)
+            raise RequestError(err_msg, err_code)
 
     else:
         raise NotImplementedError(f"Type `{type}` not implemented.", err_code)
\ No newline at end of file
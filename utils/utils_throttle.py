@@ -0,0 +1,29 @@
+import time
+from django_redis import get_redis_connection
+
+# 令牌桶保存在 Redis 哈希 throttle:{name} 中，字段 tokens 为剩余令牌数，time 为上次补充的时刻
+# 取令牌与补充在同一个脚本中完成，多个进程并发请求同一个桶时不会超发；桶在补满所需时间后过期
+_TAKE = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'time')
+local tokens = tonumber(state[1]) or capacity
+local last = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - last) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'time', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return allowed
+"""
+
+
+# 从桶中取一个令牌，容量为 capacity，每 interval 秒补充一个；取到返回 True
+def take_token(name: str, capacity: int, interval: float) -> bool:
+    connection = get_redis_connection("default")
+    command = connection.register_script(_TAKE)
+    return bool(command(keys=[f"throttle:{name}"], args=[capacity, 1 / interval, time.time()]))
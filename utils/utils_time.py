@@ -5,4 +5,13 @@ def get_timestamp():
 
 # 将时间戳转换成标准格式
 def timestamp_to_datetime(timestamp:float):
-    return datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
\ No newline at end of file
+    return datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+
+# 以微秒整数表示时间，用于游标等需要精确比较的场景
+def datetime_to_micros(value: datetime.datetime) -> int:
+    delta = value - datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+    return (delta.days * 86_400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+
+def micros_to_datetime(micros: int) -> datetime.datetime:
+    return datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc) + datetime.timedelta(microseconds=micros)